@@ -1,15 +1,25 @@
 # Standard libraries
-import requests
-import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
-import psycopg2
 
 # for env variables
 import os
 from dotenv import load_dotenv, get_key
 load_dotenv()
 
+# shared FPL API client, player transform, table loader and connection pool
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'squad_optimization'))
+import fpl_api
+import fpl_transform
+import fpl_loader
+import fpl_db
+import fpl_profiling
+import fpl_snapshots
+
+# stage timings and memory are logged as one JSON line per stage
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
 # save env variables
 SUPABASE_USER = get_key('.env', 'SUPABASE_USER')
 SUPABASE_HOST = get_key('.env', 'SUPABASE_HOST')
@@ -17,153 +27,59 @@ SUPABASE_PASSWORD = get_key('.env', 'SUPABASE_PASSWORD')
 SUPABASE_PORT = get_key('.env', 'SUPABASE_PORT')
 SUPABASE_DB = get_key('.env', 'SUPABASE_DB')
 
-# FPL API for fixtures
-url = 'https://fantasy.premierleague.com/api/fixtures/'
-response = requests.get(url)
-fixtures_json = response.json()
+# optional number of upcoming fixtures kept per player, 5 when unset
+PLAYER_FIXTURES_COUNT = get_key('.env', 'PLAYER_FIXTURES_COUNT')
 
-# store in pandas DF
-fixtures_df = pd.DataFrame(fixtures_json)
+# optional directory of the local Parquet snapshot store, every run's fixtures are kept there when set
+FPL_SNAPSHOT_STORE = get_key('.env', 'FPL_SNAPSHOT_STORE')
 
-# FPL API for teams
-url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-response = requests.get(url)
-json = response.json()
+# optional table the stage timings of every run are appended to, e.g. pipeline_metrics
+PIPELINE_METRICS_TABLE = get_key('.env', 'PIPELINE_METRICS_TABLE')
 
-# storing json outputs as dataframes
-teams_df = pd.DataFrame(json['teams'])
+# every stage from here on is timed as part of this run
+fpl_profiling.start_run('fpl_fixtures_upload')
 
-# getting team names into fixtures table
-fixtures_df['home_team'] = pd.merge(fixtures_df, teams_df, left_on='team_h', right_on='id', how='left')['name']
-fixtures_df['away_team'] = pd.merge(fixtures_df, teams_df, left_on='team_a', right_on='id', how='left')['name']
+# FPL API for fixtures
+fixtures_json = fpl_api.fetch_fixtures()
 
-# removing unnecessary columns
-fixtures_df = fixtures_df[['id', 'event', 'finished', 'kickoff_time', 'team_a', 'team_a_score', 'team_h', 'team_h_score',
-                           'team_h_difficulty', 'team_a_difficulty', 'home_team', 'away_team']]
+# FPL API for teams, usually already cached by the players scripts
+json = fpl_api.fetch_bootstrap_static()
 
-# convert kickoff time to timestamp
-fixtures_df['kickoff_time'] = pd.to_datetime(fixtures_df['kickoff_time'])
+# fixtures with team names, renamed for the table
+fixtures_df = fpl_transform.transform_fixtures(fixtures_json, json['teams'])
 
-# rename columns
-fixtures_df = fixtures_df.rename(columns={'id': 'match_id', 'event': 'gameweek', 'team_a': 'away_team_id', 'team_h': 'home_team_id'})
+# snapshot of the fixtures, filed under the season and current gameweek
+if FPL_SNAPSHOT_STORE:
+    season, gameweek = fpl_snapshots.snapshot_partition(json)
+    fpl_snapshots.write_snapshot(fixtures_df, 'fixtures', season, gameweek, root=FPL_SNAPSHOT_STORE)
 
 # Load into Supabase
 
-# establish connection
-conn = psycopg2.connect(
-    database=SUPABASE_DB, 
-    user=SUPABASE_USER, 
-    password=SUPABASE_PASSWORD, 
-    host=SUPABASE_HOST, 
-    port=SUPABASE_PORT
-)
-
-# Setting auto commit true
-conn.autocommit = True
-
-# Creating a cursor object using the cursor() method
-cursor = conn.cursor()
-
-# Drop the table before creating it again
-drop_query = 'DROP TABLE IF EXISTS public.dim_fpl_fixtures;'
-cursor.execute(drop_query)
-
-# Create SQL alchemy engine
-engine_url = 'postgresql://' + SUPABASE_USER + ':' + SUPABASE_PASSWORD + '@' + SUPABASE_HOST + '/' + SUPABASE_DB
-engine = create_engine(engine_url)
-
-# Load the table in supabase
-fixtures_df.to_sql(
-    'dim_fpl_fixtures',
-    engine,
-    schema='public',
-    index=False
-)
+# establish connection through the shared connection pool
+engine = fpl_db.get_engine(fpl_db.database_url(SUPABASE_USER, SUPABASE_PASSWORD, SUPABASE_HOST, SUPABASE_PORT, SUPABASE_DB))
+
+# Load the table in supabase, COPY into a staging table swapped in for the old one
+with fpl_profiling.stage('db_load', table='dim_fpl_fixtures'), fpl_db.connection(engine) as conn:
+    fpl_loader.load_frame(conn, fixtures_df, 'dim_fpl_fixtures', schema='public')
 
 print('Main fixtures data uploaded')
 
 ############################## create fixtures table at a player level ##############################
 
-# drop the existing table
-drop_players_fixtures_query = 'DROP TABLE IF EXISTS public.players_fixtures;'
-cursor.execute(drop_players_fixtures_query)
-
-# query that gets next 5 fixtures at player level 
-players_fixtures_query = """with home_fixtures as 
-                            (
-                                select 
-                                    a.id
-                                    ,a.name
-                                    ,'Home' as fixture_home_away
-                                    ,b.away_team as opponent
-                                    ,b.kickoff_time
-                                    ,b.gameweek
-                                    ,b.team_h_difficulty as fixture_difficulty_rating
-                                from 
-                                    public.dim_fpl_players as a
-                                    left join public.dim_fpl_fixtures as b on a.team_name = b.home_team
-                                where
-                                    finished = False
-                            )
-                            
-                            , away_fixtures as 
-                            (
-                                select 
-                                    a.id
-                                    ,a.name
-                                    ,'Away' as fixture_home_away
-                                    ,b.home_team as opponent
-                                    ,b.kickoff_time
-                                    ,b.gameweek
-                                    ,b.team_a_difficulty as fixture_difficulty_rating
-                                    
-                                from 
-                                    public.dim_fpl_players as a
-                                    left join public.dim_fpl_fixtures as b on a.team_name = b.away_team
-                                where
-                                    finished = False
-                            )
-
-                            , final as 
-                            (
-                                select
-                                    *
-                                    ,row_number() over (partition by id order by kickoff_time) as fixture_rank
-                                from
-                                    (
-                                        select * from home_fixtures
-                                        union all
-                                        select * from away_fixtures
-                                    ) as a
-                                order by
-                                    kickoff_time
-                            )
-                            
-                            select
-                                *
-                            from
-                                final
-                            where
-                                fixture_rank <= 5 
-                                and kickoff_time is not null
-                            ;"""
-
-# run and store the query results as a dataframe
-cursor.execute(players_fixtures_query)
-players_fixtures_df = pd.DataFrame(cursor.fetchall(), columns = ['id', 'name', 'fixture_home_away', 'opponent', 'kickoff_time', 
-                                                                 'gameweek', 'fixture_difficulty_rating', 'fixture_rank'])
-
+# next fixtures of every player, built in memory from the payloads above
+players = fpl_transform.transform_players(json)
+players_fixtures_df = fpl_transform.players_fixtures(players, fixtures_df, json['teams'], int(PLAYER_FIXTURES_COUNT or 5))
 
 # Load the table into supabase
-players_fixtures_df.to_sql(
-    'players_fixtures',
-    engine,
-    schema='public',
-    index=False
-)
-
-# close the cursor and connection
-cursor.close()
-conn.close()
+with fpl_profiling.stage('db_load', table='players_fixtures'), fpl_db.connection(engine) as conn:
+    fpl_loader.load_frame(conn, players_fixtures_df, 'players_fixtures', schema='public')
+
+# stage timings of the run, kept for trend analysis
+if PIPELINE_METRICS_TABLE:
+    with fpl_db.connection(engine) as conn:
+        fpl_profiling.write_run_metrics(conn, PIPELINE_METRICS_TABLE)
+
+# close the pooled connections
+fpl_db.dispose_engines()
 
 print('Players fixtures data uploaded')
\ No newline at end of file
@@ -0,0 +1,217 @@
+# Offline benchmarks of the optimizer and the ingest transforms
+#
+# Runs every case on synthetic player pools and on the checked-in payloads in data/, reports the best time and the
+# peak traced memory, and compares each case's result and time with baselines.json. Exits with 1 when a result
+# drifted or a time regressed past the threshold. baselines.json is only written with --update or for new cases.
+#
+#   python run_benchmarks.py                  compare with the baselines
+#   python run_benchmarks.py --update         record new baselines
+#   python run_benchmarks.py --filter squad   only the cases whose name contains "squad"
+
+
+import argparse
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import fpl_optimizer_functions as fpl
+import fpl_transform
+import synthetic
+
+BASELINES_PATH = os.path.join(BENCHMARK_DIR, 'baselines.json')
+DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+
+# player pool sizes and position budgets (in millions) the synthetic cases run at
+POOL_SIZES = [600, 2000, 10000]
+POSITION_BUDGETS = [20, 40]
+
+# a case regresses when its best time is over this many times its baseline, and also over it by this many seconds
+TIME_THRESHOLD = 1.5
+TIME_SLACK = 0.005
+
+
+def fingerprint(result):
+    """
+    Function that returns a short stable digest of a benchmark result (frames, arrays, lists or numbers)
+    """
+    if hasattr(result, 'to_json'):
+        text = result.to_json(orient='split', date_format='iso', double_precision=6)
+    elif isinstance(result, np.ndarray):
+        text = json.dumps(np.round(result.astype(np.float64), 6).tolist())
+    else:
+        text = json.dumps(result, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_pool(size):
+    """
+    Function that returns the synthetic player pool of a size, built once per run (the cases only read it)
+    """
+    return synthetic.synthetic_players(size, seed=size)
+
+
+def position_case(players, position, budget):
+    """
+    Function that returns the arguments of knapsack_solution for one position of a pool at a budget
+    """
+    position_df = players[players['position'] == position]
+    count = fpl.POSITION_COUNTS[position]
+    return position_df.index.tolist(), position_df['now_cost'].tolist(), position_df['total_points'].tolist(), budget * 10, count
+
+
+def benchmark_cases():
+    """
+    Function that returns the benchmark cases as (name, setup, run) where run(setup()) is timed
+    """
+    cases = []
+
+    for size in POOL_SIZES:
+        pool = functools.partial(synthetic_pool, size)
+
+        for budget in POSITION_BUDGETS:
+            def knapsack_setup(size=size, budget=budget, pool=pool):
+                return position_case(pool(), 'Midfielder', budget)
+
+            def knapsack_run(args):
+                return fpl.knapsack_solution(*args)[-1]
+
+            def used_items_setup(size=size, budget=budget, pool=pool):
+                args = position_case(pool(), 'Midfielder', budget)
+                return args + (fpl.knapsack_solution(*args),)
+
+            def used_items_run(args):
+                return fpl.get_used_items(*args)
+
+            cases.append(('knapsack_solution/{}/{}m'.format(size, budget), knapsack_setup, knapsack_run))
+            cases.append(('get_used_items/{}/{}m'.format(size, budget), used_items_setup, used_items_run))
+
+        for name, optimum, budget in [('optimum_keepers', fpl.optimum_keepers, 10), ('optimum_defence', fpl.optimum_defence, 25),
+                                      ('optimum_midfield', fpl.optimum_midfield, 40), ('optimum_attack', fpl.optimum_attack, 25)]:
+            cases.append(('{}/{}'.format(name, size), pool,
+                          lambda players, optimum=optimum, budget=budget: optimum(players, budget, 'total_points')))
+
+        cases.append(('best_cost_breakdown/{}'.format(size), pool,
+                      lambda players: fpl.best_cost_breakdown(players, 'total_points')))
+        cases.append(('squad_optimizer/{}'.format(size), pool,
+                      lambda players: fpl.squad_optimizer(players, 'total_points')))
+        cases.append(('squad_optimizer_convolution/{}'.format(size), pool,
+                      lambda players: fpl.squad_optimizer(players, 'total_points', split_search='convolution')))
+        cases.append(('joint_squad_optimizer/{}'.format(size), pool,
+                      lambda players: fpl.joint_squad_optimizer(players, 'total_points')))
+
+    def recorded():
+        return (synthetic.read_payload(os.path.join(DATA_DIR, 'bootstrap_static.json.gz')),
+                synthetic.read_payload(os.path.join(DATA_DIR, 'fixtures.json.gz')))
+
+    def recorded_tables():
+        bootstrap, fixtures_json = recorded()
+        return (fpl_transform.transform_players(bootstrap), fpl_transform.transform_fixtures(fixtures_json, bootstrap['teams']),
+                bootstrap['teams'])
+
+    def recorded_eligible():
+        players, fixtures, teams = recorded_tables()
+        players = players.join(fpl_transform.projected_points(players, fixtures, teams))
+        return players[players['news'] == ''].reset_index(drop=True)
+
+    cases += [
+        ('transform_players/recorded', recorded, lambda payloads: fpl_transform.transform_players(payloads[0])),
+        ('transform_players/10000', lambda: synthetic.synthetic_bootstrap_static(10000, seed=10000),
+         fpl_transform.transform_players),
+        ('transform_fixtures/recorded', recorded, lambda payloads: fpl_transform.transform_fixtures(payloads[1], payloads[0]['teams'])),
+        ('players_fixtures/recorded', recorded_tables, lambda tables: fpl_transform.players_fixtures(*tables)),
+        ('projected_points/recorded', recorded_tables, lambda tables: fpl_transform.projected_points(*tables)),
+        ('squad_optimizer/recorded', recorded_eligible, lambda players: fpl.squad_optimizer(players, 'total_points')),
+        ('squad_optimizer_many/recorded', recorded_eligible,
+         lambda players: fpl.squad_optimizer_many(players, ['total_points', 'form', 'ict_index', 'projected_points_h5'])),
+        ('robust_squad_optimizer/recorded', recorded_eligible,
+         lambda players: fpl.robust_squad_optimizer(players, 'projected_points_h5', 'cvar', 10000, team_correlation=0.2)),
+        ('lineup_optimizer/recorded', recorded_eligible, lambda players: fpl.lineup_optimizer(players, 'projected_points_h5')),
+    ]
+
+    return cases
+
+
+def run_case(setup, run, repeats):
+    """
+    Function that returns a case's result, best time over repeats and peak traced memory (bytes) of one run
+    """
+    args = setup()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run(args)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run(args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, min(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the FPL optimizer and transforms')
+    parser.add_argument('--update', action='store_true', help='record the results and times as the new baselines')
+    parser.add_argument('--filter', default='', help='only run the cases whose name contains this')
+    parser.add_argument('--repeats', type=int, default=3, help='timed runs per case, the best one counts')
+    parser.add_argument('--threshold', type=float, default=TIME_THRESHOLD, help='allowed slowdown over the baseline time')
+    parser.add_argument('--no-timing', action='store_true', help='only check results, e.g. on a different machine')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            baselines = json.load(f)
+
+    failures = []
+    recorded = False
+    print('{:<40} {:>10} {:>12}  {}'.format('case', 'time (s)', 'peak (MiB)', 'status'))
+
+    for name, setup, run in benchmark_cases():
+        if args.filter not in name:
+            continue
+
+        # the largest pools take a while, so a single timed run is enough there
+        result, seconds, peak = run_case(setup, run, 1 if '10000' in name else args.repeats)
+        digest = fingerprint(result)
+        baseline = baselines.get(name)
+
+        if args.update or baseline is None:
+            baselines[name] = {'result': digest, 'seconds': round(seconds, 4), 'peak_bytes': peak}
+            status = 'recorded'
+            recorded = True
+        elif digest != baseline['result']:
+            status = 'FAIL result drifted'
+        elif not args.no_timing and seconds > baseline['seconds'] * args.threshold and seconds > baseline['seconds'] + TIME_SLACK:
+            status = 'FAIL {:.1f}x slower than {:.4f}s'.format(seconds / baseline['seconds'], baseline['seconds'])
+        else:
+            status = 'ok ({:.2f}x)'.format(seconds / baseline['seconds']) if baseline['seconds'] > 0 else 'ok'
+
+        if status.startswith('FAIL'):
+            failures.append(name)
+        print('{:<40} {:>10.4f} {:>12.1f}  {}'.format(name, seconds, peak / 2**20, status), flush=True)
+
+    # a plain comparison run leaves the baselines untouched
+    if recorded:
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if failures:
+        print('{} benchmark(s) failed: {}'.format(len(failures), ', '.join(failures)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
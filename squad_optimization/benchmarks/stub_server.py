@@ -0,0 +1,214 @@
+# Local stand-in for the FPL API that serves the recorded payloads in data/, with injected latency and errors
+#
+# An endpoint is served from the file named after it, e.g. bootstrap-static/ from data/bootstrap_static.json.gz.
+# element-summary/<id>/ without a recorded file is made up from that player in bootstrap_static.json.gz.
+# Answers carry an ETag and honour If-None-Match, so the client's cache revalidation works as against the real API.
+#
+#   python stub_server.py --port 8765                              serve until interrupted
+#   python stub_server.py --latency 0.2 --jitter 0.3 --error-rate 0.1 --rate-limit 50
+#
+# then point the scripts at it with FPL_API_URL=http://127.0.0.1:8765/api/
+
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import synthetic
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# path prefix of the endpoints, as on the real API
+API_PREFIX = '/api/'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler that answers GETs from the server's payloads after the injected delay, or with an injected error
+    """
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            delay = server.latency + server.rng.uniform(0, server.jitter)
+            fail = server.rng.random() < server.error_rate
+            limited = server.over_rate_limit()
+            server.stats['requests'] += 1
+        time.sleep(delay)
+
+        if limited:
+            server.count('rate_limited')
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if fail:
+            server.count('errors')
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = server.payload(self.path)
+        if body is None:
+            server.count('not_found')
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        # payloads are kept gzipped and sent as they are to clients that accept it
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            encoding = 'gzip'
+        else:
+            encoding, body = None, gzip.decompress(body)
+
+        server.count('ok')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request would drown the load test's own output
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the payloads, the injected latency, error rate and rate limit and counts of what it answered
+    """
+    daemon_threads = True
+
+    def __init__(self, address, data_dir=DATA_DIR, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, rate_limit=0):
+        super().__init__(address, StubHandler)
+        self.data_dir = data_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'not_modified': 0, 'errors': 0, 'rate_limited': 0, 'not_found': 0}
+        self._payloads = {}
+        self._recent = deque()
+        self._elements = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}{}'.format(self.server_address[0], self.server_address[1], API_PREFIX)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def over_rate_limit(self):
+        """
+        Function that returns whether a request now goes over rate_limit requests in the last second, called under the lock
+        """
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1:
+            self._recent.popleft()
+        if len(self._recent) >= self.rate_limit:
+            return True
+        self._recent.append(now)
+        return False
+
+    def payload(self, path):
+        """
+        Function that returns the gzipped body of a request path, None when there is no recorded payload for it
+        """
+        path = path.split('?')[0]
+        if not path.startswith(API_PREFIX):
+            return None
+        name = path[len(API_PREFIX):].strip('/').replace('-', '_').replace('/', '_')
+
+        if name not in self._payloads:
+            file_path = os.path.join(self.data_dir, name + '.json.gz')
+            if os.path.exists(file_path):
+                with open(file_path, 'rb') as f:
+                    self._payloads[name] = f.read()
+            elif name.startswith('element_summary_'):
+                summary = self.element_summary(name[len('element_summary_'):])
+                if summary is None:
+                    return None
+                self._payloads[name] = gzip.compress(json.dumps(summary).encode(), mtime=0)
+            else:
+                return None
+        return self._payloads[name]
+
+    def element_summary(self, player_id):
+        """
+        Function that returns a made-up element-summary payload of a player in the recorded bootstrap-static
+        """
+        with self.lock:
+            if self._elements is None:
+                bootstrap = synthetic.read_payload(os.path.join(self.data_dir, 'bootstrap_static.json.gz'))
+                finished = [event['id'] for event in bootstrap.get('events', []) if event['finished']]
+                self._finished_gameweeks = max(finished, default=0)
+                self._elements = {str(element['id']): element for element in bootstrap['elements']}
+
+        if player_id not in self._elements:
+            return None
+        return synthetic.synthetic_element_summary(self._elements[player_id], self._finished_gameweeks)
+
+
+def start_stub_server(data_dir=DATA_DIR, port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, rate_limit=0):
+    """
+    Function that returns a StubServer answering on localhost (a free port unless one is given) from a background thread
+
+    Stop it with server.shutdown() and server.server_close()
+    """
+    server = StubServer(('127.0.0.1', port), data_dir, latency, jitter, error_rate, seed, rate_limit)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the FPL API serving recorded payloads')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory of the recorded <endpoint>.json.gz payloads')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every answer is delayed by')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds of random delay')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 503')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per second answered before 429s, 0 for no limit')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), args.data_dir, args.latency, args.jitter, args.error_rate, args.seed,
+                        args.rate_limit)
+    print('serving {} on {}'.format(args.data_dir, server.base_url), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# Synthetic FPL data for the benchmarks: player pools of any size and bootstrap-static/fixtures payloads
+# shaped like the API's. Everything is seeded, so the same arguments always give the same data
+
+
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+
+TEAMS = ['Arsenal', 'Aston Villa', 'Bournemouth', 'Brentford', 'Brighton', 'Chelsea', 'Crystal Palace', 'Everton',
+         'Fulham', 'Ipswich', 'Leicester', 'Liverpool', 'Man City', 'Man Utd', 'Newcastle', "Nott'm Forest",
+         'Southampton', 'Spurs', 'West Ham', 'Wolves']
+
+POSITIONS = ['Goalkeeper', 'Defender', 'Midfielder', 'Forward']
+
+# share of each position in a real player list
+POSITION_SHARES = [0.11, 0.33, 0.40, 0.16]
+
+
+def synthetic_elements(num_players, seed=0):
+    """
+    Function that returns bootstrap-static style elements, with points that grow with price like the real ones
+    """
+    rng = np.random.default_rng(seed)
+    element_types = rng.choice(4, num_players, p=POSITION_SHARES) + 1
+    now_cost = rng.integers(40, 131, num_players)
+    minutes = rng.integers(0, 3421, num_players)
+    games = np.maximum(minutes / 90, 1e-9)
+    total_points = np.maximum(0, (now_cost - 35) * minutes / 900 + rng.normal(0, 12, num_players)).astype(int)
+    goals = rng.poisson(now_cost / 40 * minutes / 1500)
+    assists = rng.poisson(now_cost / 50 * minutes / 1500)
+
+    elements = []
+    for i in range(num_players):
+        elements.append({
+            'id': i + 1,
+            'first_name': 'First{}'.format(i + 1),
+            'second_name': 'Second{}'.format(i + 1),
+            'web_name': 'Player{}'.format(i + 1),
+            'team': int(rng.integers(1, len(TEAMS) + 1)),
+            'element_type': int(element_types[i]),
+            'news': '' if rng.random() < 0.85 else 'Knee injury - 75% chance of playing',
+            'selected_by_percent': '{:.1f}'.format(rng.random() * 40),
+            'in_dreamteam': bool(rng.random() < 0.03),
+            'now_cost': int(now_cost[i]),
+            'form': '{:.1f}'.format(total_points[i] / max(games[i], 1) * rng.uniform(0.5, 1.5)),
+            'points_per_game': '{:.1f}'.format(total_points[i] / max(games[i], 1)),
+            'minutes': int(minutes[i]),
+            'goals_scored': int(goals[i]),
+            'assists': int(assists[i]),
+            'clean_sheets': int(rng.integers(0, 15)),
+            'goals_conceded': int(rng.integers(0, 60)),
+            'yellow_cards': int(rng.integers(0, 10)),
+            'red_cards': int(rng.integers(0, 2)),
+            'saves': int(rng.integers(0, 120)) if element_types[i] == 1 else 0,
+            'bonus': int(rng.integers(0, 30)),
+            'transfers_in': int(rng.integers(0, 5000000)),
+            'starts': int(minutes[i] // 90),
+            'value_season': '{:.1f}'.format(total_points[i] / now_cost[i] * 10),
+            'total_points': int(total_points[i]),
+            'influence': '{:.1f}'.format(rng.random() * 1000),
+            'creativity': '{:.1f}'.format(rng.random() * 1000),
+            'threat': '{:.1f}'.format(rng.random() * 1000),
+            'ict_index': '{:.1f}'.format(rng.random() * 300),
+        })
+    return elements
+
+
+def synthetic_events(num_gameweeks=38, finished_gameweeks=10):
+    """
+    Function that returns bootstrap-static style gameweeks (events), the last finished one being the current one
+    """
+    start = pd.Timestamp('2026-08-15T10:30:00Z')
+    return [{
+        'id': gameweek,
+        'name': 'Gameweek {}'.format(gameweek),
+        'deadline_time': (start + pd.Timedelta(days=7 * (gameweek - 1))).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'finished': gameweek <= finished_gameweeks,
+        'is_current': gameweek == finished_gameweeks,
+        'is_next': gameweek == finished_gameweeks + 1,
+    } for gameweek in range(1, num_gameweeks + 1)]
+
+
+def synthetic_bootstrap_static(num_players, seed=0):
+    """
+    Function that returns a bootstrap-static style payload (elements, element_types, teams, events)
+    """
+    return {
+        'events': synthetic_events(),
+        'elements': synthetic_elements(num_players, seed),
+        'element_types': [{'id': i + 1, 'singular_name': name, 'plural_name': name + 's'} for i, name in enumerate(POSITIONS)],
+        'teams': [{'id': i + 1, 'name': name, 'short_name': name[:3].upper()} for i, name in enumerate(TEAMS)],
+    }
+
+
+def synthetic_fixtures(num_gameweeks=38, finished_gameweeks=10, seed=0):
+    """
+    Function that returns a fixtures style payload: a season of random pairings with one postponed fixture,
+    one blank and one double gameweek for the first team
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2026-08-15T14:00:00Z')
+    fixtures = []
+
+    for gameweek in range(1, num_gameweeks + 1):
+        teams = rng.permutation(len(TEAMS)) + 1
+        for match in range(len(TEAMS) // 2):
+            home, away = int(teams[2 * match]), int(teams[2 * match + 1])
+            kickoff = start + pd.Timedelta(days=7 * (gameweek - 1), hours=int(rng.integers(0, 50)))
+            fixtures.append({
+                'id': len(fixtures) + 1,
+                'event': gameweek,
+                'finished': gameweek <= finished_gameweeks,
+                'kickoff_time': kickoff.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'team_a': away,
+                'team_a_score': int(rng.integers(0, 4)) if gameweek <= finished_gameweeks else None,
+                'team_h': home,
+                'team_h_score': int(rng.integers(0, 4)) if gameweek <= finished_gameweeks else None,
+                'team_h_difficulty': int(rng.integers(2, 6)),
+                'team_a_difficulty': int(rng.integers(2, 6)),
+            })
+
+    # team 1 blanks in the first unfinished gameweek and plays twice in the next one
+    blank = [f for f in fixtures if f['event'] == finished_gameweeks + 1 and 1 in (f['team_h'], f['team_a'])][0]
+    blank['event'] = finished_gameweeks + 2
+    # a postponed fixture has no gameweek and no kickoff
+    postponed = [f for f in fixtures if f['event'] == finished_gameweeks + 3][0]
+    postponed['event'] = None
+    postponed['kickoff_time'] = None
+
+    return fixtures
+
+
+def synthetic_element_summary(element, finished_gameweeks=10):
+    """
+    Function that returns an element-summary style payload for a bootstrap-static element: one history row per
+    finished gameweek, with the element's minutes and points spread over them
+    """
+    rng = np.random.default_rng(element['id'])
+    minutes = rng.multinomial(element['minutes'], np.full(finished_gameweeks, 1 / finished_gameweeks))
+    minutes = np.minimum(minutes, 90)
+    points_per_game = float(element['points_per_game'])
+
+    history = []
+    for gameweek in range(1, finished_gameweeks + 1):
+        played = minutes[gameweek - 1] > 0
+        points = max(-2, int(round(rng.normal(points_per_game, 2)))) if played else 0
+        goals = int(rng.poisson(0.2)) if played else 0
+        history.append({
+            'element': element['id'],
+            'fixture': (gameweek - 1) * len(TEAMS) // 2 + int(rng.integers(1, len(TEAMS) // 2 + 1)),
+            'opponent_team': int(rng.integers(1, len(TEAMS) + 1)),
+            'total_points': points,
+            'was_home': bool(rng.random() < 0.5),
+            'kickoff_time': (pd.Timestamp('2026-08-15T14:00:00Z') + pd.Timedelta(days=7 * (gameweek - 1))).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'round': gameweek,
+            'minutes': int(minutes[gameweek - 1]),
+            'goals_scored': goals,
+            'assists': int(rng.poisson(0.15)) if played else 0,
+            'clean_sheets': int(played and rng.random() < 0.3),
+            'goals_conceded': int(rng.poisson(1.2)) if played else 0,
+            'bonus': int(rng.integers(0, 4)) if played and points > 6 else 0,
+            'bps': int(rng.integers(0, 40)) if played else 0,
+            'influence': '{:.1f}'.format(rng.random() * 60 if played else 0),
+            'creativity': '{:.1f}'.format(rng.random() * 60 if played else 0),
+            'threat': '{:.1f}'.format(rng.random() * 60 if played else 0),
+            'ict_index': '{:.1f}'.format(rng.random() * 18 if played else 0),
+            'value': element['now_cost'],
+            'selected': int(rng.integers(0, 2000000)),
+        })
+    return {'fixtures': [], 'history': history, 'history_past': []}
+
+
+def synthetic_season(num_players, num_gameweeks=38, seed=0):
+    """
+    Function that returns the players after every gameweek of a season as one frame with a gameweek column,
+    in the shape of the cleaned players table (latest snapshot per gameweek of the snapshot store)
+
+    Each player has a steady scoring rate that grows with price, gameweek points and minutes are drawn around
+    it and the season stats (total_points, form, points_per_game, ...) accumulate from them
+    """
+    # imported here so the payload helpers work without the package on the path
+    import fpl_transform
+    rng = np.random.default_rng(seed)
+    bootstrap = synthetic_bootstrap_static(num_players, seed)
+    elements = bootstrap['elements']
+
+    now_cost = np.array([element['now_cost'] for element in elements])
+    rate = np.maximum(0.5, (now_cost - 35) / 15 * rng.lognormal(0, 0.35, num_players))
+    plays = rng.uniform(0.4, 1, num_players)
+
+    totals = np.zeros(num_players, dtype=np.int64)
+    minutes = np.zeros(num_players, dtype=np.int64)
+    appearances = np.zeros(num_players, dtype=np.int64)
+    recent = []
+    seasons = []
+
+    for gameweek in range(1, num_gameweeks + 1):
+        played = rng.random(num_players) < plays
+        points = np.where(played, rng.poisson(rate), 0)
+        totals += points
+        minutes += np.where(played, rng.integers(30, 91, num_players), 0)
+        appearances += played
+        recent = (recent + [points])[-4:]
+        form = np.mean(recent, axis=0)
+        injured = rng.random(num_players) < 0.08
+
+        for i, element in enumerate(elements):
+            element.update({
+                'total_points': int(totals[i]),
+                'minutes': int(minutes[i]),
+                'starts': int(appearances[i]),
+                'form': '{:.1f}'.format(form[i]),
+                'points_per_game': '{:.1f}'.format(totals[i] / max(appearances[i], 1)),
+                'value_season': '{:.1f}'.format(totals[i] / now_cost[i] * 10),
+                'news': 'Knee injury - 75% chance of playing' if injured[i] else '',
+            })
+
+        players = fpl_transform.transform_players(bootstrap)
+        players['gameweek'] = gameweek
+        seasons.append(players)
+
+    return pd.concat(seasons, ignore_index=True)
+
+
+def synthetic_players(num_players, seed=0):
+    """
+    Function that returns a player pool in the shape of the cleaned players table, without the injured players
+    """
+    # imported here so the payload helpers work without the package on the path
+    import fpl_transform
+    players = fpl_transform.transform_players(synthetic_bootstrap_static(num_players, seed))
+    return players[players['news'] == ''].reset_index(drop=True)
+
+
+def write_payload(path, payload):
+    """
+    Function that writes a payload as gzipped JSON
+    """
+    # no timestamp in the gzip header, so regenerating gives the same bytes
+    with open(path, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+        f.write(json.dumps(payload).encode())
+
+
+def read_payload(path):
+    """
+    Function that reads a gzipped JSON payload
+    """
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    # regenerates the checked-in payloads
+    import os
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    write_payload(os.path.join(data_dir, 'bootstrap_static.json.gz'), synthetic_bootstrap_static(720, seed=2026))
+    write_payload(os.path.join(data_dir, 'fixtures.json.gz'), synthetic_fixtures(seed=2026))
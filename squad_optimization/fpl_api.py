@@ -0,0 +1,147 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
+import os
+import time
+import hashlib
+import tempfile
+import logging
+
+import fpl_profiling
+
+logger = logging.getLogger(__name__)
+
+# base URL of the FPL API, FPL_API_URL points the fetches somewhere else (e.g. a local stub server)
+FPL_API_URL = os.environ.get('FPL_API_URL', 'https://fantasy.premierleague.com/api/')
+
+# cached payloads younger than this many seconds are used without asking the server
+FPL_CACHE_TTL = int(os.environ.get('FPL_CACHE_TTL', 600))
+
+# directory of the cached payloads, shared by every script on the machine
+FPL_CACHE_DIR = os.environ.get('FPL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'fpl_http_cache'))
+
+# seconds to wait for the server to connect and to answer
+FPL_TIMEOUT = (5, 30)
+
+# one pooled session per process, made by fpl_session
+_session = None
+
+
+def fpl_session():
+    """
+    Function that returns the pooled session the fetches share, retrying connection errors and 5xx answers
+    """
+    global _session
+    if _session is None:
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET'])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        _session = requests.Session()
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+        _session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Accept': 'application/json'})
+    return _session
+
+
+def cache_paths(cache_dir, url):
+    """
+    Function that returns the files the body and the headers of a cached payload are kept in
+    """
+    name = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(cache_dir, name + '.json'), os.path.join(cache_dir, name + '.meta.json')
+
+
+def write_atomic(path, data):
+    """
+    Function that writes bytes under a temporary name first so readers never see half a file
+    """
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def fetch_json(endpoint, cache_dir=None, ttl=None, base_url=None):
+    """
+    Function that returns the parsed JSON of an FPL API endpoint, e.g. 'bootstrap-static/'
+
+    A cached payload younger than ttl seconds is returned as is. An older one is revalidated with its ETag and
+    Last-Modified headers, and a 304 answer keeps it for another ttl seconds. cache_dir=False skips the cache.
+    Getting the body and parsing it are recorded as separate pipeline stages
+    """
+    cache_dir = FPL_CACHE_DIR if cache_dir is None else cache_dir
+    ttl = FPL_CACHE_TTL if ttl is None else ttl
+    url = (FPL_API_URL if base_url is None else base_url) + endpoint
+
+    with fpl_profiling.stage('api_fetch', endpoint=endpoint) as details:
+        body = fetch_body(url, cache_dir, ttl)
+        details['bytes'] = len(body)
+
+    with fpl_profiling.stage('json_parse', endpoint=endpoint):
+        return json.loads(body)
+
+
+def fetch_body(url, cache_dir, ttl):
+    """
+    Function that returns the raw body of a URL, from the cache of fetch_json when it is still fresh or not modified
+    """
+    if cache_dir is False:
+        response = fpl_session().get(url, timeout=FPL_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, meta_path = cache_paths(cache_dir, url)
+
+    meta = None
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+
+    if meta is not None and time.time() - meta['fetched_at'] < ttl:
+        logger.info('%s: cached %.0fs ago', url, time.time() - meta['fetched_at'])
+        with open(body_path, 'rb') as f:
+            return f.read()
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    start = time.perf_counter()
+    response = fpl_session().get(url, headers=headers, timeout=FPL_TIMEOUT)
+
+    if response.status_code == 304 and meta is not None:
+        logger.info('%s: not modified (%.2fs)', url, time.perf_counter() - start)
+        meta['fetched_at'] = time.time()
+        write_atomic(meta_path, json.dumps(meta).encode())
+        with open(body_path, 'rb') as f:
+            return f.read()
+
+    response.raise_for_status()
+    logger.info('%s: downloaded %d bytes (%.2fs)', url, len(response.content), time.perf_counter() - start)
+
+    # the body goes first, so the headers never describe a body that is not there yet
+    write_atomic(body_path, response.content)
+    write_atomic(meta_path, json.dumps({
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.time(),
+    }).encode())
+
+    return response.content
+
+
+def fetch_bootstrap_static(**kwargs):
+    """
+    Function that returns the bootstrap-static payload: players (elements), positions (element_types), teams and gameweeks
+    """
+    return fetch_json('bootstrap-static/', **kwargs)
+
+
+def fetch_fixtures(**kwargs):
+    """
+    Function that returns the fixtures payload
+    """
+    return fetch_json('fixtures/', **kwargs)
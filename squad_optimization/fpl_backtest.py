@@ -0,0 +1,186 @@
+import os
+import argparse
+import time
+import logging
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import fpl_optimizer_functions as fpl
+import fpl_profiling
+import fpl_snapshots
+
+logger = logging.getLogger(__name__)
+
+# metrics of the optimizer upload that are known at every past gameweek, projected points need past fixtures
+BACKTEST_METRICS = ['points_per_game', 'bonus', 'total_points', 'ict_index', 'points_per_million', 'form']
+
+# a backtest strategy: the metric the squad is optimized for, the solver of squad_optimizer_many ('joint',
+# 'breakdown' or 'convolution') and the number of gameweeks a squad is kept before it is picked again
+Strategy = collections.namedtuple('Strategy', ['metric', 'solver', 'horizon'])
+
+# columns identifying a player in the squads the optimizers return, which carry no id
+SQUAD_KEY = ['first_name', 'second_name', 'team_name']
+
+
+def strategy_name(strategy):
+    """
+    Function that returns the label of a strategy in the backtest results, e.g. form/joint/h1
+    """
+    return '{}/{}/h{}'.format(strategy.metric, strategy.solver, strategy.horizon)
+
+
+def pick_gameweeks(gameweeks, horizon):
+    """
+    Function that returns the gameweeks a strategy picks a squad after: the first one and every horizon-th after it,
+    as long as there is a later gameweek to score the squad on
+    """
+    return list(gameweeks[:-1:horizon])
+
+
+def cumulative_points(snapshots):
+    """
+    Function that returns the season total_points of every player (rows, by id) after every gameweek (columns)
+
+    A player missing from a gameweek's snapshot keeps their last total, so they score nothing in that gameweek
+    """
+    totals = snapshots.pivot_table(index='id', columns='gameweek', values='total_points', aggfunc='last')
+    return totals.sort_index(axis=1).ffill(axis=1).fillna(0)
+
+
+def squad_ids(players, squad):
+    """
+    Function that returns the ids of a squad frame's players, matched back to the pool it was picked from
+    """
+    return squad[SQUAD_KEY].merge(players[SQUAD_KEY + ['id']].drop_duplicates(SQUAD_KEY), on=SQUAD_KEY, how='left')['id'].tolist()
+
+
+# snapshots of a worker process, set once by init_backtest_worker
+_worker_snapshots = None
+
+
+def init_backtest_worker(snapshots):
+    """
+    Function that keeps the snapshots in a worker process so tasks only carry the gameweek, solver and metrics
+    """
+    global _worker_snapshots
+    _worker_snapshots = snapshots
+
+
+def pick_squads(snapshots, gameweek, solver, metrics):
+    """
+    Function that returns the squad ids each metric's optimizer picks from the eligible players after a gameweek
+    """
+    players = snapshots[(snapshots['gameweek'] == gameweek) & (snapshots['news'] == '')].reset_index(drop=True)
+    squads = fpl.squad_optimizer_many(players, metrics, solver)
+    return {metric: squad_ids(players, squads[metric]) for metric in metrics}
+
+
+def pick_squads_in_worker(gameweek, solver, metrics):
+    """
+    Function that returns pick_squads over the worker's snapshots with the task's key, and how much the worker's
+    OPTIMIZER_STATS grew
+    """
+    stats_before = dict(fpl.OPTIMIZER_STATS)
+    squads = pick_squads(_worker_snapshots, gameweek, solver, metrics)
+    return (gameweek, solver), squads, {stat: fpl.OPTIMIZER_STATS[stat] - stats_before[stat] for stat in fpl.OPTIMIZER_STATS}
+
+
+@fpl_profiling.timed(counters=fpl.OPTIMIZER_STATS)
+def backtest(snapshots, strategies, max_workers=None):
+    """
+    Function that replays strategies over a season of player snapshots and returns the points each one scored,
+    one row per strategy and gameweek with the gameweek's points and the cumulative points so far
+
+    snapshots holds the players after every gameweek with a gameweek column, e.g. the latest snapshot per gameweek
+    of fpl_snapshots.read_snapshot_frame('players', latest_per_gameweek=True) renamed from snapshot_gameweek.
+    A strategy picks its squad from the players without news after a gameweek, keeps it for horizon gameweeks
+    and scores the total_points its players gained meanwhile. The squads of all strategies sharing a gameweek
+    and solver are picked in one squad_optimizer_many call, and those calls are spread over a process pool
+    """
+    strategies = [Strategy(*strategy) for strategy in strategies]
+    gameweeks = sorted(int(gameweek) for gameweek in snapshots['gameweek'].unique())
+    totals = cumulative_points(snapshots)
+
+    # every (gameweek, solver) with the metrics picked after it
+    tasks = {}
+    for strategy in strategies:
+        for gameweek in pick_gameweeks(gameweeks, strategy.horizon):
+            tasks.setdefault((gameweek, strategy.solver), [])
+            if strategy.metric not in tasks[(gameweek, strategy.solver)]:
+                tasks[(gameweek, strategy.solver)].append(strategy.metric)
+
+    start = time.perf_counter()
+    keys = list(tasks)
+    if max_workers == 1:
+        picks = {key: pick_squads(snapshots, key[0], key[1], tasks[key]) for key in keys}
+    else:
+        picks = {}
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_backtest_worker, initargs=(snapshots,)) as executor:
+            results = executor.map(pick_squads_in_worker, [key[0] for key in keys], [key[1] for key in keys], [tasks[key] for key in keys])
+            # the workers' knapsack cells and splits count towards this process's totals
+            for key, squads, stats in results:
+                picks[key] = squads
+                for stat, value in stats.items():
+                    fpl.OPTIMIZER_STATS[stat] += value
+    logger.info('backtest picked %d squads for %d strategies over %d gameweeks in %.2fs',
+                sum(len(metrics) for metrics in tasks.values()), len(strategies), len(gameweeks), time.perf_counter() - start)
+
+    # points every player scored in every gameweek after the first
+    gameweek_points = totals.diff(axis=1).iloc[:, 1:]
+
+    rows = []
+    for strategy in strategies:
+        cumulative = 0.0
+        for i, gameweek in enumerate(gameweeks[1:]):
+            # the squad of the strategy's last pick, made after the previous gameweek or up to horizon - 1 gameweeks before it
+            squad = picks[(gameweeks[i - i % strategy.horizon], strategy.solver)][strategy.metric]
+            points = float(gameweek_points.loc[squad, gameweek].sum())
+            cumulative += points
+            rows.append((strategy_name(strategy), strategy.metric, strategy.solver, strategy.horizon, gameweek, points, cumulative))
+
+    return pd.DataFrame(rows, columns=['strategy', 'metric', 'solver', 'horizon', 'gameweek', 'points', 'cumulative_points'])
+
+
+def backtest_summary(results):
+    """
+    Function that returns the season total of every strategy of backtest, best first
+    """
+    return (results.groupby('strategy', sort=False)['cumulative_points'].last()
+            .sort_values(ascending=False, kind='stable').rename('season_points').reset_index())
+
+
+def season_snapshots(season=None, root=None):
+    """
+    Function that returns the latest players snapshot of every gameweek in the store, with a gameweek column
+    """
+    snapshots = fpl_snapshots.read_snapshot_frame('players', season=season, latest_per_gameweek=True, root=root)
+    if len(snapshots) == 0:
+        raise ValueError('no players snapshots in {}'.format(root or fpl_snapshots.FPL_SNAPSHOT_STORE))
+    if season is None:
+        snapshots = snapshots[snapshots['snapshot_season'] == snapshots['snapshot_season'].max()]
+    return snapshots.rename(columns={'snapshot_gameweek': 'gameweek'}).drop(columns=['snapshot_season', 'snapshot_at'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backtest optimizer strategies over the players snapshots of a season')
+    parser.add_argument('--season', help='season of the snapshots, e.g. 2026-27, the latest one by default')
+    parser.add_argument('--store', default=fpl_snapshots.FPL_SNAPSHOT_STORE, help='root of the snapshot store')
+    parser.add_argument('--metrics', nargs='+', default=BACKTEST_METRICS)
+    parser.add_argument('--solvers', nargs='+', default=['joint'], choices=['joint', 'breakdown', 'convolution'])
+    parser.add_argument('--horizons', nargs='+', type=int, default=[1], help='gameweeks a squad is kept for')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes, 1 to run in this process')
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error('no snapshot store, set FPL_SNAPSHOT_STORE or pass --store')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
+    strategies = [Strategy(metric, solver, horizon) for metric in args.metrics for solver in args.solvers for horizon in args.horizons]
+    results = backtest(season_snapshots(args.season, args.store), strategies, args.workers)
+    print(backtest_summary(results).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import logging
+import contextlib
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger(__name__)
+
+# pool settings, the environment variables override the defaults for every script
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+
+# seconds to wait for a free pooled connection, for the server to accept one and for a statement to finish
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 10))
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 300))
+
+# attempts at getting a connection before giving up, with a doubling wait in between
+DB_RETRIES = int(os.environ.get('DB_RETRIES', 3))
+
+# database every script and DAG task uses instead of Supabase when set, e.g. a local Postgres or sqlite:////tmp/fpl.db
+FPL_DATABASE_URL = os.environ.get('FPL_DATABASE_URL')
+
+# schemas the tables are loaded into, attached as sibling database files when the database is SQLite
+SQLITE_SCHEMAS = ['public', 'raw_fpl', 'optimum_squads']
+
+# one engine per database URL in a process, made by get_engine
+_engines = {}
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """
+    Cursor that logs how long each statement and COPY took
+    """
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            log_statement(self.query, time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            log_statement(sql, time.perf_counter() - start)
+
+
+def log_statement(statement, seconds):
+    """
+    Function that logs a statement's latency with the start of the statement on one line
+    """
+    if isinstance(statement, bytes):
+        statement = statement.decode(errors='replace')
+    statement = ' '.join(str(statement).split())
+    logger.info('%8.1fms  %s', seconds * 1000, statement[:120])
+
+
+def database_url(user, password, host, port, database):
+    """
+    Function that returns the SQLAlchemy URL of a Postgres database, through psycopg2 which the loader's COPY needs
+
+    FPL_DATABASE_URL replaces it when set, so every entry point can run against a local database
+    """
+    if FPL_DATABASE_URL:
+        return FPL_DATABASE_URL
+    return 'postgresql+psycopg2://' + user + ':' + password + '@' + host + ':' + str(port) + '/' + database
+
+
+def get_engine(url, pool_size=None, max_overflow=None, pool_timeout=None, connect_timeout=None, statement_timeout=None):
+    """
+    Function that returns the pooled engine of a database URL, made on first use and shared by every later call
+
+    Connections are checked before they are handed out, so a connection the server dropped is replaced
+    instead of failing the next statement. Every statement goes through TimedCursor.
+    A SQLite URL gets an engine with SQLITE_SCHEMAS attached and statement_timeout as its busy timeout
+    """
+    if url not in _engines and url.startswith('sqlite'):
+        _engines[url] = sqlite_engine(url, DB_STATEMENT_TIMEOUT if statement_timeout is None else statement_timeout)
+
+    if url not in _engines:
+        statement_timeout = DB_STATEMENT_TIMEOUT if statement_timeout is None else statement_timeout
+        _engines[url] = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE if pool_size is None else pool_size,
+            max_overflow=DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+            pool_timeout=DB_POOL_TIMEOUT if pool_timeout is None else pool_timeout,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            connect_args={
+                'connect_timeout': DB_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+                'options': '-c statement_timeout={}'.format(statement_timeout * 1000),
+                'cursor_factory': TimedCursor,
+            },
+        )
+    return _engines[url]
+
+
+def sqlite_engine(url, busy_timeout):
+    """
+    Function that returns an engine of a SQLite database file with a database file attached for each of SQLITE_SCHEMAS
+
+    schema.table then names the same tables as on Postgres. The attached files sit next to the main one
+    """
+    engine = create_engine(url, connect_args={'timeout': busy_timeout})
+    path = engine.url.database
+
+    @event.listens_for(engine, 'connect')
+    def attach_schemas(dbapi_connection, connection_record):
+        for schema in SQLITE_SCHEMAS:
+            attached = ':memory:' if path in (None, '', ':memory:') else '{}.{}'.format(path, schema)
+            dbapi_connection.execute("ATTACH DATABASE ? AS {}".format(schema), (attached,))
+
+    return engine
+
+
+@contextlib.contextmanager
+def connection(engine, retries=None):
+    """
+    Context manager that lends a psycopg2 connection from the engine's pool and gives it back afterwards
+
+    Getting the connection is retried on operational errors, e.g. while the server is unreachable
+    """
+    retries = DB_RETRIES if retries is None else retries
+    for attempt in range(retries):
+        try:
+            pooled = engine.raw_connection()
+            break
+        except Exception as error:
+            if attempt == retries - 1 or not isinstance(getattr(error, 'orig', error), psycopg2.OperationalError):
+                raise
+            logger.warning('connection attempt %d failed, retrying: %s', attempt + 1, error)
+            time.sleep(2 ** attempt)
+
+    try:
+        yield pooled.driver_connection
+    finally:
+        # back to the pool in the state the engine expects
+        if getattr(pooled.driver_connection, 'autocommit', False) is True:
+            pooled.driver_connection.autocommit = False
+        pooled.close()
+
+
+def dispose_engines():
+    """
+    Function that closes the pooled connections of every engine made in this process
+    """
+    for engine in _engines.values():
+        engine.dispose()
+    _engines.clear()
@@ -1,18 +1,22 @@
 # This airflow dag takes data from the FPL API, cleans it and runs it through the optimizer functions
 
 
-import requests
 import pandas as pd
 import numpy as np
 import copy
 import sys
+import os
+import tempfile
 
 import config
 import fpl_optimizer_functions as fpl
-
-import psycopg2
-from sqlalchemy import create_engine
-import pandas.io.sql as sqlio
+import fpl_api
+import fpl_history
+import fpl_transform
+import fpl_loader
+import fpl_db
+import fpl_profiling
+import fpl_snapshots
 
 from airflow import DAG
 from airflow.operators.python import PythonOperator
@@ -44,45 +48,34 @@ fpl_etl = DAG(
 
 ################################# python function to extract FPL data #################################
 
-def fpl_extract_and_clean():
-
-    # FPL API URL
-    url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-    response = requests.get(url)
-    json = response.json()
-
-    # storing json outputs as dataframes
-    elements_df = pd.DataFrame(json['elements'])
-    elements_types_df = pd.DataFrame(json['element_types'])
-    teams_df = pd.DataFrame(json['teams'])
-
-    # Pulling in player position into elements_df
-    elements_df['position'] = elements_df.element_type.map(elements_types_df.set_index('id').singular_name)
-    elements_df['team_name'] = elements_df.team.map(teams_df.set_index('id').name)
+def fpl_extract_and_clean(run_id=None):
 
-    # Filtering out only the necessary columns
-    slim_elements_df = elements_df[['id','first_name','second_name','web_name','team_name','position','news','selected_by_percent','in_dreamteam',
-                                    'now_cost','form','points_per_game','minutes','goals_scored','assists','clean_sheets',
-                                    'goals_conceded','clean_sheets','goals_conceded','yellow_cards','red_cards','saves','bonus',
-                                    'transfers_in','value_season','total_points','influence','creativity','threat','ict_index']]
+    # every stage of the task is timed under the DAG run's id, shared with the optimizer task
+    fpl_profiling.start_run('fpl_etl_dag.extract_and_load', run_id)
 
-    slim_elements_df.rename(columns = {'web_name':'name'}, inplace = True)
+    # FPL API payload, revalidated instead of downloaded again while unchanged
+    json = fpl_api.fetch_bootstrap_static()
 
-    # numeric columns:
-    numeric_cols = ['selected_by_percent','form','points_per_game','value_season','influence','creativity','threat','ict_index']
+    # typed players with the derived metrics
+    slim_elements_df = fpl_transform.transform_players(json)
 
-    # convering columns into numeric data type
-    for col in numeric_cols:
-        slim_elements_df[col] = pd.to_numeric(slim_elements_df[col])
+    # projected points over the next gameweeks, weighted by fixture difficulty
+    fixtures_df = fpl_transform.transform_fixtures(fpl_api.fetch_fixtures(), json['teams'])
+    slim_elements_df = slim_elements_df.join(fpl_transform.projected_points(slim_elements_df, fixtures_df, json['teams']))
 
-    # actual cost of the player is now_cost/10
-    slim_elements_df['actual_cost'] = slim_elements_df['now_cost']/10
+    # per-gameweek histories when config.fetch_histories is set, for form and points per 90 over the last few gameweeks
+    history_df = None
+    if getattr(config, 'fetch_histories', False):
+        summaries = fpl_history.fetch_element_summaries(slim_elements_df['id'].tolist(), fpl_transform.current_gameweek(json))
+        history_df = fpl_transform.transform_histories(summaries)
+        slim_elements_df = slim_elements_df.join(fpl_transform.windowed_metrics(history_df), on='id')
 
-    # creating additional metrics
-    slim_elements_df['games_completed'] = slim_elements_df['minutes']/90
-    slim_elements_df['points_per_90_mins'] = slim_elements_df['total_points']/slim_elements_df['games_completed']
-    slim_elements_df['ga_per_90_mins'] = (slim_elements_df['goals_scored']+slim_elements_df['assists'])/slim_elements_df['games_completed']
-    slim_elements_df['points_per_million'] = slim_elements_df['total_points']/slim_elements_df['actual_cost']
+    # snapshots of the cleaned players and fixtures in the local store when config.snapshot_store is set
+    snapshot_store = getattr(config, 'snapshot_store', None)
+    if snapshot_store:
+        season, gameweek = fpl_snapshots.snapshot_partition(json)
+        fpl_snapshots.write_snapshot(slim_elements_df, 'players', season, gameweek, root=snapshot_store)
+        fpl_snapshots.write_snapshot(fixtures_df, 'fixtures', season, gameweek, root=snapshot_store)
 
     # eligible players
     eligible_players = slim_elements_df[slim_elements_df['news'] == '']
@@ -94,27 +87,31 @@ def fpl_extract_and_clean():
     port='5432'
     database='postgres'
 
-    conn = psycopg2.connect(
-        database=database, user=user, password=password, host=host, port=port
-    )
+    # one pooled engine for the task, every statement's latency is logged
+    engine = fpl_db.get_engine(fpl_db.database_url(user, password, host, port, database))
 
-    # Setting auto commit true
-    conn.autocommit = True
+    # COPY into a staging table swapped in for the old one, readers never see the table missing
+    with fpl_profiling.stage('db_load', table='dim_fpl_players'), fpl_db.connection(engine) as conn:
+        fpl_loader.load_frame(conn, slim_elements_df, 'dim_fpl_players', schema='raw_fpl')
 
-    # Creating a cursor object using the cursor() method
-    cursor = conn.cursor()
-    
-    # Delete the contents of the table and load the dataframe
-    cursor.execute('''DROP TABLE IF EXISTS raw_fpl.dim_fpl_players''')
+    if history_df is not None:
+        with fpl_profiling.stage('db_load', table='fact_player_gameweeks'), fpl_db.connection(engine) as conn:
+            fpl_loader.load_frame(conn, history_df, 'fact_player_gameweeks', schema='raw_fpl')
+
+    write_pipeline_metrics(engine)
+
+    # close the pooled connections
+    fpl_db.dispose_engines()
 
-    # Use sqlalchemy engine to write to the DB
-    engine_url = 'postgresql://' + user + ':' + password + '@' + host + '/' + database
-    engine = create_engine(engine_url)
-    slim_elements_df.to_sql('dim_fpl_players', engine, schema='raw_fpl', index=False)
+################################# stage timings of a task #################################
 
-    # close the connection and the cursor
-    cursor.close()
-    conn.close()
+def write_pipeline_metrics(engine):
+
+    # appended to config.pipeline_metrics_table (e.g. 'pipeline_metrics') when it is set, for trend analysis
+    pipeline_metrics_table = getattr(config, 'pipeline_metrics_table', None)
+    if pipeline_metrics_table:
+        with fpl_db.connection(engine) as conn:
+            fpl_profiling.write_run_metrics(conn, pipeline_metrics_table, schema='raw_fpl')
 
 ################################# Task 1: Extract and load #################################
 
@@ -122,7 +119,9 @@ extract_and_load = PythonOperator(task_id='extract_and_load', python_callable=fp
 
 ################################# squad optimizer function #################################    
 
-def squad_optimizer():
+def squad_optimizer(run_id=None):
+
+    fpl_profiling.start_run('fpl_etl_dag.load_opt_squad', run_id)
     
     # connect to Supabase
     user=config.supabase_fpl_username
@@ -131,40 +130,59 @@ def squad_optimizer():
     port='5432'
     database='postgres'
 
-    conn = psycopg2.connect(
-        database=database, user=user, password=password, host=host, port=port
-    )
-
-    # Setting auto commit true
-    conn.autocommit = True
+    # one pooled engine for the reads and writes of the task
+    engine = fpl_db.get_engine(fpl_db.database_url(user, password, host, port, database))
 
     # save query output as dataframe
     sql = "select * from raw_fpl.dim_fpl_players;"
-    eligible_players = sqlio.read_sql_query(sql, conn)
-
-    # get the optimized squad
-    squad = fpl.squad_optimizer(eligible_players, 'total_points')
-
-    # open a cursor
-    cursor = conn.cursor()
+    with fpl_profiling.stage('db_read', table='dim_fpl_players'):
+        eligible_players = pd.read_sql_query(sql, engine)
 
     # metrics for which the squad is to be optimized
-    optimizing_metrics = ['points_per_game','bonus','total_points','ict_index','points_per_million']
-    
-    # Delete the contents of the tables
-    for metric in optimizing_metrics:
-        table_name = 'optimum_squads.' + metric
-        drop_query = 'DROP TABLE IF EXISTS ' + table_name
-        cursor.execute(drop_query)
-
-    # sqlalchemy engine
-    engine_url = 'postgresql://' + user + ':' + password + '@' + host + '/' + database
-    engine = create_engine(engine_url)
+    optimizing_metrics = ['points_per_game','bonus','total_points','ict_index','points_per_million','projected_points_h5']
+
+    # optimize all metrics in one pass over the player pool, or spread over worker processes
+    # squads of an unchanged player pool come from the cache of an earlier run
+    # with a snapshot dir, only the metrics whose squad the player changes since the last run may affect are re-solved
+    optimizer_workers = getattr(config, 'optimizer_workers', None)
+    squad_snapshot_dir = getattr(config, 'squad_snapshot_dir', None)
+    squad_cache_dir = getattr(config, 'squad_cache_dir', os.path.join(tempfile.gettempdir(), 'fpl_squad_cache'))
+    if squad_snapshot_dir:
+        squads = fpl.incremental_squad_optimizer(eligible_players, optimizing_metrics, squad_snapshot_dir)
+    elif optimizer_workers:
+        squads = fpl.squad_optimizer_parallel(eligible_players, optimizing_metrics, max_workers=optimizer_workers, cache_dir=squad_cache_dir)
+    else:
+        squads = fpl.squad_optimizer_many(eligible_players, optimizing_metrics, cache_dir=squad_cache_dir)
+    print('Squad cache hits: {}, misses: {}'.format(fpl.SQUAD_CACHE_STATS['hits'], fpl.SQUAD_CACHE_STATS['misses']))
+
+    # the next best squads of each metric, ranked
+    ranked_squads = {metric: fpl.squad_optimizer_topk(eligible_players, metric) for metric in optimizing_metrics}
+
+    # with a number of points scenarios, also the squad that holds up best in the worst tenth of them
+    robust_scenarios = getattr(config, 'robust_scenarios', None)
+    robust_squad = fpl.robust_squad_optimizer(eligible_players, 'projected_points_h5', 'cvar', robust_scenarios) if robust_scenarios else None
+
+    # with a bench weight, also the squad picked for its starting XI, bench order and captain
+    lineup_bench_weight = getattr(config, 'lineup_bench_weight', None)
+    lineup = fpl.lineup_optimizer(eligible_players, 'projected_points_h5', lineup_bench_weight) if lineup_bench_weight is not None else None
 
     # Create individual tables for each metric
-    for metric in optimizing_metrics:
-        squad = fpl.squad_optimizer(eligible_players, metric)
-        squad.to_sql(metric, engine, schema='optimum_squads', index=False)
+    with fpl_profiling.stage('db_load', tables=2 * len(optimizing_metrics)), fpl_db.connection(engine) as conn:
+        for metric in optimizing_metrics:
+            fpl.check_squad(squads[metric], metric)
+            fpl_loader.load_frame(conn, squads[metric], metric, schema='optimum_squads')
+            for squad_rank, ranked in ranked_squads[metric].groupby('squad_rank'):
+                fpl.check_squad(ranked, '{}_ranked rank {}'.format(metric, squad_rank))
+            fpl_loader.load_frame(conn, ranked_squads[metric], metric + '_ranked', schema='optimum_squads')
+        if robust_squad is not None:
+            fpl_loader.load_frame(conn, robust_squad, 'projected_points_h5_robust', schema='optimum_squads')
+        if lineup is not None:
+            fpl_loader.load_frame(conn, lineup, 'projected_points_h5_lineup', schema='optimum_squads')
+
+    write_pipeline_metrics(engine)
+
+    # close the pooled connections
+    fpl_db.dispose_engines()
 
 ################################# Task 2: Load optimized squad #################################
 
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+
+import httpx
+
+import fpl_api
+import fpl_profiling
+
+logger = logging.getLogger(__name__)
+
+# httpx logs every request at info, hundreds of lines per run
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# element-summary requests in flight at once
+FPL_HISTORY_CONCURRENCY = int(os.environ.get('FPL_HISTORY_CONCURRENCY', 16))
+
+# attempts per player, the wait after a failed one doubles from HISTORY_BACKOFF seconds (with jitter) up to HISTORY_MAX_WAIT
+HISTORY_RETRIES = 5
+HISTORY_BACKOFF = 0.5
+HISTORY_MAX_WAIT = 30
+
+# answers worth another attempt, anything else fails the player straight away
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def history_cache_dir(cache_dir, gameweek):
+    """
+    Function that returns the directory the element summaries of a gameweek are cached in
+    """
+    return os.path.join(cache_dir, 'element_summary', 'gw{}'.format(gameweek))
+
+
+def retry_wait(attempt, response=None):
+    """
+    Function that returns the seconds to wait before another attempt, the server's Retry-After when it sent one
+    """
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return min(int(response.headers['Retry-After']), HISTORY_MAX_WAIT)
+    return min(HISTORY_BACKOFF * 2 ** attempt * (1 + random.random()), HISTORY_MAX_WAIT)
+
+
+async def fetch_element_summary(client, semaphore, url, retries=HISTORY_RETRIES):
+    """
+    Function that returns the body of one element-summary URL, retrying rate limits, 5xx answers and connection errors
+
+    The semaphore is only held while a request is in flight, so waiting out a backoff doesn't block other players
+    """
+    for attempt in range(retries):
+        response = None
+        try:
+            async with semaphore:
+                response = await client.get(url)
+            if response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response.content
+            error = httpx.HTTPStatusError('{} from {}'.format(response.status_code, url), request=response.request, response=response)
+        except httpx.TransportError as transport_error:
+            error = transport_error
+
+        if attempt == retries - 1:
+            raise error
+        wait = retry_wait(attempt, response)
+        logger.debug('%s: attempt %d failed (%s), retrying in %.1fs', url, attempt + 1, error, wait)
+        await asyncio.sleep(wait)
+
+
+async def fetch_element_summaries_async(player_ids, gameweek, cache_dir, base_url, concurrency, retries):
+    """
+    Function that returns the element summaries of the players that aren't cached for the gameweek yet, caching
+    each one as soon as it arrives. Players that failed every attempt are returned as exceptions
+    """
+    cache = history_cache_dir(cache_dir, gameweek)
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(30, connect=5), limits=limits,
+                                 headers={'Accept': 'application/json'}) as client:
+
+        async def fetch(player_id):
+            body = await fetch_element_summary(client, semaphore, '{}element-summary/{}/'.format(base_url, player_id), retries)
+            fpl_api.write_atomic(os.path.join(cache, '{}.json'.format(player_id)), body)
+            return json.loads(body)
+
+        results = await asyncio.gather(*[fetch(player_id) for player_id in player_ids], return_exceptions=True)
+
+    return dict(zip(player_ids, results))
+
+
+def fetch_element_summaries(player_ids, gameweek, cache_dir=None, base_url=None, concurrency=None, retries=HISTORY_RETRIES):
+    """
+    Function that returns the element-summary payload of every player, as a dict of player id to payload
+
+    Payloads are cached on disk per gameweek: a player already fetched in the current gameweek is read from the
+    cache, the rest are fetched concurrently (at most concurrency requests at once) and cached. Caches of earlier
+    gameweeks are removed. Raises when a player still failed after all the retries, the others stay cached
+    """
+    cache_dir = fpl_api.FPL_CACHE_DIR if cache_dir is None else cache_dir
+    base_url = fpl_api.FPL_API_URL if base_url is None else base_url
+    concurrency = FPL_HISTORY_CONCURRENCY if concurrency is None else concurrency
+
+    cache = history_cache_dir(cache_dir, gameweek)
+    os.makedirs(cache, exist_ok=True)
+    for name in os.listdir(os.path.dirname(cache)):
+        if name != os.path.basename(cache):
+            shutil.rmtree(os.path.join(os.path.dirname(cache), name), ignore_errors=True)
+
+    summaries = {}
+    missing = []
+    for player_id in player_ids:
+        path = os.path.join(cache, '{}.json'.format(player_id))
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                summaries[player_id] = json.loads(f.read())
+        else:
+            missing.append(player_id)
+
+    with fpl_profiling.stage('element_summaries', players=len(missing), cached=len(summaries)):
+        start = time.perf_counter()
+        if missing:
+            fetched = asyncio.run(fetch_element_summaries_async(missing, gameweek, cache_dir, base_url, concurrency, retries))
+        else:
+            fetched = {}
+        failed = {player_id: result for player_id, result in fetched.items() if isinstance(result, BaseException)}
+        logger.info('element summaries: %d cached, %d fetched, %d failed in %.2fs', len(summaries), len(fetched) - len(failed),
+                    len(failed), time.perf_counter() - start)
+
+    if failed:
+        raise RuntimeError('element-summary failed for {} of {} players, e.g. {}: {}'.format(
+            len(failed), len(player_ids), next(iter(failed)), next(iter(failed.values()))))
+
+    summaries.update(fetched)
+    return {player_id: summaries[player_id] for player_id in player_ids}
@@ -0,0 +1,167 @@
+import io
+import time
+import logging
+import sqlite3
+
+import pandas as pd
+from psycopg2 import sql
+
+logger = logging.getLogger(__name__)
+
+
+def postgres_type(dtype):
+    """
+    Function that returns the Postgres column type of a pandas dtype, text for anything that is not a number, a flag or a time
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(dtype):
+        return {1: 'smallint', 2: 'smallint', 4: 'integer'}.get(dtype.itemsize, 'bigint')
+    if pd.api.types.is_float_dtype(dtype):
+        return 'real' if dtype.itemsize == 4 else 'double precision'
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return 'timestamp with time zone'
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return 'timestamp'
+    return 'text'
+
+
+def copy_frame(cursor, df, schema, table, if_not_exists=False):
+    """
+    Function that creates a table for a dataframe and fills it with a single COPY from an in-memory CSV buffer
+
+    With if_not_exists, an existing table is kept and the rows are added to it
+    """
+    # object columns holding numbers or timestamps (e.g. from a cursor) get their real types
+    df = df.infer_objects()
+    columns = [sql.SQL('{} {}').format(sql.Identifier(str(column)), sql.SQL(postgres_type(dtype)))
+               for column, dtype in df.dtypes.items()]
+    create = 'CREATE TABLE IF NOT EXISTS {}.{} ({})' if if_not_exists else 'CREATE TABLE {}.{} ({})'
+    cursor.execute(sql.SQL(create).format(sql.Identifier(schema), sql.Identifier(table), sql.SQL(', ').join(columns)))
+
+    # missing values are written as \N, so empty strings stay empty strings
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+
+    copy = sql.SQL("COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(
+        sql.Identifier(schema), sql.Identifier(table), sql.SQL(', ').join(sql.Identifier(str(column)) for column in df.columns))
+    cursor.copy_expert(copy.as_string(cursor), buffer)
+
+
+def quote_identifier(name):
+    """
+    Function that returns a double-quoted SQL identifier
+    """
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def insert_frame(cursor, df, schema, table, if_not_exists=False):
+    """
+    Function that creates a table for a dataframe and fills it with one executemany, for a SQLite connection
+
+    Column types are the Postgres ones of postgres_type, which SQLite maps to the matching affinities.
+    Timestamps are stored as ISO strings
+    """
+    df = df.infer_objects()
+    columns = ', '.join(quote_identifier(column) + ' ' + postgres_type(dtype) for column, dtype in df.dtypes.items())
+    create = 'CREATE TABLE IF NOT EXISTS {}.{} ({})' if if_not_exists else 'CREATE TABLE {}.{} ({})'
+    cursor.execute(create.format(quote_identifier(schema), quote_identifier(table), columns))
+
+    missing = df.isna().to_numpy()
+    values = df.astype({column: str for column, dtype in df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(dtype)})
+    values = values.astype(object).to_numpy()
+    values[missing] = None
+
+    insert = 'INSERT INTO {}.{} VALUES ({})'.format(quote_identifier(schema), quote_identifier(table), ', '.join('?' * len(df.columns)))
+    cursor.executemany(insert, values.tolist())
+
+
+def load_frame(conn, df, table, schema='public'):
+    """
+    Function that replaces a table with a dataframe, loaded with COPY into a staging table and swapped in by renaming
+
+    The swap runs in one transaction, so readers see the old table until it commits and never a missing one.
+    A failed load is rolled back and leaves the old table as it was. A SQLite connection (a local replay target)
+    gets the same swap with insert_frame in place of the COPY
+    """
+    if isinstance(conn, sqlite3.Connection):
+        return load_frame_sqlite(conn, df, table, schema)
+
+    staging = table + '_staging'
+    autocommit = conn.autocommit
+    if autocommit:
+        conn.autocommit = False
+    start = time.perf_counter()
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}.{}').format(sql.Identifier(schema), sql.Identifier(staging)))
+            copy_frame(cursor, df, schema, staging)
+            cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}.{}').format(sql.Identifier(schema), sql.Identifier(table)))
+            cursor.execute(sql.SQL('ALTER TABLE {}.{} RENAME TO {}').format(sql.Identifier(schema), sql.Identifier(staging), sql.Identifier(table)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if autocommit:
+            conn.autocommit = True
+
+    logger.info('loaded %d rows into %s.%s in %.2fs', len(df), schema, table, time.perf_counter() - start)
+
+
+def load_frame_sqlite(conn, df, table, schema='public'):
+    """
+    Function that replaces a table of a SQLite connection with a dataframe through a staging table, like load_frame
+    """
+    staging = table + '_staging'
+    start = time.perf_counter()
+
+    try:
+        # an explicit transaction, so the DDL is part of it
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.cursor()
+        cursor.execute('DROP TABLE IF EXISTS {}.{}'.format(quote_identifier(schema), quote_identifier(staging)))
+        insert_frame(cursor, df, schema, staging)
+        cursor.execute('DROP TABLE IF EXISTS {}.{}'.format(quote_identifier(schema), quote_identifier(table)))
+        cursor.execute('ALTER TABLE {}.{} RENAME TO {}'.format(quote_identifier(schema), quote_identifier(staging), quote_identifier(table)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    logger.info('loaded %d rows into %s.%s in %.2fs', len(df), schema, table, time.perf_counter() - start)
+
+
+def append_frame(conn, df, table, schema='public'):
+    """
+    Function that appends a dataframe to a table with COPY, creating the table from the frame's types if it is missing
+    """
+    if isinstance(conn, sqlite3.Connection):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            insert_frame(conn.cursor(), df, schema, table, if_not_exists=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info('appended %d rows to %s.%s', len(df), schema, table)
+        return
+
+    autocommit = conn.autocommit
+    if autocommit:
+        conn.autocommit = False
+
+    try:
+        with conn.cursor() as cursor:
+            copy_frame(cursor, df, schema, table, if_not_exists=True)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if autocommit:
+            conn.autocommit = True
+
+    logger.info('appended %d rows to %s.%s', len(df), schema, table)
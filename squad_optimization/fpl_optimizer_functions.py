@@ -2,27 +2,82 @@ import requests
 import pandas as pd
 import numpy as np
 import copy
+import logging
+import heapq
+import itertools
+import os
+import time
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import fpl_api
+import fpl_profiling
+
+logger = logging.getLogger(__name__)
+
+# number of players to pick per position
+POSITION_COUNTS = {'Goalkeeper': 2, 'Defender': 5, 'Midfielder': 5, 'Forward': 3}
+
+# columns returned for every selected player
+SQUAD_COLUMNS = ['first_name', 'second_name', 'name', 'team_name', 'position', 'selected_by_percent', 'actual_cost', 'total_points']
+
+# number of players in a squad
+SQUAD_SIZE = sum(POSITION_COUNTS.values())
+
+# full knapsack tables larger than this (in bytes) are solved with the rolling-row mode instead
+KNAPSACK_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# squad cache limits, the oldest entries are evicted past either
+SQUAD_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SQUAD_CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+# version of the solvers and of the cached squad format, part of every cache key. Bump it whenever a change can
+# give a different squad for the same players, so squads cached by the older code are not returned
+SQUAD_CACHE_VERSION = 2
+
+# squad cache lookups since the process started
+SQUAD_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# knapsack table cells filled and cost breakdowns scored since the process started
+OPTIMIZER_STATS = {'dp_cells': 0, 'splits_tried': 0}
 
 
 def knapsack_solution(players, player_costs, player_values, max_cost, count):
     
     """
     function that returns the knapsack cost matrix
+
+    cost_matrix[i][j][k] is the best value using exactly k of the first i+1 players with a cost of at most j, -inf when
+    k of them don't fit. Each player is one vectorized step over the whole count x cost plane
     """
   
     num_players = len(players)
+    costs = np.asarray(player_costs, dtype=np.int64)
+    values = np.asarray(player_values, dtype=np.float64)
   
-    cost_matrix = [[[0 for k in range(count+1)] for j in range(max_cost+1)] for i in range(num_players)]
+    # stored count-major so that shifting by a player's cost is a contiguous slice
+    cost_matrix = np.empty((num_players, count+1, max_cost+1), dtype=np.float64)
+    previous = np.full((count+1, max_cost+1), -np.inf)
+    previous[0] = 0
+    candidate = np.empty((count, max_cost+1), dtype=np.float64)
+    OPTIMIZER_STATS['dp_cells'] += num_players * (count+1) * (max_cost+1)
     
     for i in range(num_players):
-        for j in range(max_cost+1):
-            for k in range(count+1):
-                if (player_costs[i] > j) or (1 > k):
-                    cost_matrix[i][j][k] = cost_matrix[i-1][j][k]
-                else: 
-                    cost_matrix[i][j][k] = max(cost_matrix[i-1][j][k], player_values[i]+cost_matrix[i-1][j-player_costs[i]][k-1])
+        current = cost_matrix[i]
+        cost = min(costs[i], max_cost+1)
+        # cells the player can't be added to carry over unchanged
+        current[:, :cost] = previous[:, :cost]
+        current[0, cost:] = 0
+        if cost <= max_cost:
+            width = max_cost+1-cost
+            np.add(previous[:-1, :width], values[i], out=candidate[:, :width])
+            # fmax keeps the previous value when the player's metric is NaN, same as the builtin max did
+            np.fmax(previous[1:, cost:], candidate[:, :width], out=current[1:, cost:])
+        previous = current
 
-    return cost_matrix
+    # view with the original [player][cost][count] indexing
+    return cost_matrix.transpose(0, 2, 1)
     
 
 
@@ -34,20 +89,17 @@ def get_used_items(players, player_costs, player_values, max_cost, count, cost_m
     
     playerIndex = len(players) - 1
     
-    currentCost = -1
     currentCount = count
     marked = [0 for k in range(len(players))]
 
-    bestValue = -1
+    # first cost with the best value for the full count, none when count players don't fit
+    currentCost = int(np.argmax(cost_matrix[playerIndex, :max_cost+1, count]))
+    if cost_matrix[playerIndex, currentCost, count] == -np.inf:
+        return marked
     
-    for j in range(max_cost+1):
-        value = cost_matrix[playerIndex][j][count]
-        if (bestValue == -1) or (value > bestValue):
-            currentCost = j
-            bestValue = value
-    
-    while (playerIndex >= 0 and currentCost >= 0 and currentCount >= 0):
-        if (playerIndex == 0 and cost_matrix[playerIndex][currentCost][currentCount] > 0) or (cost_matrix[playerIndex][currentCost][currentCount] != cost_matrix[playerIndex-1][currentCost][currentCount]):
+    while (playerIndex >= 0 and currentCost >= 0 and currentCount > 0):
+        # the first player is taken whenever a player is still missing, the counts are exact
+        if playerIndex == 0 or (cost_matrix[playerIndex, currentCost, currentCount] != cost_matrix[playerIndex-1, currentCost, currentCount]):
             marked[playerIndex] = 1
             currentCost = currentCost - player_costs[playerIndex]
             currentCount = currentCount - 1
@@ -56,136 +108,369 @@ def get_used_items(players, player_costs, player_values, max_cost, count, cost_m
     return marked
       
 
-def optimum_keepers(eligible_players, maximum_cost, opt_metric):
+def knapsack_solution_many(players, player_costs, player_values, max_cost, count):
+
+    """
+    function that returns the knapsack cost matrix for several metrics at once
+
+    player_values has one column per metric and cost_matrix[i][m] is the [cost][count] layer of metric m, the same
+    numbers knapsack_solution gives for that metric. The cost side is shared and each player stays one
+    vectorized step, now over the metric x count x cost block
+    """
+
+    num_players = len(players)
+    costs = np.asarray(player_costs, dtype=np.int64)
+    values = np.asarray(player_values, dtype=np.float64).reshape(num_players, -1)
+    num_metrics = values.shape[1]
+
+    cost_matrix = np.empty((num_players, num_metrics, count+1, max_cost+1), dtype=np.float64)
+    previous = np.full((num_metrics, count+1, max_cost+1), -np.inf)
+    previous[:, 0] = 0
+    candidate = np.empty((num_metrics, count, max_cost+1), dtype=np.float64)
+    OPTIMIZER_STATS['dp_cells'] += num_players * num_metrics * (count+1) * (max_cost+1)
+
+    for i in range(num_players):
+        current = cost_matrix[i]
+        cost = min(costs[i], max_cost+1)
+        current[:, :, :cost] = previous[:, :, :cost]
+        current[:, 0, cost:] = 0
+        if cost <= max_cost:
+            width = max_cost+1-cost
+            np.add(previous[:, :-1, :width], values[i][:, None, None], out=candidate[:, :, :width])
+            np.fmax(previous[:, 1:, cost:], candidate[:, :, :width], out=current[:, 1:, cost:])
+        previous = current
+
+    # view with [player][metric][cost][count] indexing
+    return cost_matrix.transpose(0, 1, 3, 2)
+
+
+def knapsack_solution_rolling(players, player_costs, player_values, max_cost, count):
+
+    """
+    function that returns the last row of the knapsack cost matrix and the packed take/skip bits
+
+    Only two count x cost rows are kept while solving. For every player the cells where adding the player
+    improved the value are stored one bit per cell with np.packbits, which is all get_used_items_rolling
+    needs to walk back through the players
+    """
+
+    num_players = len(players)
+    costs = np.asarray(player_costs, dtype=np.int64)
+    values = np.asarray(player_values, dtype=np.float64)
+
+    previous = np.full((count+1, max_cost+1), -np.inf)
+    previous[0] = 0
+    current = np.empty((count+1, max_cost+1), dtype=np.float64)
+    candidate = np.empty((count, max_cost+1), dtype=np.float64)
+    take = np.zeros((count+1, max_cost+1), dtype=bool)
+    take_bits = np.zeros((num_players, ((count+1)*(max_cost+1)+7)//8), dtype=np.uint8)
+    OPTIMIZER_STATS['dp_cells'] += num_players * (count+1) * (max_cost+1)
+
+    for i in range(num_players):
+        cost = min(costs[i], max_cost+1)
+        current[:, :cost] = previous[:, :cost]
+        current[0, cost:] = 0
+        if cost <= max_cost:
+            width = max_cost+1-cost
+            np.add(previous[:-1, :width], values[i], out=candidate[:, :width])
+            np.greater(candidate[:, :width], previous[1:, cost:], out=take[1:, cost:])
+            np.fmax(previous[1:, cost:], candidate[:, :width], out=current[1:, cost:])
+            take_bits[i] = np.packbits(take)
+            take[1:, cost:] = False
+        previous, current = current, previous
+
+    # view with the same [cost][count] indexing as a layer of knapsack_solution
+    return previous.transpose(), take_bits
+
+
+def get_used_items_rolling(players, player_costs, player_values, max_cost, count, last_row, take_bits):
+
+    """
+    function that returns the used players from the packed take/skip bits of knapsack_solution_rolling
+    """
+
+    playerIndex = len(players) - 1
+
+    currentCount = count
+    marked = [0 for k in range(len(players))]
+
+    currentCost = int(np.argmax(last_row[:max_cost+1, count]))
+    if last_row[currentCost, count] == -np.inf:
+        return marked
+
+    # take bits are laid out count-major over the full table width
+    width = last_row.shape[0]
+
+    while (playerIndex >= 0 and currentCost >= 0 and currentCount > 0):
+        bit = currentCount*width + currentCost
+        taken = (take_bits[playerIndex, bit >> 3] >> (7 - (bit & 7))) & 1
+        if taken:
+            marked[playerIndex] = 1
+            currentCost = currentCost - player_costs[playerIndex]
+            currentCount = currentCount - 1
+        playerIndex = playerIndex - 1
+
+    return marked
+
+
+def empty_last_row(max_cost, count):
+
+    """
+    function that returns the last row of a knapsack over no players: only a selection of 0 players fits
+    """
+    last_row = np.full((max_cost+1, count+1), -np.inf)
+    last_row[:, 0] = 0
+    return last_row
+
+
+def knapsack_memory_bytes(num_players, max_cost, count, rolling=False):
+
+    """
+    function that returns the peak bytes held by the knapsack arrays for either mode
+    """
+
+    cells = (count+1) * (max_cost+1)
+    if rolling:
+        # two value rows, the candidate row, the take mask and the packed bits
+        return 3 * 8 * cells + cells + num_players * ((cells + 7) // 8)
+    return 8 * num_players * cells + 2 * 8 * cells
+
+
+def knapsack_solution_topk(players, player_costs, player_values, max_cost, count, k):
+
+    """
+    function that returns the k best values of every count x cost cell of the last player and the choices behind them
+
+    values[n][c][r] is the r-th best value of exactly n players with a cost of at most c, -inf past the number of such
+    selections. Each cell merges the sorted k-lists of skipping and taking the player; took[i][n][c][r] and
+    rank[i][n][c][r] record which list entry r came from, for get_used_items_topk. The k entries of a cell are
+    always different selections
+    """
+    num_players = len(players)
+    costs = np.asarray(player_costs, dtype=np.int64)
+    # a player without a value is never taken
+    values = np.nan_to_num(np.asarray(player_values, dtype=np.float64), nan=-np.inf)
+
+    previous = np.full((count+1, max_cost+1, k), -np.inf)
+    previous[0, :, 0] = 0
+    took = np.zeros((num_players, count+1, max_cost+1, k), dtype=bool)
+    rank = np.zeros((num_players, count+1, max_cost+1, k), dtype=np.int16)
+    candidates = np.empty((count+1, max_cost+1, 2*k))
+    OPTIMIZER_STATS['dp_cells'] += num_players * (count+1) * (max_cost+1) * k
+
+    for i in range(num_players):
+        cost = costs[i]
+        # skips first, so ties keep the selection without the player like the other solvers
+        candidates[:, :, :k] = previous
+        candidates[:, :, k:] = -np.inf
+        if cost <= max_cost:
+            candidates[1:, cost:, k:] = previous[:-1, :max_cost+1-cost] + values[i]
+
+        order = np.argsort(-candidates, axis=2, kind='stable')[:, :, :k]
+        previous = np.take_along_axis(candidates, order, axis=2)
+        took[i] = order >= k
+        rank[i] = order % k
+
+    return previous, took, rank
+
+
+def get_used_items_topk(player_costs, count, max_cost, values, took, rank):
+
+    """
+    function that returns the k best selections of exactly count players for a max cost as (value, row positions) pairs,
+    best first, leaving out the ranks with no selection
+    """
+    costs = np.asarray(player_costs, dtype=np.int64)
+    selections = []
+
+    for r in range(values.shape[2]):
+        value = values[count, max_cost, r]
+        if value == -np.inf:
+            break
+        n, c, entry = count, max_cost, r
+        used = []
+        for i in range(took.shape[0] - 1, -1, -1):
+            taken = took[i, n, c, entry]
+            entry = rank[i, n, c, entry]
+            if taken:
+                used.append(i)
+                c -= costs[i]
+                n -= 1
+        selections.append((value, used[::-1]))
+
+    return selections
+
+
+def dominated_players(player_costs, player_values, count, player_clubs=None, max_per_club=None, rank=1):
+
+    """
+    function that flags the players of a position that can't be in an optimal selection of count players, or in any of
+    the rank best ones
+
+    A player is dominated by every other player that costs no more and has a strictly higher value. With at least
+    count of them one is always free to swap in for a strictly better selection, so the optimum is unchanged
+    without the player. Under a club cap the swap must keep the cap too, which min(count, max_per_club) dominators
+    from the player's own club guarantee, as do dominators from more clubs than the rest of the squad can fill
+    or hold. Every dominator past those is one more strictly better selection, so rank-1 more of them keep the
+    player out of the rank best. Players without a value are never picked and are flagged as well
+    """
+    costs = np.asarray(player_costs, dtype=np.float64)
+    values = np.asarray(player_values, dtype=np.float64)
+
+    # dominates[i, j] is True when player j dominates player i
+    dominates = (costs[None, :] <= costs[:, None]) & (values[None, :] > values[:, None])
+
+    if player_clubs is None:
+        dominated = dominates.sum(axis=1) >= count + rank - 1
+    else:
+        clubs = pd.factorize(np.asarray(player_clubs))[0]
+        own_club = clubs[None, :] == clubs[:, None]
+        club_dominators = dominates.astype(np.int64) @ np.eye(clubs.max() + 1 if len(clubs) > 0 else 0, dtype=np.int64)[clubs]
+        other_clubs = (club_dominators > 0).sum(axis=1) - (club_dominators[np.arange(len(clubs)), clubs] > 0)
+        # the rest of the position can hold count-1 of them and the rest of the squad can fill this many clubs
+        blocked_clubs = count - 1 + (SQUAD_SIZE - 1) // max_per_club
+        dominated = (((dominates & own_club).sum(axis=1) >= min(count, max_per_club) + rank - 1)
+                     | (other_clubs > blocked_clubs + rank - 1))
+
+    return dominated | np.isnan(values)
+
+
+def prune_dominated_players(eligible_players, opt_metrics, max_per_club=None, rank=1):
+
+    """
+    function that returns the players that can be in an optimal squad (or one of the rank best) for at least one of the metrics
+
+    Pruning is per position with dominated_players (club aware when max_per_club is given) and logs how many
+    players it removed
+    """
+    if isinstance(opt_metrics, str):
+        opt_metrics = [opt_metrics]
+
+    keep = np.zeros(len(eligible_players), dtype=bool)
+    positions = eligible_players['position'].to_numpy()
+
+    for position, count in POSITION_COUNTS.items():
+        rows = np.flatnonzero(positions == position)
+        position_df = eligible_players.iloc[rows]
+        clubs = position_df['team_name'] if max_per_club is not None else None
+        for metric in opt_metrics:
+            keep[rows] |= ~dominated_players(position_df['now_cost'], position_df[metric], count, clubs, max_per_club, rank)
+
+    logger.info('dominance pruning removed %d of %d players', len(keep) - keep.sum(), len(keep))
+
+    return eligible_players[keep]
+
+
+def position_knapsack(eligible_players, position, maximum_cost, opt_metric, rolling=None, prune=True):
+
+    """
+    function that solves the knapsack of one position once, up to a max cost
+
+    Any budget up to maximum_cost can then be read off the same solution with selected_players and
+    position_value_curve, since cells at a lower cost never depend on the higher ones.
+    rolling=None picks the rolling-row mode whenever the full cost matrix would exceed KNAPSACK_MEMORY_LIMIT.
+    prune drops the dominated players (see dominated_players) before solving
+    """
+    max_cost = int(round(maximum_cost * 10))
+    count = POSITION_COUNTS[position]
+
+    position_df = eligible_players[eligible_players['position'] == position]
+    pool_size = len(position_df)
+    if prune:
+        position_df = position_df[~dominated_players(position_df['now_cost'], position_df[opt_metric], count)]
+    position_df = position_df.reset_index()
+    players = position_df.index.tolist()
+    player_costs = position_df['now_cost'].tolist()
+    player_values = position_df[opt_metric].tolist()
+
+    if rolling is None:
+        rolling = knapsack_memory_bytes(len(players), max_cost, count) > KNAPSACK_MEMORY_LIMIT
+
+    logger.debug('%s knapsack: %d players (%d pruned), max cost %d, %s mode, %d bytes', position, len(players), pool_size - len(players),
+                 max_cost, 'rolling' if rolling else 'full', knapsack_memory_bytes(len(players), max_cost, count, rolling))
+
+    knapsack = {'position_df': position_df, 'players': players, 'player_costs': player_costs, 'player_values': player_values,
+                'max_cost': max_cost, 'count': count, 'rolling': rolling, 'pruned': pool_size - len(players)}
+
+    if rolling:
+        knapsack['last_row'], knapsack['take_bits'] = knapsack_solution_rolling(players, player_costs, player_values, max_cost, count)
+    else:
+        knapsack['cost_matrix'] = knapsack_solution(players, player_costs, player_values, max_cost, count)
+        knapsack['last_row'] = knapsack['cost_matrix'][-1] if len(players) > 0 else empty_last_row(max_cost, count)
+
+    return knapsack
+
+
+def selected_players(knapsack, maximum_cost):
+
+    """
+    function that returns the row positions of the best players of a solved position for a max cost
+    """
+    max_cost = int(round(maximum_cost * 10))
+    args = (knapsack['players'], knapsack['player_costs'], knapsack['player_values'], max_cost, knapsack['count'])
+
+    if len(knapsack['players']) == 0:
+        return []
+
+    if knapsack['rolling']:
+        used_players = get_used_items_rolling(*args, knapsack['last_row'], knapsack['take_bits'])
+    else:
+        used_players = get_used_items(*args, knapsack['cost_matrix'])
+
+    return [i for i in range(len(used_players)) if used_players[i] == 1]
+
+
+def position_value_curve(knapsack):
+
+    """
+    function that returns the best value of a solved position at every budget (in 0.1m steps) up to its max cost,
+    -inf below the cheapest full position
+    """
+    return knapsack['last_row'][:, knapsack['count']]
+
+
+def optimum_players(eligible_players, position, maximum_cost, opt_metric, rolling=None):
+
+    """
+    function that returns the best players of a position given a max cost and metric to be optimized
+    """
+    knapsack = position_knapsack(eligible_players, position, maximum_cost, opt_metric, rolling)
+
+    final = knapsack['position_df'].iloc[selected_players(knapsack, maximum_cost)][SQUAD_COLUMNS + [opt_metric]]
+
+    return final.loc[:,~final.columns.duplicated()].copy()
+
+
+def optimum_keepers(eligible_players, maximum_cost, opt_metric, rolling=None):
     
     """
     function that returns the best keepers given a max cost and metric to be optimized
     """
-    max_cost = maximum_cost * 10
-    
-    gk_df = eligible_players[eligible_players['position'] == 'Goalkeeper']
-    gk_df = gk_df.reset_index()
-    goalkeepers = gk_df.index.tolist()
-    goalkeeper_costs = (gk_df['now_cost']).tolist()
-    goalkeeper_values = gk_df[opt_metric].tolist()
-    
-    cost_matrix = knapsack_solution(goalkeepers, goalkeeper_costs, goalkeeper_values, max_cost, 2)
-    
-    used_players = get_used_items(goalkeepers, goalkeeper_costs, goalkeeper_values, max_cost, 2, cost_matrix)
-    
-    player_indices = []
-    
-    for i in range(len(used_players)):
-        if used_players[i] == 1:
-            player_indices.append(i)
-        
-    players = pd.DataFrame()
-    
-    for index in range(len(player_indices)):
-        players = pd.concat([players, gk_df.iloc[[player_indices[index]]]])
-        
-    final = players[['first_name', 'second_name', 'name', 'team_name', 'position', 'selected_by_percent', 'actual_cost', 'total_points', opt_metric]]
-    
-    return final.loc[:,~final.columns.duplicated()].copy()
+    return optimum_players(eligible_players, 'Goalkeeper', maximum_cost, opt_metric, rolling)
 
 
-def optimum_defence(eligible_players, maximum_cost, opt_metric):
+def optimum_defence(eligible_players, maximum_cost, opt_metric, rolling=None):
 
     """
     function that returns the best defenders given a max cost and metric to be optimized
     """
-    max_cost = maximum_cost * 10
-    
-    def_df = eligible_players[eligible_players['position'] == 'Defender']
-    def_df = def_df.reset_index()
-    defenders = def_df.index.tolist()
-    defender_costs = (def_df['now_cost']).tolist()
-    defender_values = def_df[opt_metric].tolist()
-    
-    cost_matrix = knapsack_solution(defenders, defender_costs, defender_values, max_cost, 5)
-    
-    used_players = get_used_items(defenders, defender_costs, defender_values, max_cost, 5, cost_matrix)
-    
-    player_indices = []
-    
-    for i in range(len(used_players)):
-        if used_players[i] == 1:
-            player_indices.append(i)
-        
-    players = pd.DataFrame()
-    
-    for index in range(len(player_indices)):
-        players = pd.concat([players, def_df.iloc[[player_indices[index]]]])
-        
-    final = players[['first_name', 'second_name', 'name', 'team_name', 'position', 'selected_by_percent', 'actual_cost', 'total_points', opt_metric]]
-    
-    return final.loc[:,~final.columns.duplicated()].copy()
+    return optimum_players(eligible_players, 'Defender', maximum_cost, opt_metric, rolling)
 
 
-def optimum_midfield(eligible_players, maximum_cost, opt_metric):
+def optimum_midfield(eligible_players, maximum_cost, opt_metric, rolling=None):
     
     """
     function that returns the best midfielders given a max cost and metric to be optimized
     """
-    max_cost = maximum_cost * 10
-    
-    mid_df = eligible_players[eligible_players['position'] == 'Midfielder']
-    mid_df = mid_df.reset_index()
-    midfielders = mid_df.index.tolist()
-    midfielder_costs = (mid_df['now_cost']).tolist()
-    midfielder_values = mid_df[opt_metric].tolist()
-    
-    cost_matrix = knapsack_solution(midfielders, midfielder_costs, midfielder_values, max_cost, 5)
-    
-    used_players = get_used_items(midfielders, midfielder_costs, midfielder_values, max_cost, 5, cost_matrix)
-    
-    player_indices = []
-    
-    for i in range(len(used_players)):
-        if used_players[i] == 1:
-            player_indices.append(i)
-        
-    players = pd.DataFrame()
-    
-    for index in range(len(player_indices)):
-        players = pd.concat([players, mid_df.iloc[[player_indices[index]]]])
-        
-    final = players[['first_name', 'second_name', 'name', 'team_name', 'position', 'selected_by_percent', 'actual_cost', 'total_points', opt_metric]]
-    
-    return final.loc[:,~final.columns.duplicated()].copy()
+    return optimum_players(eligible_players, 'Midfielder', maximum_cost, opt_metric, rolling)
 
 
-def optimum_attack(eligible_players, maximum_cost, opt_metric):
+def optimum_attack(eligible_players, maximum_cost, opt_metric, rolling=None):
     
     """
     function that returns the best attackers given a max cost and metric to be optimized
     """
-    max_cost = maximum_cost * 10
-    
-    att_df = eligible_players[eligible_players['position'] == 'Forward']
-    att_df = att_df.reset_index()
-    attackers = att_df.index.tolist()
-    attacker_costs = (att_df['now_cost']).tolist()
-    attacker_values = att_df[opt_metric].tolist()
-    
-    cost_matrix = knapsack_solution(attackers, attacker_costs, attacker_values, max_cost, 3)
-    
-    used_players = get_used_items(attackers, attacker_costs, attacker_values, max_cost, 3, cost_matrix)
-    
-    player_indices = []
-    
-    for i in range(len(used_players)):
-        if used_players[i] == 1:
-            player_indices.append(i)
-        
-    players = pd.DataFrame()
-    
-    for index in range(len(player_indices)):
-        players = pd.concat([players, att_df.iloc[[player_indices[index]]]])
-        
-    final = players[['first_name', 'second_name', 'name', 'team_name', 'position', 'selected_by_percent', 'actual_cost', 'total_points', opt_metric]]
-    
-    return final.loc[:,~final.columns.duplicated()].copy()
+    return optimum_players(eligible_players, 'Forward', maximum_cost, opt_metric, rolling)
 
 
 def print_all_sum_rec(target, current_sum, start, output, result):
@@ -218,57 +503,1444 @@ def cost_breakdown(number):
     """
     Function that selects only the combinations with 4 numbers
     """
-    breakdown = print_all_sum(number)
+    # the same ascending combinations print_all_sum produces, generated directly instead of through every partition
     combinations = []
-    for i in breakdown:
-        if len(i) == 4:
-            if (i[0] >= 8) and (i[1] >= 25) and (i[2] >= 30) and (i[3] >= 20):
-                combinations.append(i)
+    for gk in range(4, number):
+        for dfnc in range(gk, number):
+            for mid in range(dfnc, number):
+                att = number - gk - dfnc - mid
+                if att < mid:
+                    break
+                if (gk >= 8) and (dfnc >= 25) and (mid >= 30) and (att >= 20):
+                    combinations.append([gk, dfnc, mid, att])
     return combinations
 
 
-def best_cost_breakdown(eligible_players, opt_metric):
+def position_knapsacks(eligible_players, maximum_costs, opt_metric, rolling=None):
     """
-    Function that returns the best cost breakdown (keepers - defence - midfield - attack) for the chosen metric
+    Function that solves each position once (keepers - defence - midfield - attack) up to its max cost
     """
-    costs_combinations = cost_breakdown(100)
+    return [position_knapsack(eligible_players, position, maximum_cost, opt_metric, rolling)
+            for position, maximum_cost in zip(POSITION_COUNTS, maximum_costs)]
+
+
+def position_knapsacks_many(eligible_players, maximum_costs, metrics):
+    """
+    Function that solves each position once for all the metrics and returns the position_knapsacks of every metric
+
+    Position filtering, costs and the knapsack loop are shared, metrics are chunked so that no table grows past
+    KNAPSACK_MEMORY_LIMIT. Players are kept when they aren't dominated for at least one of the metrics
+    """
+    knapsacks = {metric: [] for metric in metrics}
+
+    for position, maximum_cost in zip(POSITION_COUNTS, maximum_costs):
+        max_cost = int(round(maximum_cost * 10))
+        count = POSITION_COUNTS[position]
+
+        position_df = eligible_players[eligible_players['position'] == position]
+        pool_size = len(position_df)
+        position_df = prune_dominated_players(position_df, metrics).reset_index()
+        players = position_df.index.tolist()
+        player_costs = position_df['now_cost'].tolist()
+
+        chunk = max(1, KNAPSACK_MEMORY_LIMIT // max(1, knapsack_memory_bytes(len(players), max_cost, count)))
+        for start in range(0, len(metrics), chunk):
+            chunk_metrics = list(metrics[start:start+chunk])
+            cost_matrix = knapsack_solution_many(players, player_costs, position_df[chunk_metrics].to_numpy(dtype=np.float64), max_cost, count)
+
+            for m, metric in enumerate(chunk_metrics):
+                knapsacks[metric].append({
+                    'position_df': position_df, 'players': players, 'player_costs': player_costs,
+                    'player_values': position_df[metric].tolist(), 'max_cost': max_cost, 'count': count, 'rolling': False,
+                    'pruned': pool_size - len(players),
+                    'cost_matrix': cost_matrix[:, m],
+                    'last_row': cost_matrix[-1, m] if len(players) > 0 else empty_last_row(max_cost, count),
+                })
+
+    return knapsacks
+
+
+def squad_from_knapsacks(knapsacks, costs, opt_metric):
+    """
+    Function that returns the squad picked from solved positions for a cost breakdown
+    """
+    final_squad = []
+    for knapsack, cost in zip(knapsacks, costs):
+        players = knapsack['position_df'].iloc[selected_players(knapsack, cost)][SQUAD_COLUMNS + [opt_metric]]
+        final_squad.append(players.loc[:,~players.columns.duplicated()])
+
+    return pd.concat(final_squad).reset_index(drop=True)
+
+
+def score_cost_breakdown(knapsacks, costs_combinations, opt_metric):
+    """
+    Function that returns the best of the given cost breakdowns, read off the already solved positions
+
+    Breakdowns with a budget too small for a full position are left out
+    """
+    player_costs = [knapsack['position_df']['actual_cost'].to_numpy() for knapsack in knapsacks]
+    player_values = [knapsack['position_df'][opt_metric].to_numpy() for knapsack in knapsacks]
+
+    # breakdowns share most of their per-position budgets, so each one is only walked back once
+    selections = {}
+    rows = []
 
-    comb_df = pd.DataFrame(columns = ['costs', 'total_cost', opt_metric])
-    
     for costs in costs_combinations:
-        
-        gk = optimum_keepers(eligible_players, costs[0], opt_metric)
-        dfnc = optimum_defence(eligible_players, costs[1], opt_metric)
-        mid = optimum_midfield(eligible_players, costs[2], opt_metric)
-        att = optimum_attack(eligible_players, costs[3], opt_metric)
-        
-        final = pd.concat([gk, dfnc, mid, att])
-        total_cost = final['actual_cost'].sum()
-        optimized_metric = final[opt_metric].sum()
+
+        for position, cost in enumerate(costs):
+            if (position, cost) not in selections:
+                selections[(position, cost)] = selected_players(knapsacks[position], cost)
+        indices = [selections[(position, cost)] for position, cost in enumerate(costs)]
+        if any(len(selection) != knapsack['count'] for selection, knapsack in zip(indices, knapsacks)):
+            continue
+
+        # summed in squad order so totals (and ties) come out exactly as when the squad frame was summed
+        total_cost = np.concatenate([c[i] for c, i in zip(player_costs, indices)]).sum()
+        optimized_metric = np.concatenate([v[i] for v, i in zip(player_values, indices)]).sum()
         cost_details = [costs, total_cost, optimized_metric]
-        
-        comb_df.loc[len(comb_df)] = cost_details
+
+        rows.append(cost_details)
+
+    OPTIMIZER_STATS['splits_tried'] += len(rows)
+    if not rows:
+        raise ValueError('no squad fits the budget and position constraints')
+
+    comb_df = pd.DataFrame(rows, columns = ['costs', 'total_cost', opt_metric])
 
     comb_df[opt_metric] = pd.to_numeric(comb_df[opt_metric])
 
     return comb_df.sort_values(by=[opt_metric], ascending=False).reset_index(drop=True).head(1)
 
 
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def best_cost_breakdown(eligible_players, opt_metric, rolling=None):
+    """
+    Function that returns the best cost breakdown (keepers - defence - midfield - attack) for the chosen metric
+
+    Each position is solved once up to the largest budget it gets in any breakdown
+    """
+    costs_combinations = cost_breakdown(100)
+
+    with fpl_profiling.stage('knapsacks', OPTIMIZER_STATS):
+        knapsacks = position_knapsacks(eligible_players, np.max(costs_combinations, axis=0), opt_metric, rolling)
+
+    with fpl_profiling.stage('split_search', OPTIMIZER_STATS):
+        return score_cost_breakdown(knapsacks, costs_combinations, opt_metric)
 
-def squad_optimizer(eligible_players, opt_metric):
 
+def max_plus_convolution(first, second, length=None):
     """
-    Final function that returns the optimized squad
+    Function that returns result[s] = max(first[i] + second[s-i]) and the smallest i achieving it, for s below length
     """
-    costs = best_cost_breakdown(eligible_players, opt_metric)['costs'].iloc[0]
-    
-    keepers = optimum_keepers(eligible_players, costs[0], opt_metric)
-    defence = optimum_defence(eligible_players, costs[1], opt_metric)
-    midfield = optimum_midfield(eligible_players, costs[2], opt_metric)
-    attack = optimum_attack(eligible_players, costs[3], opt_metric)
+    if length is None:
+        length = len(first) + len(second) - 1
+
+    # row s of the reversed sliding windows holds second[s-i] for every i
+    padded = np.concatenate([np.full(len(first) - 1, -np.inf), second, np.full(max(0, length - len(second)), -np.inf)])
+    candidate = np.lib.stride_tricks.sliding_window_view(padded, len(first))[:length, ::-1] + first
+
+    first_share = np.argmax(candidate, axis=1)
+    result = candidate[np.arange(length), first_share]
+
+    return result, first_share
+
+
+def combine_value_curves(curves, max_cost):
+    """
+    Function that returns the best budget per curve for a total max cost and the combined value
+
+    The curves are combined with max-plus convolutions, so every split of the budget is considered.
+    The value is -inf when no split is feasible
+    """
+    combined = curves[0][:max_cost+1]
+    shares = []
+
+    for curve in curves[1:]:
+        # value curves are -inf up to the cheapest budget and non-decreasing after it, so only the budgets
+        # between that and the first one reaching the curve's best value need to be tried
+        low = int(np.argmax(combined > -np.inf))
+        high = int(np.argmax(combined))
+        partial, first_share = max_plus_convolution(combined[low:high+1], curve[:max_cost+1], max_cost+1-low)
+        combined = np.concatenate([np.full(low, -np.inf), partial])
+        shares.append(np.concatenate([np.zeros(low, dtype=np.int64), first_share + low]))
+
+    total = int(np.argmax(combined))
+    value = combined[total]
+
+    # walk back from the last curve to split the total
+    budgets = []
+    for first_share in reversed(shares):
+        budgets.append(total - first_share[total])
+        total = first_share[total]
+    budgets.append(total)
+
+    return budgets[::-1], value
+
+
+def best_budget_split(knapsacks, max_cost):
+    """
+    Function that returns the best budget per position (in 0.1m steps) for a total max cost and its value
+
+    The value curves of the positions are combined with combine_value_curves, so every split of the budget
+    is considered. The curves are -inf at budgets too small for a full position, so those are ruled out
+    """
+    curves = [position_value_curve(knapsack) for knapsack in knapsacks]
+
+    budgets, value = combine_value_curves(curves, max_cost)
+    if value == -np.inf:
+        raise ValueError('no squad fits the budget and position constraints')
+
+    return budgets, value
+
+
+def solver_settings(solver, max_per_club=3, budget=100):
+    """
+    Function that returns the settings that decide a squad for a solver, as part of its cache key
+    """
+    if solver == 'joint':
+        return (SQUAD_CACHE_VERSION, 'joint', max_per_club, budget)
+    return (SQUAD_CACHE_VERSION, solver)
+
+
+def squad_cache_key(eligible_players, opt_metric, settings):
+    """
+    Function that returns the content hash of everything a squad depends on: the player columns the solvers
+    read, the metric and the solver settings
+    """
+    columns = list(dict.fromkeys(['id', 'position', 'now_cost', 'team_name', opt_metric]))
+    row_hashes = pd.util.hash_pandas_object(eligible_players[columns], index=False).to_numpy()
+
+    digest = hashlib.sha256(row_hashes.tobytes())
+    digest.update(repr((columns, settings)).encode())
+    return digest.hexdigest()
+
+
+def squad_player_ids(squad, eligible_players):
+    """
+    Function that returns the ids of a squad's players, matched on name, club and position like the upload script
+    matches them, or None when a player doesn't match exactly one id
+    """
+    keys = ['first_name', 'second_name', 'team_name', 'position']
+    matched = pd.merge(squad[keys], eligible_players[keys + ['id']].drop_duplicates(), on=keys, how='left')
+    if len(matched) != len(squad) or matched['id'].isna().any():
+        return None
+    return matched['id'].tolist()
+
+
+def evict_squad_cache(cache_dir, max_bytes=SQUAD_CACHE_MAX_BYTES, max_age=SQUAD_CACHE_MAX_AGE):
+    """
+    Function that deletes cached squads older than max_age seconds, then the oldest ones until under max_bytes
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    now = time.time()
+
+    for modified, size, path in entries:
+        if now - modified <= max_age and total_bytes <= max_bytes:
+            break
+        os.remove(path)
+        total_bytes -= size
+
+
+def cached_squads(eligible_players, metrics, settings, cache_dir, solve):
+    """
+    Function that returns the squad of each metric from the on-disk cache, calling solve(metrics) for the misses
+    and caching what it returns
+
+    Only the ids of a squad are cached. On a hit its rows are taken from the current pool, so columns the solvers
+    don't read (names, points, ownership) are always current
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = {metric: squad_cache_key(eligible_players, metric, settings) for metric in metrics}
+    current_players = eligible_players.set_index('id', drop=False)
+
+    squads = {}
+    for metric, key in keys.items():
+        path = os.path.join(cache_dir, key + '.pkl')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                squad_ids = pickle.load(f)['squad_ids']
+            final = current_players.loc[squad_ids][SQUAD_COLUMNS + [metric]]
+            squads[metric] = final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+
+    missing = [metric for metric in metrics if metric not in squads]
+    SQUAD_CACHE_STATS['hits'] += len(squads)
+    SQUAD_CACHE_STATS['misses'] += len(missing)
+    logger.info('squad cache: %d hits, %d misses (%d hits, %d misses this process)', len(squads), len(missing),
+                SQUAD_CACHE_STATS['hits'], SQUAD_CACHE_STATS['misses'])
+
+    if missing:
+        solved = solve(missing)
+        for metric in missing:
+            squads[metric] = solved[metric]
+            squad_ids = squad_player_ids(solved[metric], eligible_players)
+            if squad_ids is not None:
+                fpl_api.write_atomic(os.path.join(cache_dir, keys[metric] + '.pkl'), pickle.dumps({'squad_ids': squad_ids}))
+        evict_squad_cache(cache_dir)
+
+    return {metric: squads[metric] for metric in metrics}
+
+
+def squad_optimizer(eligible_players, opt_metric, rolling=None, split_search='breakdown', cache_dir=None):
+
+    """
+    Final function that returns the optimized squad
+
+    split_search='breakdown' keeps the whole-million cost breakdowns of cost_breakdown.
+    split_search='convolution' searches every 0.1m split of the 100.0m budget with best_budget_split.
+    With a cache_dir, an unchanged player pool returns the squad cached by an earlier run
+    """
+    if cache_dir is not None:
+        return cached_squads(eligible_players, [opt_metric], solver_settings(split_search), cache_dir,
+                             lambda metrics: {opt_metric: squad_optimizer(eligible_players, opt_metric, rolling, split_search)})[opt_metric]
+
+    if split_search == 'convolution':
+        knapsacks = position_knapsacks(eligible_players, [100] * len(POSITION_COUNTS), opt_metric, rolling)
+        budgets, _ = best_budget_split(knapsacks, 1000)
+        costs = [budget / 10 for budget in budgets]
+    else:
+        costs_combinations = cost_breakdown(100)
+        knapsacks = position_knapsacks(eligible_players, np.max(costs_combinations, axis=0), opt_metric, rolling)
+        costs = score_cost_breakdown(knapsacks, costs_combinations, opt_metric)['costs'].iloc[0]
+
+    logger.info('dominance pruning removed %d of %d players', sum(knapsack['pruned'] for knapsack in knapsacks),
+                sum(knapsack['pruned'] + len(knapsack['players']) for knapsack in knapsacks))
+
+    return squad_from_knapsacks(knapsacks, costs, opt_metric)
+
+
+def squad_is_legal(positions, clubs=None, max_per_club=None):
+    """
+    Function that tells whether players with these positions make a squad: SQUAD_SIZE players with POSITION_COUNTS
+    of each position and, given their clubs and a max_per_club, no more than that from a club
+    """
+    positions = list(positions)
+    if len(positions) != SQUAD_SIZE or any(positions.count(position) != count for position, count in POSITION_COUNTS.items()):
+        return False
+    if max_per_club is not None and np.unique(np.asarray(clubs), return_counts=True)[1].max() > max_per_club:
+        return False
+    return True
+
+
+def check_squad(squad, name, max_per_club=3):
+    """
+    Function that raises a ValueError when a squad frame is not a legal squad (see squad_is_legal), so a broken
+    squad is never loaded
+    """
+    if not squad_is_legal(squad['position'], squad['team_name'], max_per_club):
+        raise ValueError('{} is not a legal squad: {} players, {} by position and at most {} from a club'.format(
+            name, len(squad), squad['position'].value_counts().to_dict(), squad['team_name'].value_counts().max()))
+
+
+def squad_pool(players, opt_metric=None):
+    """
+    Function that returns the arrays the club-capped solvers work on for players indexed from 0: positions,
+    costs, values of the metric (when given) and club codes
+    """
+    pool = {
+        'positions': players['position'].to_numpy(),
+        'costs': players['now_cost'].to_numpy(dtype=np.int64),
+        'clubs': pd.factorize(players['team_name'])[0],
+    }
+    if opt_metric is not None:
+        pool['values'] = players[opt_metric].to_numpy(dtype=np.float64)
+    pool['num_clubs'] = pool['clubs'].max() + 1 if len(players) > 0 else 0
+    return pool
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def squad_optimizer_topk(eligible_players, opt_metric, k=10, max_per_club=3, budget=100):
+
+    """
+    Final function that returns the k best distinct squads as one frame ranked by squad_rank, best first, with each
+    squad's total in squad_value
+
+    With a max_per_club these are the squads of joint_squad_optimizer (every 0.1m split of the budget, club cap), see
+    ranked_capped_squads, and rank 1 is its squad. max_per_club=None ranks the squads of squad_optimizer instead
+    (whole-million cost breakdowns, no club cap), see ranked_breakdown_squads. Players are pruned with
+    dominated_players for the k best squads, so every squad of the top k keeps its players
+    """
+    if max_per_club is None:
+        ranked = ranked_breakdown_squads(eligible_players, opt_metric, k)
+    else:
+        pruned = prune_dominated_players(eligible_players, opt_metric, max_per_club, rank=k)
+        players = pruned.reset_index(drop=True)
+        ranked = [(value, pruned.index[squad]) for value, squad in
+                  ranked_capped_squads(squad_pool(players, opt_metric), k, max_per_club, int(round(budget * 10)))]
+
+    frames = []
+    for squad_rank, (value, squad) in enumerate(ranked, start=1):
+        final = eligible_players.loc[list(squad)][SQUAD_COLUMNS + [opt_metric]]
+        final = final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+        frames.append(final.assign(squad_rank=squad_rank, squad_value=value))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def ranked_breakdown_squads(eligible_players, opt_metric, k):
+
+    """
+    Function that returns the k best distinct squads of squad_optimizer's whole-million cost breakdowns, without the
+    club cap, as (value, index labels) pairs best first
+
+    Each position is solved once with knapsack_solution_topk up to the largest budget it gets in any breakdown.
+    Every breakdown then combines the k best selections of its positions, and a squad found under several
+    breakdowns is only kept once
+    """
+    costs_combinations = cost_breakdown(100)
+    maximum_costs = np.max(costs_combinations, axis=0)
+
+    positions = []
+    for (position, count), maximum_cost in zip(POSITION_COUNTS.items(), maximum_costs):
+        position_df = eligible_players[eligible_players['position'] == position]
+        position_df = position_df[~dominated_players(position_df['now_cost'], position_df[opt_metric], count, rank=k)]
+        max_cost = int(round(maximum_cost * 10))
+        topk = knapsack_solution_topk(position_df.index, position_df['now_cost'], position_df[opt_metric], max_cost, count, k)
+        positions.append((position_df, count, topk))
+
+    selections = {}
+    squads = {}
+
+    for costs in costs_combinations:
+        lists = []
+        for position, cost in enumerate(costs):
+            if (position, cost) not in selections:
+                position_df, count, (values, took, rank) = positions[position]
+                selections[(position, cost)] = get_used_items_topk(position_df['now_cost'], count, int(round(cost * 10)), values, took, rank)
+            lists.append(selections[(position, cost)])
+        if any(len(selection) == 0 for selection in lists):
+            continue
+
+        # the k best sums over the positions' k-lists
+        totals = np.zeros(1)
+        for selection in lists:
+            totals = np.add.outer(totals, [value for value, _ in selection]).ravel()
+        best = np.argsort(-totals, kind='stable')[:k]
+
+        for flat in best:
+            picks = np.unravel_index(flat, [len(selection) for selection in lists])
+            squad = tuple(positions[position][0].index[i] for position, pick in enumerate(picks) for i in lists[position][pick][1])
+            squads.setdefault(frozenset(squad), (totals[flat], squad))
+
+    return sorted(squads.values(), key=lambda entry: -entry[0])[:k]
+
+
+def ranked_capped_squads(pool, k, max_per_club, max_cost):
+
+    """
+    Function that returns the k best distinct squads under the club cap as (value, row positions) pairs, best first,
+    each in squad order
+
+    Lawler's partitioning over capped_squad: once the best squad of a subproblem (players forced in and excluded)
+    is ranked, every other squad of that subproblem lacks one of its free players, so the subproblems forcing
+    in its first j free players and excluding the next one hold all of them, each exactly once. The best squad
+    of every subproblem waits in a heap, and the knapsacks and club multipliers are shared by all the solves
+    """
+    plain_cache, bounds = {}, {}
+    nodes = []
+    tie_breaker = itertools.count()
+
+    def push(forced, excluded):
+        solution = capped_squad(pool, forced, excluded, max_per_club, max_cost, plain_cache, bounds)
+        if solution is not None:
+            squad = sorted(solution[0], key=lambda i: (list(POSITION_COUNTS).index(pool['positions'][i]), i))
+            heapq.heappush(nodes, (-solution[1], next(tie_breaker), forced, excluded, squad))
+
+    push(frozenset(), frozenset())
+    ranked = []
+
+    while nodes and len(ranked) < k:
+        negative_value, _, forced, excluded, squad = heapq.heappop(nodes)
+        ranked.append((-negative_value, squad))
+        if len(ranked) == k:
+            break
+
+        free_players = [i for i in squad if i not in forced]
+        for j, player in enumerate(free_players):
+            push(forced | frozenset(free_players[:j]), excluded | {player})
+
+    logger.debug('ranked %d capped squads, %d position knapsacks solved', len(ranked), len(plain_cache) + len(bounds.get('cache', {})))
+
+    return ranked
+
+
+def position_spend_cap(player_costs, count, max_cost):
+    """
+    Function that returns the most a position can usefully spend: the cost of its count most expensive players
+    """
+    return min(max_cost, int(np.sort(player_costs)[::-1][:count].sum()))
+
+
+def relaxed_squad(pool, forced, excluded, max_per_club, max_cost, cache):
+    """
+    Function that returns the best squad (row positions) and its value with the forced players in, the excluded
+    players out and the club cap only applied to clubs the forced players already fill
+
+    Returns None when no squad fits. Position knapsacks are cached on the players they were solved over
+    """
+    forced = np.array(sorted(forced), dtype=np.int64)
+    available = np.ones(len(pool['costs']), dtype=bool)
+    available[forced] = False
+    available[list(excluded)] = False
+    full_clubs = np.bincount(pool['clubs'][forced], minlength=pool['num_clubs']) >= max_per_club
+    available &= ~full_clubs[pool['clubs']]
+
+    remaining_cost = max_cost - pool['costs'][forced].sum()
+    if remaining_cost < 0:
+        return None
+
+    solves = []
+    curves = []
+    for position, count in POSITION_COUNTS.items():
+        need = count - int((pool['positions'][forced] == position).sum())
+        indices = np.flatnonzero(available & (pool['positions'] == position))
+        if need < 0 or len(indices) < need:
+            return None
+
+        position_cost = position_spend_cap(pool['costs'][indices], need, max_cost)
+
+        key = (position, need, indices.tobytes())
+        if key not in cache:
+            cache[key] = knapsack_solution(indices, pool['costs'][indices], pool['values'][indices], position_cost, need) if need > 0 else None
+        cost_matrix = cache[key]
+
+        curve = cost_matrix[-1][:, need] if need > 0 else np.zeros(1)
+        curves.append(np.pad(curve, (0, max_cost+1-len(curve)), mode='edge'))
+        solves.append((indices, need, cost_matrix, position_cost))
+
+    budgets, value = combine_value_curves(curves, remaining_cost)
+    if value == -np.inf:
+        return None
+
+    squad = forced.tolist()
+    for (indices, need, cost_matrix, position_cost), budget in zip(solves, budgets):
+        if need > 0:
+            used_players = get_used_items(indices, pool['costs'][indices], pool['values'][indices], min(budget, position_cost), need, cost_matrix)
+            squad += indices[np.flatnonzero(used_players)].tolist()
+
+    return squad, value + pool['values'][forced].sum()
+
+
+def club_multipliers(pool, max_per_club, max_cost, iterations=30):
+    """
+    Function that returns a Lagrange multiplier per club for the club cap, found with subgradient steps
+
+    With each club's multiplier taken off its players' values, relaxed_squad plus max_per_club times the sum of
+    the multipliers still bounds the best squad under the cap, usually much more tightly than dropping the cap
+    """
+    multipliers = np.zeros(pool['num_clubs'])
+    best_multipliers, best_bound = multipliers, np.inf
+    step = None
+
+    for iteration in range(iterations):
+        penalized = dict(pool, values=pool['values'] - multipliers[pool['clubs']])
+        squad, value = relaxed_squad(penalized, frozenset(), frozenset(), max_per_club, max_cost, {})
+        bound = value + max_per_club * multipliers.sum()
+        if bound < best_bound:
+            best_multipliers, best_bound = multipliers, bound
+
+        over = np.bincount(pool['clubs'][squad], minlength=pool['num_clubs']) - max_per_club
+        if (over <= 0).all() and (multipliers[over < 0] == 0).all():
+            # the squad keeps to the cap and reaches the bound, so nothing tighter exists
+            break
+
+        if step is None:
+            # a tenth of the average player value in the squad
+            step = abs(value) / (10 * len(squad))
+        multipliers = np.maximum(0, multipliers + step * over / (iteration + 1))
+
+    return best_multipliers
+
+
+def capped_squad(pool, forced, excluded, max_per_club, max_cost, plain_cache, bounds):
+    """
+    Function that returns the best squad (row positions) and its value with the forced players in, the excluded
+    players out and at most max_per_club players of a club, None when no squad fits
+
+    Branch and bound over the position knapsacks. A node's bound is relaxed_squad with the club multipliers
+    taken off the player values, and a node whose squad breaks the cap is split on the players of that club
+    so that every child keeps at most max_per_club of them. Nodes are expanded best bound first, so the first
+    squad that respects the cap and reaches its node's bound is optimal. The multipliers and the knapsacks solved
+    with them are kept in bounds, so later calls over the same pool reuse them
+    """
+    solution = relaxed_squad(pool, forced, excluded, max_per_club, max_cost, plain_cache)
+    if solution is None or np.bincount(pool['clubs'][solution[0]]).max() <= max_per_club:
+        return solution
+
+    if not bounds:
+        # the multipliers bound any squad under the cap, whatever players are forced in or excluded
+        multipliers = club_multipliers(pool, max_per_club, max_cost)
+        bounds.update(penalized=dict(pool, values=pool['values'] - multipliers[pool['clubs']]), cache={},
+                      offset=max_per_club * multipliers.sum())
+    penalized, penalized_cache, offset = bounds['penalized'], bounds['cache'], bounds['offset']
+
+    nodes = []
+    tie_breaker = itertools.count()
+
+    def push(forced, excluded):
+        solution = relaxed_squad(penalized, forced, excluded, max_per_club, max_cost, penalized_cache)
+        if solution is not None:
+            heapq.heappush(nodes, (-(solution[1] + offset), next(tie_breaker), forced, excluded, solution[0], False))
+
+    push(forced, excluded)
+    explored = 0
+
+    while nodes:
+        negative_bound, _, forced, excluded, squad, plain = heapq.heappop(nodes)
+        explored += 1
+
+        club_counts = np.bincount(pool['clubs'][squad], minlength=pool['num_clubs'])
+        club = int(np.argmax(club_counts))
+
+        if club_counts[club] <= max_per_club:
+            value = pool['values'][squad].sum()
+            if plain or value >= -negative_bound - 1e-9 * max(1, abs(negative_bound)):
+                logger.debug('club branch and bound: %d nodes explored, %d position knapsacks solved', explored, len(penalized_cache))
+                return squad, value
+            # keeps to the cap but falls short of the bound: bound the node without multipliers instead
+            solution = relaxed_squad(pool, forced, excluded, max_per_club, max_cost, plain_cache)
+            heapq.heappush(nodes, (-solution[1], next(tie_breaker), forced, excluded, solution[0], True))
+            continue
+
+        # children keep the first j free players of the club and drop the next one, the last keeps a full club
+        club_players = [i for i in squad if pool['clubs'][i] == club and i not in forced]
+        free_slots = max_per_club - sum(1 for i in forced if pool['clubs'][i] == club)
+        for j in range(free_slots):
+            push(forced | frozenset(club_players[:j]), excluded | {club_players[j]})
+        push(forced | frozenset(club_players[:free_slots]), excluded)
+
+    return None
+
+
+def joint_squad_optimizer(eligible_players, opt_metric, max_per_club=3, budget=100, plain_cache=None, prune=True, cache_dir=None):
+
+    """
+    Final function that returns the optimized squad, solving the positions, the budget and the club cap together
+    with the branch and bound of capped_squad.
+    plain_cache can carry position knapsacks already solved for this metric, see squad_optimizer_many.
+    prune drops the players dominated under the club cap first.
+    With a cache_dir, an unchanged player pool returns the squad cached by an earlier run
+    """
+    if cache_dir is not None:
+        return cached_squads(eligible_players, [opt_metric], solver_settings('joint', max_per_club, budget), cache_dir,
+                             lambda metrics: {opt_metric: joint_squad_optimizer(eligible_players, opt_metric, max_per_club, budget, plain_cache, prune)})[opt_metric]
+
+    players, squad = joint_squad_rows(eligible_players, opt_metric, max_per_club, budget, plain_cache, prune)
+    final = players.iloc[squad][SQUAD_COLUMNS + [opt_metric]]
+
+    return final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+
+
+def joint_squad_rows(eligible_players, opt_metric, max_per_club=3, budget=100, plain_cache=None, prune=True):
+    """
+    Function that returns the player pool joint_squad_optimizer solved over and the row positions of its squad,
+    in squad order
+    """
+    max_cost = int(round(budget * 10))
+    if prune:
+        eligible_players = prune_dominated_players(eligible_players, opt_metric, max_per_club)
+    players = eligible_players.reset_index(drop=True)
+    pool = squad_pool(players, opt_metric)
+    if plain_cache is None:
+        plain_cache = {}
+
+    solution = capped_squad(pool, frozenset(), frozenset(), max_per_club, max_cost, plain_cache, {})
+    if solution is None:
+        raise ValueError('no squad fits the budget, position and club constraints')
+
+    squad = solution[0]
+    squad = sorted(squad, key=lambda i: (list(POSITION_COUNTS).index(pool['positions'][i]), i))
+    if not squad_is_legal(pool['positions'][squad], pool['clubs'][squad], max_per_club):
+        raise ValueError('joint squad optimizer picked {} players, not a squad within the position and club constraints'.format(len(squad)))
+
+    return players, squad
+
+
+def root_knapsacks_many(players, metrics, budget=100):
+    """
+    Function that returns, for each metric, the root position knapsacks relaxed_squad would solve over players
+    (indexed from 0), keyed the way relaxed_squad caches them. All metrics are solved together through
+    knapsack_solution_many, in chunks that keep each table under KNAPSACK_MEMORY_LIMIT
+    """
+    max_cost = int(round(budget * 10))
+    positions = players['position'].to_numpy()
+    costs = players['now_cost'].to_numpy(dtype=np.int64)
+    plain_caches = {metric: {} for metric in metrics}
+
+    for position, count in POSITION_COUNTS.items():
+        indices = np.flatnonzero(positions == position)
+        if len(indices) < count:
+            continue
+        position_cost = position_spend_cap(costs[indices], count, max_cost)
+        position_players = players.iloc[indices]
+        chunk = max(1, KNAPSACK_MEMORY_LIMIT // max(1, knapsack_memory_bytes(len(indices), position_cost, count)))
+        for start in range(0, len(metrics), chunk):
+            chunk_metrics = metrics[start:start+chunk]
+            cost_matrix = knapsack_solution_many(indices, costs[indices], position_players[chunk_metrics].to_numpy(dtype=np.float64), position_cost, count)
+            for m, metric in enumerate(chunk_metrics):
+                plain_caches[metric][(position, count, indices.tobytes())] = cost_matrix[:, m]
+
+    return plain_caches
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def squad_optimizer_many(eligible_players, metrics, solver='joint', max_per_club=3, cache_dir=None):
+
+    """
+    Final function that returns the optimized squad for each metric, as a dict of metric to squad
+
+    solver='joint' gives the squads of joint_squad_optimizer, 'breakdown' and 'convolution' the squads of
+    squad_optimizer with that split_search. Every position is filtered and solved once for all the metrics
+    through knapsack_solution_many, only the split search (and the club branch and bound) runs per metric.
+    With a cache_dir, only the metrics missing from the cache are solved
+    """
+    metrics = list(dict.fromkeys(metrics))
+
+    if cache_dir is not None:
+        return cached_squads(eligible_players, metrics, solver_settings(solver, max_per_club), cache_dir,
+                             lambda missing: squad_optimizer_many(eligible_players, missing, solver, max_per_club))
+
+    if solver == 'joint':
+        with fpl_profiling.stage('knapsacks', OPTIMIZER_STATS):
+            players = prune_dominated_players(eligible_players, metrics, max_per_club).reset_index(drop=True)
+            plain_caches = root_knapsacks_many(players, metrics)
+
+        with fpl_profiling.stage('club_branch_and_bound', OPTIMIZER_STATS):
+            return {metric: joint_squad_optimizer(players, metric, max_per_club, plain_cache=plain_caches[metric], prune=False) for metric in metrics}
+
+    if solver == 'convolution':
+        with fpl_profiling.stage('knapsacks', OPTIMIZER_STATS):
+            knapsacks = position_knapsacks_many(eligible_players, [100] * len(POSITION_COUNTS), metrics)
+        with fpl_profiling.stage('split_search', OPTIMIZER_STATS):
+            costs = {metric: [budget / 10 for budget in best_budget_split(knapsacks[metric], 1000)[0]] for metric in metrics}
+    else:
+        costs_combinations = cost_breakdown(100)
+        with fpl_profiling.stage('knapsacks', OPTIMIZER_STATS):
+            knapsacks = position_knapsacks_many(eligible_players, np.max(costs_combinations, axis=0), metrics)
+        with fpl_profiling.stage('split_search', OPTIMIZER_STATS):
+            costs = {metric: score_cost_breakdown(knapsacks[metric], costs_combinations, metric)['costs'].iloc[0] for metric in metrics}
+
+    return {metric: squad_from_knapsacks(knapsacks[metric], costs[metric], metric) for metric in metrics}
+
+
+# player pool of a worker process, set once by init_optimizer_worker
+_worker_players = None
+
+
+def init_optimizer_worker(eligible_players):
+    """
+    Function that keeps the player pool in a worker process so tasks only carry the metric
+    """
+    global _worker_players
+    _worker_players = eligible_players
+
+
+def optimize_metrics_in_worker(metrics, solver, max_per_club):
+    """
+    Function that returns the optimized squads of some metrics from the worker's player pool, the CPU seconds it took
+    and how much the worker's OPTIMIZER_STATS grew
+    """
+    start = time.process_time()
+    stats_before = dict(OPTIMIZER_STATS)
+    squads = squad_optimizer_many(_worker_players, metrics, solver, max_per_club)
+    return squads, time.process_time() - start, {stat: OPTIMIZER_STATS[stat] - stats_before[stat] for stat in OPTIMIZER_STATS}
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def squad_optimizer_parallel(eligible_players, metrics, solver='joint', max_per_club=3, max_workers=None, cache_dir=None):
+
+    """
+    Final function that returns the optimized squad for each metric, with the metrics spread over a process pool
+
+    The player pool is sent to each worker once through the pool initializer and each worker solves its share of
+    the metrics with squad_optimizer_many. The scaling efficiency (CPU time spent solving over wall time times
+    workers) is logged for every run. With a cache_dir, only the metrics missing from the cache are solved
+    """
+    metrics = list(dict.fromkeys(metrics))
+    if max_workers is not None and max_workers < 1:
+        raise ValueError('max_workers must be at least 1, got {}'.format(max_workers))
+    if not metrics:
+        return {}
+
+    if cache_dir is not None:
+        return cached_squads(eligible_players, metrics, solver_settings(solver, max_per_club), cache_dir,
+                             lambda missing: squad_optimizer_parallel(eligible_players, missing, solver, max_per_club, max_workers))
+
+    workers = min(max_workers if max_workers is not None else os.cpu_count() or 1, len(metrics))
+    chunks = [metrics[i::workers] for i in range(workers)]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_optimizer_worker, initargs=(eligible_players,)) as executor:
+        results = list(executor.map(optimize_metrics_in_worker, chunks, [solver] * workers, [max_per_club] * workers))
+    wall_time = time.perf_counter() - start
+
+    busy_time = sum(seconds for _, seconds, _ in results)
+    logger.info('optimized %d metrics on %d workers in %.2fs (%.2fs CPU solving), scaling efficiency %.0f%%',
+                len(metrics), workers, wall_time, busy_time, 100 * busy_time / (wall_time * workers))
+
+    # the workers' knapsack cells and splits count towards this process's totals
+    squads = {}
+    for chunk_squads, _, chunk_stats in results:
+        squads.update(chunk_squads)
+        for stat, value in chunk_stats.items():
+            OPTIMIZER_STATS[stat] += value
+
+    return {metric: squads[metric] for metric in metrics}
+
+
+def squad_snapshot_path(snapshot_dir, opt_metric, settings):
+    """
+    Function that returns the file the last player snapshot and squad of a metric and solver settings are kept in
+    """
+    name = hashlib.sha256(repr((opt_metric, settings)).encode()).hexdigest()
+    return os.path.join(snapshot_dir, 'snapshot_' + name + '.pkl')
+
+
+def player_deltas(previous, current, opt_metric):
+    """
+    Function that returns the ids of the players that joined, left and changed between two snapshots of the
+    player pool, comparing the columns the solver reads: position, now_cost, team_name and the metric
+    """
+    columns = ['position', 'now_cost', 'team_name', opt_metric]
+    # plain objects, so snapshots with different categories or dtypes still compare
+    previous = previous.set_index('id')[columns].astype(object)
+    current = current.set_index('id')[columns].astype(object)
+
+    added = current.index.difference(previous.index)
+    removed = previous.index.difference(current.index)
+    common = current.index.intersection(previous.index)
+
+    old, new = previous.loc[common], current.loc[common]
+    unchanged = ((old == new) | (old.isna() & new.isna())).all(axis=1).to_numpy()
+
+    return added, removed, common[~unchanged]
+
+
+def previous_squad_holds(previous, current, squad_ids, opt_metric, max_per_club):
+    """
+    Function that tells whether the squad that was optimal for the previous snapshot is still optimal for the current one
+
+    It holds when the squad players are all still there with the same position, club and cost and no less value,
+    and every other player that joined or changed is dominated in the current pool, or kept their position and
+    club, got no cheaper and gained no value. Any other squad then gained no more than the previous squad did
+    """
+    added, removed, changed = player_deltas(previous, current, opt_metric)
+    if len(added) == 0 and len(removed) == 0 and len(changed) == 0:
+        return True
+
+    squad_ids = pd.Index(squad_ids)
+    if squad_ids.isin(removed).any():
+        return False
+
+    columns = ['position', 'now_cost', 'team_name', opt_metric]
+    old = previous.set_index('id')[columns]
+    new = current.set_index('id')[columns]
+
+    # players that can't be in an optimal squad of the current pool can change freely
+    dominated = pd.Series(False, index=new.index)
+    for position, count in POSITION_COUNTS.items():
+        position_df = new[new['position'] == position]
+        dominated[position_df.index] = dominated_players(position_df['now_cost'], position_df[opt_metric], count,
+                                                         position_df['team_name'], max_per_club)
+
+    for player_id in added:
+        if not dominated[player_id]:
+            return False
+
+    for player_id in changed:
+        before, after = old.loc[player_id], new.loc[player_id]
+        if before['position'] != after['position'] or before['team_name'] != after['team_name']:
+            return False
+        if player_id in squad_ids:
+            if after['now_cost'] != before['now_cost'] or not after[opt_metric] >= before[opt_metric]:
+                return False
+        elif not dominated[player_id] and (after['now_cost'] < before['now_cost'] or not after[opt_metric] <= before[opt_metric]):
+            return False
+
+    return True
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def incremental_squad_optimizer(eligible_players, metrics, snapshot_dir, max_per_club=3, budget=100):
+
+    """
+    Final function that returns the squad of joint_squad_optimizer for each metric, as a dict of metric to squad,
+    re-solving only the metrics whose previous squad may no longer be optimal
+
+    The players (by id) are diffed against the snapshot kept in snapshot_dir by the last run. When
+    previous_squad_holds, the previous squad is returned with its rows taken from the current pool, otherwise
+    the metric is solved again. The current pool and squad become the snapshot for the next run
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    settings = solver_settings('joint', max_per_club, budget)
+    columns = ['id', 'position', 'now_cost', 'team_name']
+    current_players = eligible_players.set_index('id', drop=False)
+
+    squads = {}
+    reused = []
+    for metric in dict.fromkeys(metrics):
+        current = eligible_players[columns + [metric]].drop_duplicates(subset='id')
+        path = squad_snapshot_path(snapshot_dir, metric, settings)
+
+        snapshot = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+
+        if snapshot is not None and previous_squad_holds(snapshot['players'], current, snapshot['squad_ids'], metric, max_per_club):
+            squad_ids = snapshot['squad_ids']
+            reused.append(metric)
+        else:
+            players, rows = joint_squad_rows(eligible_players, metric, max_per_club, budget)
+            squad_ids = players['id'].iloc[rows].tolist()
+
+        final = current_players.loc[squad_ids][SQUAD_COLUMNS + [metric]]
+        squads[metric] = final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+
+        fpl_api.write_atomic(path, pickle.dumps({'players': current, 'squad_ids': squad_ids}))
+
+    logger.info('incremental optimizer: %d of %d metrics kept their previous squad', len(reused), len(squads))
+
+    return squads
+
+
+# points a transfer beyond the free ones costs, and how many free transfers can be saved up
+TRANSFER_HIT_COST = 4
+MAX_FREE_TRANSFERS = 5
+
+# per-transfer penalties the planner solves the joint squad for, each giving a squad with its own number of transfers
+TRANSFER_PENALTIES = [0.5, 1, 2, 3, 4, 6, 8]
+
+# seconds the planner spends on joint solves, no joint solve starts once they are spent and the remaining gameweeks
+# only try single transfers and the squads already found (an 8 gameweek plan over ~700 players takes a few seconds)
+TRANSFER_PLAN_TIME_BUDGET = 60
+
+
+def best_single_transfer(pool, squad, values, bank, max_per_club):
+    """
+    Function that returns the best squad (row positions) one transfer away from squad, trying every player out
+    against every affordable player of the same position in whose club has room. None when no transfer gains
+    """
+    squad = np.asarray(squad)
+    in_squad = np.zeros(len(values), dtype=bool)
+    in_squad[squad] = True
+    club_counts = np.bincount(pool['clubs'][squad], minlength=pool['num_clubs'])
+
+    best_gain, best = 0, None
+    for out in squad:
+        allowed = (pool['positions'] == pool['positions'][out]) & ~in_squad & (pool['costs'] <= bank + pool['costs'][out])
+        allowed &= club_counts[pool['clubs']] - (pool['clubs'] == pool['clubs'][out]) < max_per_club
+        if not allowed.any():
+            continue
+        player_in = int(np.argmax(np.where(allowed, values, -np.inf)))
+        gain = values[player_in] - values[out]
+        if gain > best_gain:
+            best_gain, best = gain, np.where(squad == out, player_in, squad)
+
+    return best
+
+
+def starting_xi_points(positions, points):
+    """
+    Function that returns the points of a squad's best starting XI in each gameweek: the most any formation
+    (FORMATIONS) scores from the players' points (rows, one per player with positions) that gameweek (columns)
+    """
+    positions = np.asarray(positions)
+    # best first within each position, summed so that top[k-1] is the k best players' points
+    tops = [np.cumsum(-np.sort(-points[positions == position], axis=0), axis=0) for position in POSITION_COUNTS]
+
+    best = np.full(points.shape[1], -np.inf)
+    for formation in FORMATIONS:
+        best = np.maximum(best, sum(top[count-1] for top, count in zip(tops, formation)))
+    return best
+
+
+def plan_transfers(players, projections, current_squad, bank, free_transfers=1, hit_cost=TRANSFER_HIT_COST,
+                   lookahead=3, discount=0.85, max_per_club=3, time_budget=TRANSFER_PLAN_TIME_BUDGET):
+
+    """
+    Final function that returns a transfer plan, one row per gameweek of projections
+
+    projections holds the projected points of each player (rows, by id) in each coming gameweek (columns, in order),
+    e.g. from fpl_transform.gameweek_projections. current_squad is the 15 ids owned now and bank the money left in
+    0.1m steps; players are sold at their now_cost.
+
+    Rolling horizon: each gameweek a squad is valued on the points of its best starting XI (starting_xi_points) in
+    each of the next lookahead gameweeks (discounted), so bench players add nothing, and the transfers made are the
+    best of
+      - the best single transfer,
+      - the joint squad (joint_squad_rows) with every transfer charged each of TRANSFER_PENALTIES, which trades
+        points against transfers while keeping to the budget and club cap,
+      - the squads found for earlier gameweeks (the warm start; prices are fixed so they stay affordable),
+    net of hit_cost for each transfer beyond the free ones, or keeping the squad when none of them gains. The
+    candidates are found on each player's discounted points. Only candidates that are 2/5/5/3 squads of 15 within
+    the club cap and the budget are considered. No joint solve starts once time_budget seconds are spent
+    """
+    start = time.perf_counter()
+    deadline = start + time_budget
+    players = players.set_index('id', drop=False).loc[projections.index].reset_index(drop=True)
+    pool = squad_pool(players)
+    points = projections.to_numpy(dtype=np.float64)
+    num_gameweeks = points.shape[1]
+
+    squad = np.sort(pd.Index(players['id']).get_indexer(current_squad))
+    if (squad < 0).any() or not squad_is_legal(pool['positions'][squad]):
+        raise ValueError('current_squad must be the ids of a 2/5/5/3 squad of 15 projected players')
+    total_budget = int(bank) + pool['costs'][squad].sum()
+
+    candidates = set()
+    rows = []
+    joint_solves = 0
+
+    for week in range(num_gameweeks):
+        window = points[:, week:week+lookahead]
+        discounts = discount ** np.arange(window.shape[1])
+        values = window @ discounts
+
+        week_candidates = set()
+        single = best_single_transfer(pool, squad, values, total_budget - pool['costs'][squad].sum(), max_per_club)
+        if single is not None:
+            week_candidates.add(tuple(np.sort(single)))
+
+        in_squad = np.isin(np.arange(len(players)), squad)
+        for penalty in TRANSFER_PENALTIES:
+            if time.perf_counter() >= deadline:
+                break
+            frame = players[['id', 'position', 'now_cost', 'team_name']].assign(plan_value=values + penalty * in_squad)
+            solved, solved_rows = joint_squad_rows(frame, 'plan_value', max_per_club, total_budget / 10)
+            week_candidates.add(tuple(np.sort(pd.Index(players['id']).get_indexer(solved['id'].iloc[solved_rows]))))
+            joint_solves += 1
+
+        # only full squads within the position quotas, the club cap and the budget are ever made
+        candidates |= {candidate for candidate in week_candidates
+                       if squad_is_legal(pool['positions'][list(candidate)], pool['clubs'][list(candidate)], max_per_club)
+                       and pool['costs'][list(candidate)].sum() <= total_budget}
+
+        # keeping the squad is always an option, ties go to fewer transfers
+        best_score = starting_xi_points(pool['positions'][squad], window[squad]) @ discounts
+        best_transfers, best_squad = 0, squad
+        for candidate in candidates:
+            candidate = np.array(candidate)
+            transfers = SQUAD_SIZE - len(np.intersect1d(candidate, squad))
+            score = starting_xi_points(pool['positions'][candidate], window[candidate]) @ discounts - hit_cost * max(0, transfers - free_transfers)
+            if score > best_score + 1e-9 or (score >= best_score - 1e-9 and transfers < best_transfers):
+                best_score, best_transfers, best_squad = score, transfers, candidate
+
+        hits = hit_cost * max(0, best_transfers - free_transfers)
+        rows.append({
+            'gameweek': projections.columns[week],
+            'free_transfers': free_transfers,
+            'transfers': best_transfers,
+            'hit_cost': hits,
+            'transfers_out': players['id'].iloc[np.setdiff1d(squad, best_squad)].tolist(),
+            'transfers_in': players['id'].iloc[np.setdiff1d(best_squad, squad)].tolist(),
+            'projected_points': starting_xi_points(pool['positions'][best_squad], points[best_squad, week:week+1])[0],
+            'bank': total_budget - pool['costs'][best_squad].sum(),
+            'squad': players['id'].iloc[best_squad].tolist(),
+        })
+
+        # an unused free transfer carries over, up to MAX_FREE_TRANSFERS
+        free_transfers = min(MAX_FREE_TRANSFERS, max(free_transfers - best_transfers, 0) + 1)
+        squad = best_squad
+
+    plan = pd.DataFrame(rows)
+    logger.info('transfer plan over %d gameweeks: %d transfers, %d hit points, %.1f projected points net, %d joint solves in %.2fs',
+                num_gameweeks, plan['transfers'].sum(), plan['hit_cost'].sum(),
+                plan['projected_points'].sum() - plan['hit_cost'].sum(), joint_solves, time.perf_counter() - start)
+
+    return plan
+
+
+# points scenarios sampled per player by the robust optimizer, and the share of worst scenarios its CVaR averages
+ROBUST_SCENARIOS = 2000
+ROBUST_CVAR_ALPHA = 0.1
+
+# standard deviations the candidate squads trade the mean against, and the number of candidates solved on the
+# mean over a random alpha share of the scenarios
+ROBUST_RISK_AVERSIONS = [0.25, 0.5, 1, 2]
+ROBUST_RESAMPLES = 8
+
+# rounds of single swaps tried on the best candidate squad
+ROBUST_MAX_SWAPS = 15
+
+
+def sample_scenarios(players, mean_metric, num_scenarios=ROBUST_SCENARIOS, std_metric=None, team_correlation=0.0, seed=0):
+    """
+    Function that returns sampled points of every player (rows, in order) in every scenario (columns), as one
+    float32 matrix
+
+    Points are normal around mean_metric with std_metric as the standard deviation, or the square root of the
+    mean (the Poisson spread) without one. With a team_correlation, that share of the variance is shared by the
+    players of a club, so a club's bad scenario hits all of its players
+    """
+    rng = np.random.default_rng(seed)
+    means = players[mean_metric].to_numpy(dtype=np.float32)
+    stds = players[std_metric].to_numpy(dtype=np.float32) if std_metric else np.sqrt(np.maximum(means, 0))
+
+    # built in place, the matrix is the largest thing the robust optimizer holds
+    scenarios = rng.standard_normal((len(players), num_scenarios), dtype=np.float32)
+    if team_correlation > 0:
+        clubs = pd.factorize(players['team_name'])[0]
+        club_noise = np.float32(np.sqrt(team_correlation)) * rng.standard_normal((clubs.max() + 1, num_scenarios), dtype=np.float32)
+        scenarios *= np.float32(np.sqrt(1 - team_correlation))
+        for club in range(len(club_noise)):
+            scenarios[clubs == club] += club_noise[club]
+    scenarios *= stds[:, None]
+    scenarios += means[:, None]
+
+    return scenarios
+
+
+def scenario_cvar(totals, alpha=ROBUST_CVAR_ALPHA):
+    """
+    Function that returns the mean of the worst alpha share of the scenarios (last axis) of each row of totals
+    """
+    worst = max(1, int(np.ceil(alpha * totals.shape[-1])))
+    return np.partition(totals, worst - 1, axis=-1)[..., :worst].mean(axis=-1)
+
+
+def scenario_objective(totals, objective, alpha=ROBUST_CVAR_ALPHA):
+    """
+    Function that returns the score of each row of totals over the scenarios: the expected value ('ev') or the CVaR ('cvar')
+    """
+    if objective == 'ev':
+        return totals.mean(axis=-1)
+    if objective == 'cvar':
+        return scenario_cvar(totals, alpha)
+    raise ValueError('unknown objective {}, expected ev or cvar'.format(objective))
+
+
+def robust_candidate_values(scenarios, alpha=ROBUST_CVAR_ALPHA, seed=0):
+    """
+    Function that returns the player values candidate squads are solved on, as a dict of name to values: the
+    scenario mean, the mean less each of ROBUST_RISK_AVERSIONS standard deviations, each player's own CVaR and
+    the means over ROBUST_RESAMPLES random alpha shares of the scenarios
+    """
+    rng = np.random.default_rng(seed)
+    means = scenarios.mean(axis=1, dtype=np.float64)
+    stds = scenarios.std(axis=1).astype(np.float64)
+
+    values = {'robust_mean': means}
+    for risk_aversion in ROBUST_RISK_AVERSIONS:
+        values['robust_std_{}'.format(risk_aversion)] = means - risk_aversion * stds
+    values['robust_tail'] = scenario_cvar(scenarios, alpha).astype(np.float64)
+
+    size = max(1, int(np.ceil(alpha * scenarios.shape[1])))
+    for resample in range(ROBUST_RESAMPLES):
+        columns = rng.choice(scenarios.shape[1], size, replace=False)
+        values['robust_resample_{}'.format(resample)] = scenarios[:, columns].mean(axis=1, dtype=np.float64)
+
+    return values
+
+
+def improve_robust_squad(pool, squad, scenarios, objective, alpha, max_cost, max_per_club, max_swaps=ROBUST_MAX_SWAPS):
+    """
+    Function that returns squad (row positions) after the single swaps that improve the objective most, one per
+    round until none improves it. Every affordable same-position player whose club has room is scored against
+    all scenarios at once for each player out
+    """
+    squad = np.asarray(squad)
+    totals = scenarios[squad].sum(axis=0)
+    score = scenario_objective(totals, objective, alpha)
+
+    for _ in range(max_swaps):
+        in_squad = np.zeros(len(pool['costs']), dtype=bool)
+        in_squad[squad] = True
+        club_counts = np.bincount(pool['clubs'][squad], minlength=pool['num_clubs'])
+        bank = max_cost - pool['costs'][squad].sum()
+
+        best_score, best = score, None
+        for out in squad:
+            allowed = (pool['positions'] == pool['positions'][out]) & ~in_squad & (pool['costs'] <= bank + pool['costs'][out])
+            allowed &= club_counts[pool['clubs']] - (pool['clubs'] == pool['clubs'][out]) < max_per_club
+            players_in = np.flatnonzero(allowed)
+            if len(players_in) == 0:
+                continue
+            swapped = scenario_objective(totals - scenarios[out] + scenarios[players_in], objective, alpha)
+            i = int(np.argmax(swapped))
+            if swapped[i] > best_score + 1e-6 * max(1, abs(best_score)):
+                best_score, best = swapped[i], (out, players_in[i])
+
+        if best is None:
+            break
+        out, player_in = best
+        squad = np.where(squad == out, player_in, squad)
+        totals = totals - scenarios[out] + scenarios[player_in]
+        score = best_score
+
+    return squad
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def robust_squad_optimizer(eligible_players, mean_metric, objective='cvar', num_scenarios=ROBUST_SCENARIOS, alpha=ROBUST_CVAR_ALPHA,
+                           std_metric=None, team_correlation=0.0, max_per_club=3, budget=100, seed=0, scenarios=None):
+
+    """
+    Final function that returns the squad doing best across sampled points scenarios, on the expected value
+    (objective='ev') or the mean of the worst alpha share of scenarios (objective='cvar')
+
+    The scenarios (players x scenarios, see sample_scenarios, or passed in) give the candidate squads'
+    values (robust_candidate_values), solved by the joint optimizer with their position knapsacks filled together.
+    Every candidate is then scored against all scenarios in one matrix product, and the best one is improved
+    with single swaps scored the same way. The squad carries its expected points and CVaR in squad_expected and squad_cvar
+    """
+    max_cost = int(round(budget * 10))
+    players = eligible_players.reset_index(drop=True)
+    if scenarios is None:
+        scenarios = sample_scenarios(players, mean_metric, num_scenarios, std_metric, team_correlation, seed)
+    pool = squad_pool(players, mean_metric)
+
+    start = time.perf_counter()
+    values = robust_candidate_values(scenarios, alpha, seed)
+    frame = players[['position', 'now_cost', 'team_name']].assign(**values)
+
+    with fpl_profiling.stage('knapsacks', OPTIMIZER_STATS):
+        pruned = prune_dominated_players(frame, list(values), max_per_club)
+        rows = pruned.index.to_numpy()
+        pruned = pruned.reset_index(drop=True)
+        plain_caches = root_knapsacks_many(pruned, list(values), budget)
+
+    with fpl_profiling.stage('club_branch_and_bound', OPTIMIZER_STATS):
+        candidates = {tuple(np.sort(rows[joint_squad_rows(pruned, name, max_per_club, budget, plain_caches[name], prune=False)[1]]))
+                      for name in values}
+
+    with fpl_profiling.stage('scenario_search', scenarios=scenarios.shape[1], candidates=len(candidates)):
+        candidates = np.array(sorted(candidates))
+        membership = np.zeros((len(candidates), len(players)), dtype=np.float32)
+        membership[np.arange(len(candidates))[:, None], candidates] = 1
+        scores = scenario_objective(membership @ scenarios, objective, alpha)
+        squad = improve_robust_squad(pool, candidates[int(np.argmax(scores))], scenarios, objective, alpha, max_cost, max_per_club)
+
+    squad = sorted(squad, key=lambda i: (list(POSITION_COUNTS).index(pool['positions'][i]), i))
+    totals = scenarios[squad].sum(axis=0)
+    logger.info('robust squad (%s) over %d scenarios from %d candidate squads in %.2fs: expected %.1f, CVaR %.1f',
+                objective, scenarios.shape[1], len(candidates), time.perf_counter() - start, totals.mean(), scenario_cvar(totals, alpha))
+
+    final = players.iloc[squad][SQUAD_COLUMNS + [mean_metric]]
+    final = final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+    return final.assign(squad_expected=float(totals.mean()), squad_cvar=float(scenario_cvar(totals, alpha)))
+
+
+# starting XI formations as players per position in POSITION_COUNTS order, every valid one: 1 goalkeeper,
+# 3 to 5 defenders, 2 to 5 midfielders and 1 to 3 forwards
+FORMATIONS = [counts for counts in itertools.product([1], range(3, 6), range(2, 6), range(1, 4)) if sum(counts) == 11]
+
+# weight of a bench player's points against a starter's, bench players only score when a starter doesn't play
+BENCH_WEIGHT = 0.1
+
+# factor the captain's points are multiplied by
+CAPTAIN_MULTIPLIER = 2
+
+
+def lineup_weights(count, starters, captain, bench_weight=BENCH_WEIGHT):
+    """
+    Function that returns the weight of a position's players by rank: the captain (when the position holds them)
+    first, then the starters, then the bench
+    """
+    weights = np.full(count, bench_weight, dtype=np.float64)
+    weights[:starters] = 1
+    if captain:
+        weights[0] = CAPTAIN_MULTIPLIER
+    return weights
+
+
+def lineup_knapsack(player_costs, player_values, max_cost, weights):
+
+    """
+    function that returns the lineup knapsack cost matrix of a position for several rank weightings at once
+
+    Players must come in order of value, best first, so the k-th player taken is the k-th best and gets weights[v][k].
+    cost_matrix[i][v][k][j] is the best weighted value of exactly k of the first i+1 players costing at most j
+    (-inf when k of them don't fit). Each player is one vectorized step over the weighting x count x cost block
+    """
+    num_players = len(player_costs)
+    costs = np.asarray(player_costs, dtype=np.int64)
+    values = np.asarray(player_values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    num_weights, count = weights.shape
+
+    cost_matrix = np.empty((num_players, num_weights, count+1, max_cost+1), dtype=np.float64)
+    previous = np.full((num_weights, count+1, max_cost+1), -np.inf)
+    previous[:, 0] = 0
+    candidate = np.empty((num_weights, count, max_cost+1), dtype=np.float64)
+    OPTIMIZER_STATS['dp_cells'] += num_players * num_weights * (count+1) * (max_cost+1)
+
+    for i in range(num_players):
+        current = cost_matrix[i]
+        cost = min(costs[i], max_cost+1)
+        current[:, :, :cost] = previous[:, :, :cost]
+        current[:, 0, cost:] = 0
+        if cost <= max_cost:
+            width = max_cost+1-cost
+            np.add(previous[:, :-1, :width], (values[i] * weights)[:, :, None], out=candidate[:, :, :width])
+            np.fmax(previous[:, 1:, cost:], candidate[:, :, :width], out=current[:, 1:, cost:])
+        previous = current
+
+    return cost_matrix
+
+
+def get_lineup_items(player_costs, max_cost, count, cost_matrix):
+    """
+    Function that returns the positions (in the knapsack's value order) of the players taken for count players
+    within max_cost, from one weighting's [player][count][cost] layer of lineup_knapsack
+    """
+    taken = []
+    for i in range(len(player_costs) - 1, -1, -1):
+        if count == 0:
+            break
+        if i == 0 or cost_matrix[i, count, max_cost] != cost_matrix[i-1, count, max_cost]:
+            taken.append(i)
+            max_cost -= player_costs[i]
+            count -= 1
+    return taken[::-1]
+
+
+def lineup_variants():
+    """
+    Function that returns the (starters, captain) weightings each position is solved for, over all the formations
+    """
+    return [sorted({(formation[p], captain) for formation in FORMATIONS for captain in (False, True)})
+            for p in range(len(POSITION_COUNTS))]
+
+
+def relaxed_lineup(pool, excluded, bench_weight, max_cost, cache):
+    """
+    Function that returns the best squad and lineup without the club cap and with the excluded players out, as
+    (value, squad rows, starter rows, captain row, formation), None when no squad fits
+
+    Each position is solved once for all its (starters, captain) weightings by lineup_knapsack, cached on the
+    players it was solved over. Every formation and captain position then combines one value curve per position,
+    and the combinations sharing their first positions (and players) share those convolutions through the cache too
+    """
+    available = np.ones(len(pool['costs']), dtype=bool)
+    available[list(excluded)] = False
+
+    solves = []
+    curves = []
+    for (position, count), variants in zip(POSITION_COUNTS.items(), lineup_variants()):
+        indices = np.flatnonzero(available & (pool['positions'] == position))
+        if len(indices) < count:
+            return None
+        # best value first, the lineup weights go by rank
+        indices = indices[np.argsort(-pool['values'][indices], kind='stable')]
+        position_cost = position_spend_cap(pool['costs'][indices], count, max_cost)
+
+        key = (position, indices.tobytes())
+        if key not in cache:
+            weights = [lineup_weights(count, starters, captain, bench_weight) for starters, captain in variants]
+            cache[key] = lineup_knapsack(pool['costs'][indices], pool['values'][indices], position_cost, weights)
+        cost_matrix = cache[key]
+
+        curves.append({variant: np.pad(cost_matrix[-1, v, count], (0, max_cost-position_cost), mode='edge')
+                       for v, variant in enumerate(variants)})
+        solves.append((key, indices, count, cost_matrix, variants))
+
+    # combined curves of the first positions' variants with the budget the earlier ones got at each total, cached
+    # on those positions' players so nodes that only exclude a later position's player reuse them
+    def combine(prefix):
+        if not prefix:
+            return np.concatenate([[0], np.full(max_cost, -np.inf)]), None
+        key = ('combined', max_cost, tuple(solve[0] for solve in solves[:len(prefix)]), prefix)
+        if key not in cache:
+            curve, _ = combine(prefix[:-1])
+            # the curve is -inf below its cheapest squad and non-decreasing after it, see combine_value_curves
+            low, high = int(np.argmax(curve > -np.inf)), int(np.argmax(curve))
+            partial, first_share = max_plus_convolution(curve[low:high+1], curves[len(prefix)-1][prefix[-1]], max_cost+1-low)
+            cache[key] = (np.concatenate([np.full(low, -np.inf), partial]), np.concatenate([np.zeros(low, dtype=np.int64), first_share + low]))
+        return cache[key]
+
+    best = None
+    for formation in FORMATIONS:
+        for captain_position in range(len(POSITION_COUNTS)):
+            prefix = tuple((formation[p], p == captain_position) for p in range(len(POSITION_COUNTS)))
+            curve, _ = combine(prefix)
+            total = int(np.argmax(curve))
+            if curve[total] > -np.inf and (best is None or curve[total] > best[0]):
+                best = (curve[total], prefix, total)
+    if best is None:
+        return None
+
+    value, prefix, total = best
+    squad, starters, captain = [], [], None
+    for p in range(len(prefix), 0, -1):
+        _, first_share = combine(prefix[:p])
+        budget = total - first_share[total]
+        total = first_share[total]
+
+        _, indices, count, cost_matrix, variants = solves[p-1]
+        v = variants.index(prefix[p-1])
+        taken = indices[get_lineup_items(pool['costs'][indices], min(budget, cost_matrix.shape[-1]-1), count, cost_matrix[:, v])]
+        squad += taken.tolist()
+        starters += taken[:prefix[p-1][0]].tolist()
+        if prefix[p-1][1]:
+            captain = int(taken[0])
+
+    formation = tuple(starter_count for starter_count, _ in prefix)
+    return value, squad, starters, captain, formation
+
+
+@fpl_profiling.timed(counters=OPTIMIZER_STATS)
+def lineup_optimizer(eligible_players, opt_metric, bench_weight=BENCH_WEIGHT, max_per_club=3, budget=100):
+
+    """
+    Final function that returns the squad with its starting XI, bench order and captain chosen together
+
+    The squad is worth its starters' opt_metric, the captain's twice, plus bench_weight times its bench players',
+    over every valid formation (FORMATIONS). relaxed_lineup solves it without the club cap, and a squad breaking
+    the cap is split on the players of the club over it, each child leaving one of them out, best bound first.
+    Rows come in lineup order: the XI by position in lineup_slot 1 to 11, then the bench goalkeeper and the
+    outfield bench best first. The squad's formation and weighted value are in formation and lineup_value
+    """
+    max_cost = int(round(budget * 10))
+    players = prune_dominated_players(eligible_players, opt_metric, max_per_club).reset_index(drop=True)
+    pool = squad_pool(players, opt_metric)
+
+    cache = {}
+    nodes = []
+    seen = set()
+    tie_breaker = itertools.count()
+
+    def push(excluded):
+        if excluded in seen:
+            return
+        seen.add(excluded)
+        solution = relaxed_lineup(pool, excluded, bench_weight, max_cost, cache)
+        if solution is not None:
+            heapq.heappush(nodes, (-solution[0], next(tie_breaker), excluded, solution))
+
+    with fpl_profiling.stage('club_branch_and_bound', OPTIMIZER_STATS):
+        push(frozenset())
+        while True:
+            if not nodes:
+                raise ValueError('no squad fits the budget, position and club constraints')
+            _, _, excluded, solution = heapq.heappop(nodes)
+            value, squad, starters, captain, formation = solution
+
+            club_counts = np.bincount(pool['clubs'][squad], minlength=pool['num_clubs'])
+            club = int(np.argmax(club_counts))
+            if club_counts[club] <= max_per_club:
+                break
+            for i in squad:
+                if pool['clubs'][i] == club:
+                    push(excluded | {i})
 
-    final_squad = [keepers, defence, midfield, attack]
+    logger.debug('lineup optimizer: %d nodes explored, %d position knapsacks solved', len(seen), len(cache))
 
-    final_squad_df = pd.concat(final_squad).reset_index(drop=True)
+    # the XI by position, then the bench goalkeeper and the outfield bench best first
+    order = list(POSITION_COUNTS)
+    xi = sorted(starters, key=lambda i: (order.index(pool['positions'][i]), -pool['values'][i], i))
+    bench = sorted(set(squad) - set(starters), key=lambda i: (pool['positions'][i] != 'Goalkeeper', -pool['values'][i], i))
+    vice_captain = max((i for i in starters if i != captain), key=lambda i: (pool['values'][i], -i))
 
-    return final_squad_df
\ No newline at end of file
+    final = players.iloc[xi + bench][SQUAD_COLUMNS + [opt_metric]]
+    final = final.loc[:,~final.columns.duplicated()].reset_index(drop=True)
+    return final.assign(lineup_slot=np.arange(1, SQUAD_SIZE + 1), starter=[True] * len(xi) + [False] * len(bench),
+                        captain=[i == captain for i in xi + bench], vice_captain=[i == vice_captain for i in xi + bench],
+                        formation='-'.join(str(count) for count in formation[1:]), lineup_value=value)
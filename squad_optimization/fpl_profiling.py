@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import uuid
+import logging
+import datetime
+import functools
+import contextlib
+import tracemalloc
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# peak memory of every stage is traced with tracemalloc only with PIPELINE_TRACE_MEMORY=1, tracing slows down every
+# allocation of the run. Stage timings are always recorded
+PIPELINE_TRACE_MEMORY = os.environ.get('PIPELINE_TRACE_MEMORY', '0') == '1'
+
+# columns of the pipeline_metrics table, anything else a stage records goes into details as JSON
+METRICS_COLUMNS = ['run_id', 'pipeline', 'stage', 'started_at', 'seconds', 'peak_bytes', 'status', 'details']
+
+# pipeline and run the stages of this process belong to, set by start_run
+_run = {'pipeline': None, 'run_id': None}
+
+# stage records of the current run, in the order the stages finished
+_records = []
+
+# stages currently open, innermost last, each holding the highest traced memory seen while it was open
+_open_stages = []
+
+
+def start_run(pipeline, run_id=None):
+    """
+    Function that starts a new run of a pipeline (a script or a DAG task), whose stages are recorded from now on
+    """
+    _run['pipeline'] = pipeline
+    _run['run_id'] = run_id or uuid.uuid4().hex
+    _records.clear()
+    return _run['run_id']
+
+
+@contextlib.contextmanager
+def stage(name, counters=None, **details):
+    """
+    Context manager that times a stage of the pipeline and, with PIPELINE_TRACE_MEMORY, records its peak traced memory
+
+    counters is a dict of running totals (e.g. fpl_optimizer_functions.OPTIMIZER_STATS), how much each grew
+    during the stage is recorded with the details. Stages nest: the peak of an inner stage counts towards
+    the outer one. The record is logged as one line of JSON when the stage ends, failed or not.
+    Outside of a run (no start_run yet, e.g. in the notebook or the benchmarks) nothing is measured
+    """
+    if _run['run_id'] is None:
+        yield details
+        return
+
+    tracing = PIPELINE_TRACE_MEMORY
+    started_tracing = tracing and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    entry = {'peak': 0}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        if _open_stages:
+            _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        entry = {'peak': current, 'start': current}
+    _open_stages.append(entry)
+
+    counters_before = dict(counters) if counters is not None else {}
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    start = time.perf_counter()
+    status = 'failed'
+    try:
+        yield details
+        status = 'ok'
+    finally:
+        seconds = time.perf_counter() - start
+        _open_stages.pop()
+
+        peak_bytes = None
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(entry['peak'], peak)
+            peak_bytes = peak - entry['start']
+            if _open_stages:
+                _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+        if started_tracing:
+            tracemalloc.stop()
+
+        for counter, total in (counters or {}).items():
+            details[counter] = total - counters_before.get(counter, 0)
+
+        record = {'run_id': _run['run_id'], 'pipeline': _run['pipeline'], 'stage': name, 'started_at': started_at.isoformat(),
+                  'seconds': round(seconds, 6), 'peak_bytes': peak_bytes, 'status': status, **details}
+        _records.append(record)
+        logger.info(json.dumps(record, default=str))
+
+
+def timed(name=None, counters=None):
+    """
+    Decorator that runs every call of a function as a stage, named after the function unless a name is given
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__, counters):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_metrics():
+    """
+    Function that returns the stage records of the current run as a frame with the pipeline_metrics columns
+    """
+    rows = []
+    for record in _records:
+        details = {key: value for key, value in record.items() if key not in METRICS_COLUMNS}
+        rows.append([record['run_id'], record['pipeline'], record['stage'], pd.Timestamp(record['started_at']),
+                     record['seconds'], record['peak_bytes'], record['status'], json.dumps(details, default=str)])
+
+    metrics = pd.DataFrame(rows, columns=METRICS_COLUMNS)
+    return metrics.astype({'seconds': 'float64', 'peak_bytes': 'Int64'})
+
+
+def write_run_metrics(conn, table='pipeline_metrics', schema='public'):
+    """
+    Function that appends the stage records of the current run to the pipeline_metrics table, made on first use
+    """
+    # imported here so the optimizer and the benchmarks don't need a Postgres driver
+    import fpl_loader
+
+    if _records:
+        fpl_loader.append_frame(conn, run_metrics(), table, schema)
@@ -0,0 +1,144 @@
+import os
+import re
+import uuid
+import datetime
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+import fpl_profiling
+import fpl_transform
+
+logger = logging.getLogger(__name__)
+
+# root of the local snapshot store, snapshots are only kept when it is set
+FPL_SNAPSHOT_STORE = os.environ.get('FPL_SNAPSHOT_STORE')
+
+# partition columns of every snapshot table, as snapshot_season=2026-27/snapshot_gameweek=10/snapshot_at=20261018T120000Z
+# directories, named apart from the tables' own columns (the fixtures have a gameweek)
+PARTITION_SCHEMA = pa.schema([('snapshot_season', pa.string()), ('snapshot_gameweek', pa.int16()), ('snapshot_at', pa.string())])
+
+# timestamp format of the snapshot partition, sorts in time order as a string
+SNAPSHOT_FORMAT = '%Y%m%dT%H%M%SZ'
+
+# files are read through memory maps, so reading a few columns only pages in those column chunks
+_filesystem = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+
+def season_of(bootstrap):
+    """
+    Function that returns the season of a bootstrap-static payload as e.g. '2026-27', from the first gameweek's deadline
+    """
+    deadlines = [event['deadline_time'] for event in bootstrap.get('events', []) if event.get('deadline_time')]
+    start = pd.Timestamp(min(deadlines)) if deadlines else pd.Timestamp.now(tz='UTC')
+    # a season starts in August, anything before is the end of the previous one
+    year = start.year if start.month >= 7 else start.year - 1
+    return '{}-{:02d}'.format(year, (year + 1) % 100)
+
+
+def snapshot_partition(bootstrap):
+    """
+    Function that returns the season and current gameweek a bootstrap-static payload's snapshots are filed under
+    """
+    return season_of(bootstrap), fpl_transform.current_gameweek(bootstrap)
+
+
+def write_snapshot(df, table, season, gameweek, taken_at=None, root=None):
+    """
+    Function that writes a dataframe as a snapshot of a table into the store and returns the snapshot's timestamp
+
+    Each snapshot is one Parquet file under <root>/<table>/snapshot_season=/snapshot_gameweek=/snapshot_at=, written
+    under a temporary name first so readers never see half a file
+    """
+    root = FPL_SNAPSHOT_STORE if root is None else root
+    taken_at = taken_at or datetime.datetime.now(datetime.timezone.utc)
+    snapshot = taken_at.strftime(SNAPSHOT_FORMAT)
+
+    directory = os.path.join(root, table, 'snapshot_season={}'.format(season), 'snapshot_gameweek={}'.format(int(gameweek)),
+                             'snapshot_at={}'.format(snapshot))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'part-0.parquet')
+
+    with fpl_profiling.stage('snapshot_write', table=table, rows=len(df)):
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+        temporary = os.path.join(directory, '.{}.tmp'.format(uuid.uuid4().hex))
+        pq.write_table(arrow_table, temporary, compression='zstd')
+        os.replace(temporary, path)
+
+    logger.info('snapshot of %s (%d rows) written to %s', table, len(df), path)
+    return snapshot
+
+
+def list_snapshots(table, root=None):
+    """
+    Function that returns the snapshots of a table in the store, one row per snapshot with its partition columns
+    and file, oldest first
+    """
+    root = FPL_SNAPSHOT_STORE if root is None else root
+    pattern = re.compile(r'snapshot_season=([^/]+)/snapshot_gameweek=(-?\d+)/snapshot_at=([^/]+)/part-0\.parquet$')
+
+    rows = []
+    table_dir = os.path.join(root, table)
+    for directory, _, files in os.walk(table_dir):
+        for name in files:
+            path = os.path.join(directory, name)
+            match = pattern.search(os.path.relpath(path, table_dir).replace(os.sep, '/'))
+            if match:
+                rows.append((match.group(1), int(match.group(2)), match.group(3), path))
+
+    snapshots = pd.DataFrame(rows, columns=PARTITION_SCHEMA.names + ['path'])
+    return snapshots.sort_values(['snapshot_at', 'snapshot_season', 'snapshot_gameweek'], kind='stable').reset_index(drop=True)
+
+
+def select_snapshots(snapshots, season=None, gameweeks=None, snapshot=None, latest_per_gameweek=False):
+    """
+    Function that returns the snapshots of list_snapshots in a season, gameweeks or with a timestamp, optionally only
+    the latest snapshot of each gameweek
+    """
+    if season is not None:
+        snapshots = snapshots[snapshots['snapshot_season'] == season]
+    if gameweeks is not None:
+        snapshots = snapshots[snapshots['snapshot_gameweek'].isin(list(gameweeks))]
+    if snapshot is not None:
+        snapshots = snapshots[snapshots['snapshot_at'] == snapshot]
+    if latest_per_gameweek:
+        snapshots = snapshots.groupby(['snapshot_season', 'snapshot_gameweek'], sort=False).tail(1)
+    return snapshots
+
+
+def read_snapshots(table, columns=None, season=None, gameweeks=None, snapshot=None, latest_per_gameweek=False, root=None):
+    """
+    Function that returns snapshots of a table as one Arrow table, with the partition columns of PARTITION_SCHEMA
+
+    Only the chosen snapshots' files and columns are read, through memory maps. Snapshots written before a
+    column was added read it as nulls. Use read_snapshot_frame for a dataframe
+    """
+    root = FPL_SNAPSHOT_STORE if root is None else root
+    chosen = select_snapshots(list_snapshots(table, root), season, gameweeks, snapshot, latest_per_gameweek)
+    table_dir = os.path.join(root, table)
+
+    with fpl_profiling.stage('snapshot_read', table=table, snapshots=len(chosen)) as details:
+        if len(chosen) == 0:
+            return pa.table({})
+
+        paths = chosen['path'].tolist()
+        fragments_schema = pa.unify_schemas([pq.read_schema(path, memory_map=True) for path in paths])
+        schema = pa.unify_schemas([fragments_schema, PARTITION_SCHEMA])
+
+        dataset = ds.dataset(paths, schema=schema, format='parquet', filesystem=_filesystem,
+                             partitioning=ds.partitioning(PARTITION_SCHEMA, flavor='hive'), partition_base_dir=table_dir)
+        result = dataset.to_table(columns=None if columns is None else list(columns) + PARTITION_SCHEMA.names)
+        details['rows'] = result.num_rows
+
+    return result
+
+
+def read_snapshot_frame(table, columns=None, **kwargs):
+    """
+    Function that returns snapshots of a table as a dataframe, see read_snapshots
+    """
+    return read_snapshots(table, columns, **kwargs).to_pandas()
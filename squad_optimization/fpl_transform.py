@@ -0,0 +1,314 @@
+import pandas as pd
+import numpy as np
+
+import fpl_profiling
+
+# columns kept from the bootstrap-static elements and their types, in table order
+# ids, prices and counts fit int16 (transfers_in does not), the stats the API sends as strings are float32
+PLAYER_SCHEMA = {
+    'id': 'int16',
+    'first_name': 'str',
+    'second_name': 'str',
+    'web_name': 'str',
+    'team': 'int16',
+    'element_type': 'int16',
+    'news': 'category',
+    'selected_by_percent': 'float32',
+    'in_dreamteam': 'bool',
+    'now_cost': 'int16',
+    'form': 'float32',
+    'points_per_game': 'float32',
+    'minutes': 'int16',
+    'goals_scored': 'int16',
+    'assists': 'int16',
+    'clean_sheets': 'int16',
+    'goals_conceded': 'int16',
+    'yellow_cards': 'int16',
+    'red_cards': 'int16',
+    'saves': 'int16',
+    'bonus': 'int16',
+    'transfers_in': 'int32',
+    'starts': 'int16',
+    'value_season': 'float32',
+    'total_points': 'int16',
+    'influence': 'float32',
+    'creativity': 'float32',
+    'threat': 'float32',
+    'ict_index': 'float32',
+}
+
+# columns of the transformed players, with team_name and position in place of the team and element_type ids
+PLAYER_COLUMNS = ['id','first_name','second_name','name','team_name','position','news','selected_by_percent','in_dreamteam',
+                  'now_cost','form','points_per_game','minutes','goals_scored','assists','clean_sheets',
+                  'goals_conceded','yellow_cards','red_cards','saves','bonus',
+                  'transfers_in','starts','value_season','total_points','influence','creativity','threat','ict_index',
+                  'actual_cost','games_completed','points_per_90_mins','ga_per_90_mins','goal_contributions','points_per_million']
+
+
+def id_categorical(ids, lookup, name):
+    """
+    Function that maps ids to a categorical of a lookup table's name column, keeping the lookup's order
+    """
+    lookup = pd.DataFrame(lookup)
+    codes = pd.Index(lookup['id']).get_indexer(ids)
+    return pd.Categorical.from_codes(codes, categories=lookup[name].tolist())
+
+
+def current_gameweek(bootstrap):
+    """
+    Function that returns the current gameweek of a bootstrap-static payload, the last finished one between
+    gameweeks and 0 before the season
+    """
+    events = bootstrap.get('events', [])
+    current = [event['id'] for event in events if event.get('is_current')]
+    if current:
+        return current[0]
+    return max((event['id'] for event in events if event.get('finished')), default=0)
+
+
+@fpl_profiling.timed()
+def transform_players(json):
+    """
+    Function that returns the cleaned players of a bootstrap-static payload, typed by PLAYER_SCHEMA
+
+    Every column is built straight from the payload into its final type and the derived metrics are computed
+    in one pass over the typed arrays, so the frame is only constructed once
+    """
+    elements = json['elements']
+    columns = {}
+    for column, dtype in PLAYER_SCHEMA.items():
+        values = [element[column] for element in elements]
+        if dtype == 'category':
+            columns[column] = pd.Categorical(values)
+        elif dtype == 'str':
+            columns[column] = values
+        else:
+            columns[column] = np.array(values, dtype=dtype)
+
+    columns['name'] = columns.pop('web_name')
+    columns['team_name'] = id_categorical(columns.pop('team'), json['teams'], 'name')
+    columns['position'] = id_categorical(columns.pop('element_type'), json['element_types'], 'singular_name')
+
+    # actual cost of the player is now_cost/10, a game completed is 90 minutes
+    columns['actual_cost'] = columns['now_cost'] / np.float32(10)
+    columns['games_completed'] = columns['minutes'] / np.float32(90)
+    columns['goal_contributions'] = columns['goals_scored'] + columns['assists']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['points_per_90_mins'] = columns['total_points'] / columns['games_completed']
+        columns['ga_per_90_mins'] = columns['goal_contributions'] / columns['games_completed']
+        columns['points_per_million'] = columns['total_points'] / columns['actual_cost']
+
+    return pd.DataFrame(columns)[PLAYER_COLUMNS]
+
+
+@fpl_profiling.timed()
+def players_fixtures(players, fixtures, teams, num_fixtures=5):
+    """
+    Function that returns the next num_fixtures unfinished fixtures of every player, ranked by kickoff
+
+    fixtures is the renamed fixtures table (home_team_id, away_team_id, home_team, away_team, ...) and teams the
+    bootstrap-static teams. Each team's next fixtures are picked once and then joined to its players by team id
+    """
+    upcoming = fixtures[~fixtures['finished'].astype(bool) & fixtures['kickoff_time'].notna()]
+
+    sides = []
+    for side, team, opponent, difficulty in [('Home', 'home_team_id', 'away_team', 'team_h_difficulty'),
+                                             ('Away', 'away_team_id', 'home_team', 'team_a_difficulty')]:
+        sides.append(pd.DataFrame({
+            'team_id': upcoming[team].to_numpy(),
+            'fixture_home_away': side,
+            'opponent': upcoming[opponent].to_numpy(),
+            'kickoff_time': upcoming['kickoff_time'].to_numpy(),
+            'gameweek': upcoming['gameweek'].to_numpy(),
+            'fixture_difficulty_rating': upcoming[difficulty].to_numpy(),
+        }))
+
+    team_fixtures = pd.concat(sides, ignore_index=True).sort_values(['team_id', 'kickoff_time'], kind='stable')
+    team_fixtures['fixture_rank'] = team_fixtures.groupby('team_id').cumcount() + 1
+    team_fixtures = team_fixtures[team_fixtures['fixture_rank'] <= num_fixtures]
+
+    teams = pd.DataFrame(teams)
+    team_ids = pd.Series(teams['id'].to_numpy(), index=teams['name'].to_numpy())
+    player_teams = pd.DataFrame({
+        'id': players['id'].to_numpy(),
+        'name': players['name'].to_numpy(),
+        'team_id': team_ids.reindex(players['team_name'].astype(str)).to_numpy(),
+    })
+
+    final = player_teams.merge(team_fixtures, on='team_id').sort_values(['kickoff_time', 'id'], kind='stable')
+
+    return final[['id', 'name', 'fixture_home_away', 'opponent', 'kickoff_time',
+                  'gameweek', 'fixture_difficulty_rating', 'fixture_rank']].reset_index(drop=True)
+
+
+@fpl_profiling.timed()
+def transform_fixtures(fixtures_json, teams):
+    """
+    Function that returns the fixtures table of a fixtures payload with the team names of the bootstrap-static teams
+    """
+    fixtures_df = pd.DataFrame(fixtures_json)
+    team_names = pd.DataFrame(teams).set_index('id')['name']
+
+    # getting team names into fixtures table
+    fixtures_df['home_team'] = fixtures_df['team_h'].map(team_names)
+    fixtures_df['away_team'] = fixtures_df['team_a'].map(team_names)
+
+    # removing unnecessary columns
+    fixtures_df = fixtures_df[['id', 'event', 'finished', 'kickoff_time', 'team_a', 'team_a_score', 'team_h', 'team_h_score',
+                               'team_h_difficulty', 'team_a_difficulty', 'home_team', 'away_team']]
+
+    # convert kickoff time to timestamp
+    fixtures_df = fixtures_df.assign(kickoff_time=pd.to_datetime(fixtures_df['kickoff_time']))
+
+    return fixtures_df.rename(columns={'id': 'match_id', 'event': 'gameweek', 'team_a': 'away_team_id', 'team_h': 'home_team_id'})
+
+
+# multiplier of a player's points per game for a fixture of each difficulty rating (1 easiest, 5 hardest)
+DIFFICULTY_WEIGHTS = {1: 1.2, 2: 1.1, 3: 1.0, 4: 0.9, 5: 0.8}
+
+# horizons (in gameweeks) projected_points is computed for by default
+PROJECTION_HORIZONS = [1, 3, 5]
+
+
+def team_gameweek_weights(fixtures, teams, num_gameweeks, difficulty_weights=DIFFICULTY_WEIGHTS):
+    """
+    Function that returns the summed difficulty weights of each team's fixtures in each of the next num_gameweeks
+    gameweeks (teams in the order of the bootstrap-static teams) and the first of those gameweeks
+
+    A blank gameweek is 0 and a double gameweek holds both fixtures
+    """
+    team_index = pd.Index(pd.DataFrame(teams)['id'])
+    upcoming = fixtures[~fixtures['finished'].astype(bool) & fixtures['gameweek'].notna()]
+    first_gameweek = int(upcoming['gameweek'].min()) if len(upcoming) > 0 else 0
+
+    # weight lookup by difficulty rating, unknown ratings count as average
+    weights = np.ones(max(difficulty_weights) + 1)
+    for difficulty, weight in difficulty_weights.items():
+        weights[difficulty] = weight
+
+    team_weights = np.zeros((len(team_index), num_gameweeks))
+    offsets = upcoming['gameweek'].to_numpy(dtype=np.int64) - first_gameweek
+    in_horizon = offsets < num_gameweeks
+    for team, difficulty in [('home_team_id', 'team_h_difficulty'), ('away_team_id', 'team_a_difficulty')]:
+        rows = team_index.get_indexer(upcoming[team].to_numpy()[in_horizon])
+        ratings = np.clip(upcoming[difficulty].to_numpy(dtype=np.int64)[in_horizon], 0, len(weights) - 1)
+        np.add.at(team_weights, (rows, offsets[in_horizon]), weights[ratings])
+
+    return team_weights, first_gameweek
+
+
+def player_team_rows(players, teams):
+    """
+    Function that returns the row of each player's team in the bootstrap-static teams
+    """
+    teams = pd.DataFrame(teams)
+    rows = pd.Series(np.arange(len(teams)), index=teams['name'].to_numpy())
+    return rows.reindex(players['team_name'].astype(str)).to_numpy()
+
+
+@fpl_profiling.timed()
+def projected_points(players, fixtures, teams, horizons=PROJECTION_HORIZONS, difficulty_weights=DIFFICULTY_WEIGHTS):
+    """
+    Function that returns a projected_points_hN column for every horizon N, the points each player is expected to
+    score over the next N gameweeks
+
+    A fixture is worth the player's points per game times the weight of its difficulty for the player's team,
+    summed per gameweek by team_gameweek_weights. One team by gameweek table serves every player and horizon
+    """
+    team_weights, _ = team_gameweek_weights(fixtures, teams, max(horizons), difficulty_weights)
+
+    # fixture weight of each team over the first h gameweeks, for every horizon at once
+    cumulative = np.cumsum(team_weights, axis=1)[:, np.array(horizons) - 1]
+
+    points_per_game = players['points_per_game'].to_numpy(dtype=np.float32)
+    projections = points_per_game[:, None] * cumulative[player_team_rows(players, teams)].astype(np.float32)
+
+    return pd.DataFrame(projections, index=players.index, columns=['projected_points_h{}'.format(h) for h in horizons])
+
+
+@fpl_profiling.timed()
+def gameweek_projections(players, fixtures, teams, num_gameweeks=8, difficulty_weights=DIFFICULTY_WEIGHTS):
+    """
+    Function that returns the projected points of every player (rows, by id) in each of the next num_gameweeks
+    gameweeks (columns, by gameweek number), as used by the transfer planner
+    """
+    team_weights, first_gameweek = team_gameweek_weights(fixtures, teams, num_gameweeks, difficulty_weights)
+
+    points_per_game = players['points_per_game'].to_numpy(dtype=np.float32)
+    projections = points_per_game[:, None] * team_weights[player_team_rows(players, teams)].astype(np.float32)
+
+    return pd.DataFrame(projections, index=players['id'].to_numpy(), columns=range(first_gameweek, first_gameweek + num_gameweeks))
+
+
+# columns kept from the element-summary history rows and their types, in table order
+HISTORY_SCHEMA = {
+    'element': 'int16',
+    'round': 'int16',
+    'fixture': 'int16',
+    'opponent_team': 'int16',
+    'was_home': 'bool',
+    'kickoff_time': 'datetime',
+    'minutes': 'int16',
+    'total_points': 'int16',
+    'goals_scored': 'int16',
+    'assists': 'int16',
+    'clean_sheets': 'int16',
+    'goals_conceded': 'int16',
+    'bonus': 'int16',
+    'bps': 'int16',
+    'influence': 'float32',
+    'creativity': 'float32',
+    'threat': 'float32',
+    'ict_index': 'float32',
+    'value': 'int16',
+}
+
+# windows (in gameweeks) windowed_metrics computes form and points per 90 over by default
+HISTORY_WINDOWS = [3, 6]
+
+
+@fpl_profiling.timed()
+def transform_histories(summaries):
+    """
+    Function that returns one row per player and fixture played from element-summary payloads (a dict of player
+    id to payload), typed by HISTORY_SCHEMA, with element and round renamed to id and gameweek
+    """
+    rows = [row for summary in summaries.values() for row in summary['history']]
+    columns = {}
+    for column, dtype in HISTORY_SCHEMA.items():
+        values = [row[column] for row in rows]
+        if dtype == 'datetime':
+            columns[column] = pd.to_datetime(pd.Series(values, dtype=object), utc=True)
+        else:
+            columns[column] = np.array(values, dtype=dtype)
+
+    history = pd.DataFrame(columns).rename(columns={'element': 'id', 'round': 'gameweek'})
+    return history.sort_values(['id', 'kickoff_time'], kind='stable').reset_index(drop=True)
+
+
+@fpl_profiling.timed()
+def windowed_metrics(history, windows=HISTORY_WINDOWS):
+    """
+    Function that returns form_wN (points per gameweek), points_wN and points_per_90_wN of every player (rows, by id)
+    over the last N gameweeks of the history, for every window N
+
+    Gameweeks are counted back from the latest one in the history, so a blank gameweek counts as 0 points
+    and both fixtures of a double gameweek count
+    """
+    latest = int(history['gameweek'].max()) if len(history) > 0 else 0
+    gameweeks_back = latest - history['gameweek'].to_numpy(dtype=np.int64)
+    points = history['total_points'].to_numpy(dtype=np.float32)
+    minutes = history['minutes'].to_numpy(dtype=np.float32)
+
+    metrics = {}
+    for window in windows:
+        in_window = gameweeks_back < window
+        by_player = pd.DataFrame({'id': history['id'].to_numpy(), 'points': np.where(in_window, points, 0),
+                                  'minutes': np.where(in_window, minutes, 0)}).groupby('id').sum()
+        metrics['form_w{}'.format(window)] = by_player['points'] / np.float32(min(window, latest) or 1)
+        metrics['points_w{}'.format(window)] = by_player['points']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            metrics['points_per_90_w{}'.format(window)] = by_player['points'] / by_player['minutes'] * np.float32(90)
+
+    return pd.DataFrame(metrics)
@@ -1,13 +1,20 @@
-import requests
-import pandas as pd
-import psycopg2
-from sqlalchemy import create_engine
+import fpl_api
+import fpl_history
+import fpl_transform
+import fpl_loader
+import fpl_db
+import fpl_profiling
+import fpl_snapshots
 
 # for env variables
 import os
 from dotenv import load_dotenv, get_key
 load_dotenv()
 
+# stage timings and memory are logged as one JSON line per stage
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
 # save env variables
 SUPABASE_USER = get_key('.env', 'SUPABASE_USER')
 SUPABASE_HOST = get_key('.env', 'SUPABASE_HOST')
@@ -15,85 +22,69 @@ SUPABASE_PASSWORD = get_key('.env', 'SUPABASE_PASSWORD')
 SUPABASE_PORT = get_key('.env', 'SUPABASE_PORT')
 SUPABASE_DB = get_key('.env', 'SUPABASE_DB')
 
-# FPL API URL
-url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-response = requests.get(url)
-json = response.json()
+# optional flag, when set the per-gameweek history of every player is fetched and loaded too
+FPL_FETCH_HISTORIES = get_key('.env', 'FPL_FETCH_HISTORIES')
+
+# optional directory of the local Parquet snapshot store, every run's players are kept there when set
+FPL_SNAPSHOT_STORE = get_key('.env', 'FPL_SNAPSHOT_STORE')
 
-# storing json outputs as dataframes
-elements_df = pd.DataFrame(json['elements'])
-elements_types_df = pd.DataFrame(json['element_types'])
-teams_df = pd.DataFrame(json['teams'])
+# optional table the stage timings of every run are appended to, e.g. pipeline_metrics
+PIPELINE_METRICS_TABLE = get_key('.env', 'PIPELINE_METRICS_TABLE')
 
+# every stage from here on is timed as part of this run
+fpl_profiling.start_run('raw_players_data_upload')
 
-# Pulling in player position into elements_df
-elements_df['position'] = elements_df.element_type.map(elements_types_df.set_index('id').singular_name)
-elements_df['team_name'] = elements_df.team.map(teams_df.set_index('id').name)
+# FPL API payload, shared with the other scripts through the on-disk cache
+json = fpl_api.fetch_bootstrap_static()
 
 def convert_filename(string):
     return string.lower().replace(" ", "_")
 
 
-# Filtering out only the necessary columns
-slim_elements_df = elements_df[['id', 'first_name','second_name','web_name','team_name','position','news','selected_by_percent','in_dreamteam',
-                                'now_cost','form','points_per_game','minutes','goals_scored','assists','clean_sheets',
-                                'goals_conceded','yellow_cards','red_cards','saves','bonus',
-                                'transfers_in','starts','value_season','total_points','influence','creativity','threat','ict_index']]
-
-slim_elements_df.rename(columns = {'web_name':'name'}, inplace = True)
-
-
-# numeric columns:
-numeric_cols = ['selected_by_percent','form','points_per_game','value_season','influence','creativity','threat','ict_index']
+# typed players with the derived metrics
+slim_elements_df = fpl_transform.transform_players(json)
 
+# projected points over the next gameweeks, weighted by fixture difficulty
+fixtures_df = fpl_transform.transform_fixtures(fpl_api.fetch_fixtures(), json['teams'])
+slim_elements_df = slim_elements_df.join(fpl_transform.projected_points(slim_elements_df, fixtures_df, json['teams']))
 
-# convering columns into numeric data type
-for col in numeric_cols:
-    slim_elements_df[col] = pd.to_numeric(slim_elements_df[col])
+# per-gameweek histories, for form and points per 90 over the last few gameweeks
+if FPL_FETCH_HISTORIES:
+    summaries = fpl_history.fetch_element_summaries(slim_elements_df['id'].tolist(), fpl_transform.current_gameweek(json))
+    history_df = fpl_transform.transform_histories(summaries)
+    slim_elements_df = slim_elements_df.join(fpl_transform.windowed_metrics(history_df), on='id')
 
-
-# actual cost of the player is now_cost/10
-slim_elements_df['actual_cost'] = slim_elements_df['now_cost']/10
-
-
-# creating additional metrics
-slim_elements_df['games_completed'] = slim_elements_df['minutes']/90
-slim_elements_df['points_per_90_mins'] = slim_elements_df['total_points']/slim_elements_df['games_completed']
-slim_elements_df['ga_per_90_mins'] = (slim_elements_df['goals_scored']+slim_elements_df['assists'])/slim_elements_df['games_completed']
-slim_elements_df['goal_contributions'] = (slim_elements_df['goals_scored']+slim_elements_df['assists'])
-slim_elements_df['points_per_million'] = slim_elements_df['total_points']/slim_elements_df['actual_cost']
+# snapshot of the cleaned players, filed under the season and current gameweek
+if FPL_SNAPSHOT_STORE:
+    season, gameweek = fpl_snapshots.snapshot_partition(json)
+    fpl_snapshots.write_snapshot(slim_elements_df, 'players', season, gameweek, root=FPL_SNAPSHOT_STORE)
 
 # path to team image icon
-slim_elements_df['image_path'] = '/' + slim_elements_df['team_name'].apply(convert_filename) + '.svg'
+slim_elements_df['image_path'] = '/' + slim_elements_df['team_name'].astype(str).apply(convert_filename) + '.svg'
 
 # create percentile columns for specific metrics
 percentile_metrics = ['bonus', 'form', 'ict_index', 'points_per_game', 'points_per_million', 'total_points', 'goals_scored', 'assists', 'clean_sheets']
 
-for metric in percentile_metrics:
-    slim_elements_df[metric + '_percentile'] = slim_elements_df.groupby('position')[metric].rank(pct=True)
-
-# Connect to Supabase
-conn = psycopg2.connect(
-    database=SUPABASE_DB, user=SUPABASE_USER, password=SUPABASE_PASSWORD, host=SUPABASE_HOST, port=SUPABASE_PORT
-)
-
-# Setting auto commit true
-conn.autocommit = True
+with fpl_profiling.stage('percentiles'):
+    for metric in percentile_metrics:
+        slim_elements_df[metric + '_percentile'] = slim_elements_df.groupby('position', observed=True)[metric].rank(pct=True)
 
-# Creating a cursor object using the cursor() method
-cursor = conn.cursor()
+# Connect to Supabase through the shared connection pool
+engine = fpl_db.get_engine(fpl_db.database_url(SUPABASE_USER, SUPABASE_PASSWORD, SUPABASE_HOST, SUPABASE_PORT, SUPABASE_DB))
 
-# drop existing players table
-drop_query = 'DROP TABLE IF EXISTS public.dim_fpl_players;'
-cursor.execute(drop_query)
+# upload to Supabase, COPY into a staging table swapped in for the old one
+with fpl_profiling.stage('db_load', table='dim_fpl_players'), fpl_db.connection(engine) as conn:
+    fpl_loader.load_frame(conn, slim_elements_df, 'dim_fpl_players', schema='public')
 
-# create SQL alchemy engine
-engine_url = 'postgresql://' + SUPABASE_USER + ':' + SUPABASE_PASSWORD + '@' + SUPABASE_HOST + '/' + SUPABASE_DB
-engine = create_engine(engine_url)
+if FPL_FETCH_HISTORIES:
+    with fpl_profiling.stage('db_load', table='fact_player_gameweeks'), fpl_db.connection(engine) as conn:
+        fpl_loader.load_frame(conn, history_df, 'fact_player_gameweeks', schema='public')
 
-# upload to Supabase
-slim_elements_df.to_sql('dim_fpl_players', engine, schema='public', index=False)
+# stage timings of the run, kept for trend analysis
+if PIPELINE_METRICS_TABLE:
+    with fpl_db.connection(engine) as conn:
+        fpl_profiling.write_run_metrics(conn, PIPELINE_METRICS_TABLE)
 
-conn.close()
+fpl_db.dispose_engines()
 
 print("Data loaded to Supabase")
\ No newline at end of file
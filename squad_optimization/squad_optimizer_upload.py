@@ -1,17 +1,22 @@
-import requests
 import pandas as pd
 import numpy as np
 
-import psycopg2
-from sqlalchemy import create_engine
-
 import fpl_optimizer_functions as fpl
+import fpl_api
+import fpl_transform
+import fpl_loader
+import fpl_db
+import fpl_profiling
 
 # for env variables
 import os
 from dotenv import load_dotenv, get_key
 load_dotenv()
 
+# stage timings and memory are logged as one JSON line per stage
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+
 # save env variables
 SUPABASE_USER = get_key('.env', 'SUPABASE_USER')
 SUPABASE_HOST = get_key('.env', 'SUPABASE_HOST')
@@ -19,50 +24,36 @@ SUPABASE_PASSWORD = get_key('.env', 'SUPABASE_PASSWORD')
 SUPABASE_PORT = get_key('.env', 'SUPABASE_PORT')
 SUPABASE_DB = get_key('.env', 'SUPABASE_DB')
 
-# FPL API URL
-url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
-response = requests.get(url)
-json = response.json()
-
-# storing json outputs as dataframes
-elements_df = pd.DataFrame(json['elements'])
-elements_types_df = pd.DataFrame(json['element_types'])
-teams_df = pd.DataFrame(json['teams'])
-
-
-# Pulling in player position into elements_df
-elements_df['position'] = elements_df.element_type.map(elements_types_df.set_index('id').singular_name)
-elements_df['team_name'] = elements_df.team.map(teams_df.set_index('id').name)
+# optional number of optimizer processes, metrics are solved in this process when unset
+OPTIMIZER_WORKERS = get_key('.env', 'OPTIMIZER_WORKERS')
 
+# optional directory for cached squads, unchanged player pools skip the optimizer when set
+SQUAD_CACHE_DIR = get_key('.env', 'SQUAD_CACHE_DIR')
 
+# optional directory for the last player snapshot, only metrics whose squad may have changed are re-solved when set
+SQUAD_SNAPSHOT_DIR = get_key('.env', 'SQUAD_SNAPSHOT_DIR')
 
-# Filtering out only the necessary columns
-slim_elements_df = elements_df[['id', 'first_name','second_name','web_name','team_name','position','news','selected_by_percent','in_dreamteam',
-                                'now_cost','form','points_per_game','minutes','goals_scored','assists','clean_sheets',
-                                'goals_conceded','yellow_cards','red_cards','saves','bonus',
-                                'transfers_in','starts','value_season','total_points','influence','creativity','threat','ict_index']]
+# optional number of points scenarios, a squad picked on the CVaR of projected_points_h5 is also loaded when set
+ROBUST_SCENARIOS = get_key('.env', 'ROBUST_SCENARIOS')
 
-slim_elements_df.rename(columns = {'web_name':'name'}, inplace = True)
+# optional weight of bench points, the squad of projected_points_h5 with its XI, bench order and captain is also loaded when set
+LINEUP_BENCH_WEIGHT = get_key('.env', 'LINEUP_BENCH_WEIGHT')
 
-# numeric columns:
-numeric_cols = ['selected_by_percent','form','points_per_game','value_season','influence','creativity','threat','ict_index']
+# optional table the stage timings of every run are appended to, e.g. pipeline_metrics
+PIPELINE_METRICS_TABLE = get_key('.env', 'PIPELINE_METRICS_TABLE')
 
+# every stage from here on is timed as part of this run
+fpl_profiling.start_run('squad_optimizer_upload')
 
-# convering columns into numeric data type
-for col in numeric_cols:
-    slim_elements_df[col] = pd.to_numeric(slim_elements_df[col])
+# FPL API payload, shared with the other scripts through the on-disk cache
+json = fpl_api.fetch_bootstrap_static()
 
+# typed players with the derived metrics
+slim_elements_df = fpl_transform.transform_players(json)
 
-# actual cost of the player is now_cost/10
-slim_elements_df['actual_cost'] = slim_elements_df['now_cost']/10
-
-
-# creating additional metrics
-slim_elements_df['games_completed'] = slim_elements_df['minutes']/90
-slim_elements_df['points_per_90_mins'] = slim_elements_df['total_points']/slim_elements_df['games_completed']
-slim_elements_df['ga_per_90_mins'] = (slim_elements_df['goals_scored']+slim_elements_df['assists'])/slim_elements_df['games_completed']
-slim_elements_df['goal_contributions'] = (slim_elements_df['goals_scored']+slim_elements_df['assists'])
-slim_elements_df['points_per_million'] = slim_elements_df['total_points']/slim_elements_df['actual_cost']
+# projected points over the next gameweeks, weighted by fixture difficulty
+fixtures_df = fpl_transform.transform_fixtures(fpl_api.fetch_fixtures(), json['teams'])
+slim_elements_df = slim_elements_df.join(fpl_transform.projected_points(slim_elements_df, fixtures_df, json['teams']))
 
 # eligible players
 eligible_players = slim_elements_df[slim_elements_df['news'] == '']
@@ -76,43 +67,59 @@ print("Data processing done")
 ##################### Loading data into Supabase #####################
 
 
-# establish connection
-user=SUPABASE_USER
-password=SUPABASE_PASSWORD
-host=SUPABASE_HOST
-port=SUPABASE_PORT
-database=SUPABASE_DB
+# establish connection, shared by every table of the run
+engine = fpl_db.get_engine(fpl_db.database_url(SUPABASE_USER, SUPABASE_PASSWORD, SUPABASE_HOST, SUPABASE_PORT, SUPABASE_DB))
+
+# number of alternative squads ranked per metric
+SQUAD_TOP_K = 10
+
+optimizing_metrics = ['points_per_game','bonus','total_points','ict_index','points_per_million','form','projected_points_h5']
 
-conn = psycopg2.connect(
-    database=database, user=user, password=password, host=host, port=port
-)
 
-# Setting auto commit true
-conn.autocommit = True
+# all metrics are optimized in one pass over the player pool, or spread over worker processes
+if SQUAD_SNAPSHOT_DIR:
+    squads = fpl.incremental_squad_optimizer(eligible_players, optimizing_metrics, SQUAD_SNAPSHOT_DIR)
+elif OPTIMIZER_WORKERS:
+    squads = fpl.squad_optimizer_parallel(eligible_players, optimizing_metrics, max_workers=int(OPTIMIZER_WORKERS), cache_dir=SQUAD_CACHE_DIR)
+else:
+    squads = fpl.squad_optimizer_many(eligible_players, optimizing_metrics, cache_dir=SQUAD_CACHE_DIR)
 
-# Creating a cursor object using the cursor() method
-cursor = conn.cursor()
+# the next best squads, ranked, next to the optimal one
+ranked_squads = {metric: fpl.squad_optimizer_topk(eligible_players, metric, SQUAD_TOP_K) for metric in optimizing_metrics}
 
-optimizing_metrics = ['points_per_game','bonus','total_points','ict_index','points_per_million','form']
+# the squad that holds up best in the worst tenth of sampled points outcomes
+robust_squad = fpl.robust_squad_optimizer(eligible_players, 'projected_points_h5', 'cvar', int(ROBUST_SCENARIOS)) if ROBUST_SCENARIOS else None
 
-for metric in optimizing_metrics:
+# the squad picked for its starting XI and captain, with the bench only counting for LINEUP_BENCH_WEIGHT of its points
+lineup = fpl.lineup_optimizer(eligible_players, 'projected_points_h5', float(LINEUP_BENCH_WEIGHT)) if LINEUP_BENCH_WEIGHT else None
 
-    table_name = 'public.optimal_squad_' + metric
-    drop_query = 'DROP TABLE IF EXISTS ' + table_name
-    cursor.execute(drop_query)
+with fpl_profiling.stage('db_load', tables=2 * len(optimizing_metrics)), fpl_db.connection(engine) as conn:
+    for metric in optimizing_metrics:
 
-engine_url = 'postgresql://' + user + ':' + password + '@' + host + '/' + database
-engine = create_engine(engine_url)
+        table_name = 'optimal_squad_' + metric
+        squad = squads[metric]
+        fpl.check_squad(squad, table_name)
+        squad = pd.merge(squad, slim_elements_df[['first_name', 'second_name', 'id']], on=['first_name', 'second_name'], how='left')
+        fpl_loader.load_frame(conn, squad, table_name, schema='public')
 
+        for squad_rank, ranked in ranked_squads[metric].groupby('squad_rank'):
+            fpl.check_squad(ranked, '{}_ranked rank {}'.format(table_name, squad_rank))
+        ranked = pd.merge(ranked_squads[metric], slim_elements_df[['first_name', 'second_name', 'id']], on=['first_name', 'second_name'], how='left')
+        fpl_loader.load_frame(conn, ranked, table_name + '_ranked', schema='public')
 
-for metric in optimizing_metrics:
+    if robust_squad is not None:
+        robust = pd.merge(robust_squad, slim_elements_df[['first_name', 'second_name', 'id']], on=['first_name', 'second_name'], how='left')
+        fpl_loader.load_frame(conn, robust, 'optimal_squad_projected_points_h5_robust', schema='public')
 
-    table_name = 'optimal_squad_' + metric
-    squad = fpl.squad_optimizer(eligible_players, metric)
-    squad = pd.merge(squad, slim_elements_df[['first_name', 'second_name', 'id']], on=['first_name', 'second_name'], how='left')
-    squad.to_sql(table_name, engine, schema='public', index=False)
+    if lineup is not None:
+        lineup = pd.merge(lineup, slim_elements_df[['first_name', 'second_name', 'id']], on=['first_name', 'second_name'], how='left')
+        fpl_loader.load_frame(conn, lineup, 'optimal_lineup_projected_points_h5', schema='public')
 
+# stage timings of the run, kept for trend analysis
+if PIPELINE_METRICS_TABLE:
+    with fpl_db.connection(engine) as conn:
+        fpl_profiling.write_run_metrics(conn, PIPELINE_METRICS_TABLE)
 
-conn.close()
+fpl_db.dispose_engines()
 
 print("Data loaded to Supabase")
\ No newline at end of file
@@ -0,0 +1,69 @@
+# Shared fixtures of the optimizer tests: the recorded player pool of benchmarks/data and small hand-built pools
+
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SQUAD_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, SQUAD_DIR)
+sys.path.insert(0, os.path.join(SQUAD_DIR, 'benchmarks'))
+
+import fpl_transform
+import synthetic
+
+DATA_DIR = os.path.join(SQUAD_DIR, 'benchmarks', 'data')
+
+
+@pytest.fixture(scope='session')
+def recorded_teams():
+    """
+    Fixture of the teams of the recorded bootstrap-static payload
+    """
+    return synthetic.read_payload(os.path.join(DATA_DIR, 'bootstrap_static.json.gz'))['teams']
+
+
+@pytest.fixture(scope='session')
+def recorded_fixtures(recorded_teams):
+    """
+    Fixture of the transformed fixtures of the recorded payload
+    """
+    return fpl_transform.transform_fixtures(synthetic.read_payload(os.path.join(DATA_DIR, 'fixtures.json.gz')), recorded_teams)
+
+
+@pytest.fixture(scope='session')
+def recorded_players(recorded_fixtures, recorded_teams):
+    """
+    Fixture of the eligible players of the recorded payloads, with the projected points, as the upload script builds them
+    """
+    players = fpl_transform.transform_players(synthetic.read_payload(os.path.join(DATA_DIR, 'bootstrap_static.json.gz')))
+    players = players.join(fpl_transform.projected_points(players, recorded_fixtures, recorded_teams))
+    return players[players['news'] == ''].reset_index(drop=True)
+
+
+def small_pool(seed, per_position=(3, 7, 7, 4), num_clubs=8):
+    """
+    Function that returns a pool small enough to brute force, with few clubs so that the club cap binds
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for position, size in zip(['Goalkeeper', 'Defender', 'Midfielder', 'Forward'], per_position):
+        for _ in range(size):
+            now_cost = int(rng.integers(40, 91))
+            rows.append({'id': len(rows) + 1, 'first_name': 'First{}'.format(len(rows) + 1), 'second_name': 'Second{}'.format(len(rows) + 1),
+                         'name': 'Player{}'.format(len(rows) + 1), 'team_name': 'Club{}'.format(rng.integers(num_clubs)),
+                         'position': position, 'selected_by_percent': 1.0, 'now_cost': now_cost, 'actual_cost': now_cost / 10,
+                         'total_points': int(rng.integers(0, 250)), 'form': round(float(rng.uniform(0, 10)), 1)})
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def small_pools():
+    """
+    Fixture of a few small hand-built pools
+    """
+    return [small_pool(seed) for seed in range(5)]
@@ -0,0 +1,190 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import fpl_optimizer_functions as fpl
+import fpl_transform
+
+METRICS = ['points_per_game', 'bonus', 'total_points', 'ict_index', 'points_per_million', 'form', 'projected_points_h5',
+           'goal_contributions']
+
+
+def brute_force_values(players, opt_metric, max_per_club=None, budget=100):
+    """
+    Function that returns the values of every legal squad of a small pool, best first
+    """
+    clubs = np.eye(players['team_name'].nunique())[players['team_name'].factorize()[0]]
+    costs, values, club_counts = np.zeros(1), np.zeros(1), np.zeros((1, clubs.shape[1]))
+    for position, count in fpl.POSITION_COUNTS.items():
+        picks = np.array(list(itertools.combinations(np.flatnonzero(players['position'] == position), count)))
+        costs = (costs[:, None] + players['now_cost'].to_numpy()[picks].sum(axis=1)).ravel()
+        values = (values[:, None] + players[opt_metric].to_numpy()[picks].sum(axis=1)).ravel()
+        club_counts = (club_counts[:, None] + clubs[picks].sum(axis=1)).reshape(-1, clubs.shape[1])
+
+    legal = costs <= budget * 10
+    if max_per_club is not None:
+        legal &= club_counts.max(axis=1) <= max_per_club
+    return np.sort(values[legal])[::-1]
+
+
+def brute_force_squad(players, opt_metric, max_per_club=None, budget=100):
+    """
+    Function that returns the best value of any legal squad of a small pool, -inf when none fits
+    """
+    values = brute_force_values(players, opt_metric, max_per_club, budget)
+    return values[0] if len(values) > 0 else -np.inf
+
+
+def assert_legal(squad, max_per_club=None):
+    assert fpl.squad_is_legal(squad['position'], squad['team_name'], max_per_club)
+    assert (squad['actual_cost'] * 10).round().sum() <= 1000
+
+
+@pytest.mark.parametrize('metric', METRICS)
+def test_joint_squad_is_legal_on_recorded_pool(recorded_players, metric):
+    squad = fpl.joint_squad_optimizer(recorded_players, metric)
+    assert_legal(squad, max_per_club=3)
+
+
+def test_joint_squad_matches_brute_force(small_pools):
+    for players in small_pools:
+        for metric in ['total_points', 'form']:
+            best = brute_force_squad(players, metric, max_per_club=3)
+            if best == -np.inf:
+                with pytest.raises(ValueError):
+                    fpl.joint_squad_optimizer(players, metric)
+                continue
+            squad = fpl.joint_squad_optimizer(players, metric)
+            assert_legal(squad, max_per_club=3)
+            assert squad[metric].sum() == pytest.approx(best)
+
+
+@pytest.mark.parametrize('split_search', ['breakdown', 'convolution'])
+def test_squad_optimizer_is_legal_on_recorded_pool(recorded_players, split_search):
+    for metric in METRICS:
+        assert_legal(fpl.squad_optimizer(recorded_players, metric, split_search=split_search))
+
+
+def test_convolution_split_matches_brute_force(small_pools):
+    for players in small_pools:
+        for metric in ['total_points', 'form']:
+            best = brute_force_squad(players, metric)
+            knapsacks = fpl.position_knapsacks(players, [100] * len(fpl.POSITION_COUNTS), metric)
+            budgets, value = fpl.best_budget_split(knapsacks, 1000)
+            assert sum(budgets) <= 1000
+            assert value == pytest.approx(best)
+
+            squad = fpl.squad_optimizer(players, metric, split_search='convolution')
+            assert_legal(squad)
+            assert squad[metric].sum() == pytest.approx(best)
+
+
+@pytest.mark.parametrize('solver', ['joint', 'breakdown', 'convolution'])
+def test_squad_optimizer_many_matches_single_metric_solves(recorded_players, solver):
+    squads = fpl.squad_optimizer_many(recorded_players, METRICS, solver=solver)
+    for metric in METRICS:
+        fpl.check_squad(squads[metric], metric, max_per_club=3 if solver == 'joint' else None)
+        if solver == 'joint':
+            single = fpl.joint_squad_optimizer(recorded_players, metric)
+        else:
+            single = fpl.squad_optimizer(recorded_players, metric, split_search=solver)
+        assert squads[metric][metric].sum() == pytest.approx(single[metric].sum())
+
+
+def test_squad_cache_rebuilds_rows_from_the_current_pool(recorded_players, tmp_path):
+    cache_dir = str(tmp_path)
+    squad = fpl.squad_optimizer_many(recorded_players, ['total_points'], cache_dir=cache_dir)['total_points']
+    hits = fpl.SQUAD_CACHE_STATS['hits']
+
+    # columns the solver doesn't read come from the current pool on a hit
+    updated = recorded_players.assign(selected_by_percent=recorded_players['selected_by_percent'] + 1)
+    cached = fpl.squad_optimizer_many(updated, ['total_points'], cache_dir=cache_dir)['total_points']
+    assert fpl.SQUAD_CACHE_STATS['hits'] == hits + 1
+    assert (cached['selected_by_percent'] == squad['selected_by_percent'] + 1).all()
+    assert (cached['second_name'] == squad['second_name']).all()
+
+    # a change to what the solver reads is a miss
+    repriced = recorded_players.assign(now_cost=recorded_players['now_cost'] + 1)
+    fpl.squad_optimizer_many(repriced, ['total_points'], cache_dir=cache_dir)
+    assert fpl.SQUAD_CACHE_STATS['hits'] == hits + 1
+
+
+def test_check_squad_rejects_short_squads(recorded_players):
+    squad = fpl.joint_squad_optimizer(recorded_players, 'total_points')
+    fpl.check_squad(squad, 'total_points')
+    with pytest.raises(ValueError):
+        fpl.check_squad(squad.iloc[:12], 'total_points')
+
+
+def test_transfer_plan_keeps_legal_squads(recorded_players, recorded_fixtures, recorded_teams):
+    projections = fpl_transform.gameweek_projections(recorded_players, recorded_fixtures, recorded_teams)
+    players, rows = fpl.joint_squad_rows(recorded_players, 'total_points')
+    bank = 1000 - players['now_cost'].iloc[rows].sum()
+
+    plan = fpl.plan_transfers(recorded_players, projections, players['id'].iloc[rows].tolist(), bank)
+
+    assert len(plan) == projections.shape[1]
+    by_id = recorded_players.set_index('id')
+    for _, week in plan.iterrows():
+        squad = by_id.loc[week['squad']]
+        assert fpl.squad_is_legal(squad['position'], squad['team_name'], 3)
+        assert squad['now_cost'].sum() + week['bank'] == 1000
+        assert len(week['transfers_in']) == len(week['transfers_out']) == week['transfers']
+
+
+
+@pytest.mark.parametrize('time_budget', [fpl.TRANSFER_PLAN_TIME_BUDGET, 0])
+def test_transfer_plan_takes_no_hit_without_a_net_gain(recorded_players, recorded_fixtures, recorded_teams, time_budget):
+    projections = fpl_transform.gameweek_projections(recorded_players, recorded_fixtures, recorded_teams)
+    players, rows = fpl.joint_squad_rows(recorded_players, 'total_points')
+    bank = 1000 - players['now_cost'].iloc[rows].sum()
+    squad = players['id'].iloc[rows].tolist()
+
+    plan = fpl.plan_transfers(recorded_players, projections, squad, bank, time_budget=time_budget)
+
+    positions = recorded_players.set_index('id')['position']
+    for week, row in plan.iterrows():
+        window = projections.iloc[:, week:week+3]
+        discounts = 0.85 ** np.arange(window.shape[1])
+        kept = fpl.starting_xi_points(positions.loc[squad], window.loc[squad].to_numpy()) @ discounts
+        made = fpl.starting_xi_points(positions.loc[row['squad']], window.loc[row['squad']].to_numpy()) @ discounts
+        assert made - row['hit_cost'] >= kept - 1e-6
+        if row['hit_cost'] > 0:
+            assert made - row['hit_cost'] > kept
+        squad = row['squad']
+
+
+def ranked_squads(ranked):
+    return [squad for _, squad in ranked.groupby('squad_rank', sort=True)]
+
+
+@pytest.mark.parametrize('metric', METRICS)
+def test_topk_rank_one_is_the_optimal_squad(recorded_players, metric):
+    ranked = fpl.squad_optimizer_topk(recorded_players, metric, k=5)
+    squads = ranked_squads(ranked)
+    best = fpl.joint_squad_optimizer(recorded_players, metric)
+
+    assert set(squads[0]['second_name'] + squads[0]['first_name']) == set(best['second_name'] + best['first_name'])
+    assert squads[0]['squad_value'].iloc[0] == pytest.approx(best[metric].sum())
+    assert squads[0][metric].sum() == pytest.approx(best[metric].sum())
+    for squad in squads:
+        assert_legal(squad, max_per_club=3)
+    values = [squad['squad_value'].iloc[0] for squad in squads]
+    assert values == sorted(values, reverse=True)
+    assert len({frozenset(squad['second_name'] + squad['first_name']) for squad in squads}) == len(squads)
+
+    # without the club cap the ranking is over squad_optimizer's breakdowns
+    uncapped = ranked_squads(fpl.squad_optimizer_topk(recorded_players, metric, k=5, max_per_club=None))
+    assert_legal(uncapped[0])
+    assert uncapped[0]['squad_value'].iloc[0] == pytest.approx(fpl.squad_optimizer(recorded_players, metric)[metric].sum())
+
+
+def test_topk_matches_brute_force(small_pools):
+    for players in small_pools:
+        for metric in ['total_points', 'form']:
+            expected = brute_force_values(players, metric, max_per_club=3)[:8]
+            squads = ranked_squads(fpl.squad_optimizer_topk(players, metric, k=8))
+            for squad in squads:
+                assert_legal(squad, max_per_club=3)
+            assert [squad['squad_value'].iloc[0] for squad in squads] == pytest.approx(list(expected))